@@ -0,0 +1,71 @@
+"""invoice storage tables"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql as pg
+
+# revision identifiers, used by Alembic.
+revision = "20261018_0002"
+down_revision = "20241202_0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "invoices",
+        sa.Column("filename", sa.String(length=255), primary_key=True, nullable=False),
+        sa.Column("number", sa.String(length=128), nullable=False),
+        sa.Column("number_date", sa.String(length=128)),
+        sa.Column("number_seq", sa.Integer()),
+        sa.Column("date", sa.String(length=32), nullable=False),
+        sa.Column("recipient", sa.Text(), nullable=False),
+        sa.Column("total", sa.Float(), nullable=False),
+        sa.Column("currency", sa.String(length=32), nullable=False),
+        sa.Column("document_type", sa.String(length=32), nullable=False),
+        sa.Column("organization_id", sa.String(length=64)),
+        sa.Column("saved_at", sa.String(length=64), nullable=False),
+        sa.Column("search_text", sa.Text(), nullable=False),
+        sa.Column("data", pg.JSONB(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+    )
+    op.create_index("ix_invoices_number", "invoices", ["number"], unique=False)
+    op.create_index("ix_invoices_date", "invoices", ["date"], unique=False)
+    op.create_index("ix_invoices_recipient", "invoices", ["recipient"], unique=False)
+    op.create_index("ix_invoices_updated_at_filename", "invoices", ["updated_at", "filename"], unique=False)
+    op.create_index("ix_invoices_number_seq", "invoices", ["number_date", "number_seq"], unique=False)
+    op.create_index(
+        "ix_invoices_search",
+        "invoices",
+        [sa.text("to_tsvector('russian'::regconfig, search_text)")],
+        unique=False,
+        postgresql_using="gin",
+    )
+
+    op.create_table(
+        "invoice_number_reservations",
+        sa.Column("number", sa.String(length=128), primary_key=True, nullable=False),
+        sa.Column("number_date", sa.String(length=128), nullable=False),
+        sa.Column("number_seq", sa.Integer(), nullable=False),
+        sa.Column("expires_at", sa.DateTime(timezone=True), nullable=False),
+    )
+    op.create_index(
+        "ix_invoice_number_reservations_seq",
+        "invoice_number_reservations",
+        ["number_date", "number_seq"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_invoice_number_reservations_seq", table_name="invoice_number_reservations")
+    op.drop_table("invoice_number_reservations")
+    op.drop_index("ix_invoices_search", table_name="invoices")
+    op.drop_index("ix_invoices_number_seq", table_name="invoices")
+    op.drop_index("ix_invoices_updated_at_filename", table_name="invoices")
+    op.drop_index("ix_invoices_recipient", table_name="invoices")
+    op.drop_index("ix_invoices_date", table_name="invoices")
+    op.drop_index("ix_invoices_number", table_name="invoices")
+    op.drop_table("invoices")
@@ -0,0 +1,29 @@
+"""invoice revision history"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql as pg
+
+# revision identifiers, used by Alembic.
+revision = "20261018_0003"
+down_revision = "20261018_0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "invoice_revisions",
+        sa.Column("filename", sa.String(length=255), primary_key=True, nullable=False),
+        sa.Column("rev", sa.Integer(), primary_key=True, nullable=False),
+        sa.Column("saved_at", sa.String(length=64), nullable=False),
+        sa.Column("saved_by", sa.String(length=64)),
+        sa.Column("snapshot", pg.JSONB()),
+        sa.Column("patch", pg.JSONB()),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("invoice_revisions")
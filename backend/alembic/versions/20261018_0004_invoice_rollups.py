@@ -0,0 +1,47 @@
+"""invoice rollups"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.repositories.invoice_postgres import rollup_rows
+
+# revision identifiers, used by Alembic.
+revision = "20261018_0004"
+down_revision = "20261018_0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    rollups = op.create_table(
+        "invoice_rollups",
+        sa.Column("dimension", sa.String(length=32), primary_key=True, nullable=False),
+        sa.Column("key", sa.Text(), primary_key=True, nullable=False),
+        sa.Column("currency", sa.String(length=32), primary_key=True, nullable=False),
+        sa.Column("count", sa.Integer(), nullable=False),
+        sa.Column("total", sa.Float(), nullable=False),
+    )
+    op.create_index(
+        "ix_invoice_rollups_total", "invoice_rollups", ["dimension", sa.text("total DESC")], unique=False
+    )
+
+    # Сводки по уже загруженным инвойсам — теми же ключами, что и при записи
+    invoices = sa.table(
+        "invoices",
+        sa.column("date"),
+        sa.column("recipient"),
+        sa.column("total"),
+        sa.column("currency"),
+        sa.column("document_type"),
+    )
+    records = op.get_bind().execute(sa.select(invoices)).mappings()
+    rows = rollup_rows((record, 1) for record in records)
+    if rows:
+        op.bulk_insert(rollups, rows)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_invoice_rollups_total", table_name="invoice_rollups")
+    op.drop_table("invoice_rollups")
@@ -0,0 +1,117 @@
+"""invoice items and item catalog"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql as pg
+
+from app.repositories.invoice_postgres import item_rows
+
+# revision identifiers, used by Alembic.
+revision = "20261018_0005"
+down_revision = "20261018_0004"
+branch_labels = None
+depends_on = None
+
+# Колонки позиции, общие для invoice_items и item_catalog
+ITEM_COLUMNS = (
+    "model", "name", "description", "price", "unit", "hs_code", "country", "reducer_specs",
+    "currency", "date", "updated_at",
+)
+
+
+def _item_columns() -> list[sa.Column]:
+    return [
+        sa.Column("model", sa.Text(), nullable=False),
+        sa.Column("name", sa.Text(), nullable=False),
+        sa.Column("description", sa.Text(), nullable=False),
+        sa.Column("price", sa.Float(), nullable=False),
+        sa.Column("unit", sa.Text(), nullable=False),
+        sa.Column("hs_code", sa.Text(), nullable=False),
+        sa.Column("country", sa.Text(), nullable=False),
+        sa.Column("reducer_specs", pg.JSONB(), nullable=False),
+        sa.Column("currency", sa.String(length=32), nullable=False),
+        sa.Column("date", sa.String(length=32), nullable=False),
+        sa.Column("updated_at", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+    ]
+
+
+def upgrade() -> None:
+    items = op.create_table(
+        "invoice_items",
+        sa.Column("filename", sa.String(length=255), primary_key=True, nullable=False),
+        sa.Column("position", sa.Integer(), primary_key=True, nullable=False),
+        sa.Column("item_key", sa.Text(), nullable=False),
+        sa.Column("model_key", sa.Text(), nullable=False),
+        sa.Column("description_key", sa.Text(), nullable=False),
+        sa.Column("quantity", sa.Float(), nullable=False),
+        *_item_columns(),
+    )
+    op.create_index(
+        "ix_invoice_items_key",
+        "invoice_items",
+        ["item_key", sa.text("date DESC"), sa.text("updated_at DESC")],
+        unique=False,
+    )
+
+    op.create_table(
+        "item_catalog",
+        sa.Column("item_key", sa.Text(), primary_key=True, nullable=False),
+        sa.Column("model_key", sa.Text(collation="C"), nullable=False),
+        sa.Column("name_key", sa.Text(collation="C"), nullable=False),
+        sa.Column("description_key", sa.Text(collation="C"), nullable=False),
+        sa.Column("uses", sa.Integer(), nullable=False),
+        *_item_columns(),
+        sa.Column("filename", sa.String(length=255), nullable=False),
+    )
+    op.create_index("ix_item_catalog_model_key", "item_catalog", ["model_key"], unique=False)
+    op.create_index("ix_item_catalog_name_key", "item_catalog", ["name_key"], unique=False)
+    op.create_index("ix_item_catalog_description_key", "item_catalog", ["description_key"], unique=False)
+
+    # Позиции уже загруженных инвойсов — теми же ключами, что и при записи
+    invoices = sa.table(
+        "invoices",
+        sa.column("filename"),
+        sa.column("date"),
+        sa.column("currency"),
+        sa.column("data", pg.JSONB()),
+        sa.column("updated_at"),
+    )
+    batch = []
+    records = op.get_bind().execution_options(yield_per=500).execute(sa.select(invoices)).mappings()
+    for record in records:
+        batch.extend({**row, "updated_at": record["updated_at"]} for row in item_rows(record))
+        if len(batch) >= 1000:
+            op.bulk_insert(items, batch)
+            batch = []
+    if batch:
+        op.bulk_insert(items, batch)
+
+    columns = ", ".join(ITEM_COLUMNS)
+    op.execute(
+        f"""
+        INSERT INTO item_catalog (
+            item_key, model_key, name_key, description_key, uses, {columns}, filename
+        )
+        SELECT DISTINCT ON (item_key)
+            item_key,
+            split_part(item_key, chr(31), 1),
+            split_part(item_key, chr(31), 2),
+            split_part(item_key, chr(31), 3),
+            count(*) OVER (PARTITION BY item_key),
+            {columns},
+            filename
+        FROM invoice_items
+        ORDER BY item_key, date DESC, updated_at DESC
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_item_catalog_description_key", table_name="item_catalog")
+    op.drop_index("ix_item_catalog_name_key", table_name="item_catalog")
+    op.drop_index("ix_item_catalog_model_key", table_name="item_catalog")
+    op.drop_table("item_catalog")
+    op.drop_index("ix_invoice_items_key", table_name="invoice_items")
+    op.drop_table("invoice_items")
@@ -0,0 +1,32 @@
+"""invoice item indexes for price history"""
+
+from __future__ import annotations
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "20261018_0006"
+down_revision = "20261018_0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_invoice_items_model",
+        "invoice_items",
+        ["model_key", sa.text("date DESC"), sa.text("updated_at DESC")],
+        unique=False,
+    )
+    op.create_index(
+        "ix_invoice_items_description",
+        "invoice_items",
+        ["description_key", sa.text("date DESC"), sa.text("updated_at DESC")],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_invoice_items_description", table_name="invoice_items")
+    op.drop_index("ix_invoice_items_model", table_name="invoice_items")
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends
 
-from app.api.routes import auth, device, health, invoices, external
+from app.api.routes import auth, device, health, invoices, external, metrics, organizations
 from app.parsing.router import router as parsing_router
 from app.dependencies.auth import session_guard
 
@@ -23,6 +23,14 @@ api_v1_router.include_router(
     tags=["external"],
     dependencies=[Depends(session_guard)],
 )
+api_v1_router.include_router(
+    metrics.router,
+    dependencies=[Depends(session_guard)],
+)
+api_v1_router.include_router(
+    organizations.router,
+    dependencies=[Depends(session_guard)],
+)
 api_v1_router.include_router(
     parsing_router,
     prefix="/parsing",
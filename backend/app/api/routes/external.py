@@ -1,14 +1,11 @@
 from fastapi import APIRouter, Depends, Response, Body, Query
 from typing import Dict, Any, List
-from app.services.pdf_service import PdfService
+from app.services.pdf_service import PdfService, get_pdf_service
 from app.services.dadata_service import DaDataService
 from app.schemas.invoice import Invoice
 
 router = APIRouter()
 
-def get_pdf_service() -> PdfService:
-    return PdfService()
-
 def get_dadata_service() -> DaDataService:
     return DaDataService()
 
@@ -1,77 +1,286 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Response
-from typing import List, Dict
+import asyncio
+from datetime import datetime
+from fastapi import APIRouter, Depends, File, Header, HTTPException, status, Request, Response, Query, UploadFile
+from fastapi.responses import FileResponse, StreamingResponse
+from typing import Annotated, List, Dict, Optional
+from app.core.config import get_settings
+from app.services.invoice_export import InvoiceExport
+from app.services.invoice_import import read_records
 from app.services.invoice_service import InvoiceService
-from app.services.pdf_service import PdfService
-from app.schemas.invoice import Invoice
+from app.services.pdf_service import PdfService, get_pdf_service
+from app.schemas.invoice import (
+    Invoice,
+    InvoiceCatalogItem,
+    InvoiceExportRequest,
+    InvoiceImportResult,
+    InvoiceListQuery,
+    InvoicePriceHistory,
+    InvoiceRevision,
+    InvoiceStats,
+)
+from app.utils.etag import none_match
+from app.utils.jsonio import FastJSONResponse
 
 router = APIRouter()
 
 def get_invoice_service() -> InvoiceService:
     return InvoiceService()
 
-def get_pdf_service() -> PdfService:
-    return PdfService()
+def not_modified(request: Request, etag: Optional[str]) -> Optional[Response]:
+    """304 response if the client's If-None-Match matches the current ETag."""
+    if none_match(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return None
+
+def set_etag(response: Response, etag: Optional[str]) -> None:
+    if etag:
+        response.headers["ETag"] = etag
+        # Cached copies must be revalidated, which costs a 304 at most
+        response.headers["Cache-Control"] = "no-cache"
 
 @router.get("/", response_model=List[Dict])
 async def list_invoices(
+    request: Request,
+    query: Annotated[InvoiceListQuery, Query()],
+    service: InvoiceService = Depends(get_invoice_service)
+):
+    """
+    Get list of invoices with basic metadata, newest first.
+    Without `limit` the whole (filtered) list is returned; with `limit` the
+    cursor of the next page is sent in the `X-Next-Cursor` header.
+    The ETag follows the index version, so `If-None-Match` gets a 304 until
+    any invoice is saved or deleted.
+    """
+    etag = await service.list_etag(request.url.query)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    entries, next_cursor = await service.list_invoices_page(query)
+    # Entries come from the index as plain dicts: serialized directly, without
+    # response_model validation and jsonable_encoder walking every entry
+    result = FastJSONResponse(entries)
+    if next_cursor:
+        result.headers["X-Next-Cursor"] = next_cursor
+    set_etag(result, etag)
+    return result
+
+@router.get("/search", response_model=List[Dict])
+async def search_invoices(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(50, ge=1, le=500),
+    service: InvoiceService = Depends(get_invoice_service)
+):
+    """
+    Full-text search over the whole archive, ordered by relevance.
+    """
+    return await service.search_invoices(q, limit)
+
+@router.get("/stats", response_model=InvoiceStats)
+async def get_invoice_stats(
+    recipients: int = Query(20, ge=1, le=1000),
+    service: InvoiceService = Depends(get_invoice_service)
+):
+    """
+    Totals by month, recipient (top `recipients` by total), currency and document type.
+    """
+    return await service.get_stats(recipients)
+
+@router.get("/items/autocomplete", response_model=List[InvoiceCatalogItem])
+async def autocomplete_items(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(20, ge=1, le=100),
     service: InvoiceService = Depends(get_invoice_service)
 ):
     """
-    Get list of all invoices with basic metadata.
+    Line items used in earlier invoices whose model, name or description starts
+    with `q` (case-insensitive), with the most recent price, unit, HS code,
+    country and reducer specs. Served from the catalog kept in the archive index.
     """
-    return service.list_invoices()
+    return await service.autocomplete_items(q, limit)
+
+@router.get("/items/price-history", response_model=InvoicePriceHistory)
+async def get_item_price_history(
+    model: Optional[str] = None,
+    description: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    service: InvoiceService = Depends(get_invoice_service)
+):
+    """
+    Prices charged for a `model` and/or `description` (exact match, ignoring case
+    and extra spaces): the `limit` most recent lines, newest first, with invoice
+    date, number, recipient and currency, and min/avg/max per currency.
+    """
+    return await service.get_price_history(model, description, limit)
 
 @router.get("/next-number")
 async def get_next_number(
     date: str = None,
+    reserve: bool = False,
     service: InvoiceService = Depends(get_invoice_service)
 ):
     """
     Generate next sequence number for the given date.
+    With `reserve=true` the number is held for a short time so that two users
+    creating invoices concurrently do not get the same number; release it with
+    `DELETE /next-number/{number}` if the invoice is not saved.
     """
-    number = service.get_next_number(date)
+    number = await service.get_next_number(date, reserve=reserve)
     return {"number": number}
 
+@router.delete("/next-number/{number}", response_model=Dict)
+async def release_next_number(
+    number: str,
+    service: InvoiceService = Depends(get_invoice_service)
+):
+    """
+    Release a number reserved by `GET /next-number?reserve=true`.
+    """
+    return await service.release_number(number)
+
+@router.post("/export")
+async def export_invoices(
+    export_request: InvoiceExportRequest,
+    service: InvoiceService = Depends(get_invoice_service),
+    pdf_service: PdfService = Depends(get_pdf_service)
+):
+    """
+    Stream a ZIP with `json/<filename>` and `pdf/<name>.pdf` for the selected invoices.
+    PDFs are rendered a few at a time while the archive is being sent; failures
+    are listed in `errors.json` inside the archive.
+    """
+    filenames = await service.resolve_export(export_request)
+    export = InvoiceExport(
+        service,
+        pdf_service,
+        filenames,
+        include_json=export_request.include_json,
+        include_pdf=export_request.include_pdf,
+        concurrency=get_settings().invoice_export_pdf_concurrency,
+    )
+    archive_name = f"invoices_{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}.zip"
+    return StreamingResponse(
+        export.stream(),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={archive_name}"}
+    )
+
+@router.post("/import", response_model=InvoiceImportResult)
+async def import_invoices(
+    file: UploadFile = File(...),
+    overwrite: bool = False,
+    dry_run: bool = False,
+    service: InvoiceService = Depends(get_invoice_service)
+):
+    """
+    Bulk import from NDJSON (one invoice per line) or a ZIP of JSON files.
+    Every record is validated; errors are reported per record (`source` is the
+    line number or the ZIP entry) and do not abort the import.
+    """
+    records = await asyncio.to_thread(read_records, file.file)
+    if not records:
+        raise HTTPException(status_code=400, detail="No invoices found in the upload")
+    return await service.import_invoices(records, overwrite=overwrite, dry_run=dry_run)
+
 @router.get("/{filename}/pdf")
 async def get_invoice_pdf(
     filename: str,
+    request: Request,
     service: InvoiceService = Depends(get_invoice_service),
     pdf_service: PdfService = Depends(get_pdf_service)
 ):
     """
     Generate and download PDF for an existing invoice.
+    The ETag covers the invoice version and the PDF template version.
     """
-    invoice = service.get_invoice(filename)
+    etag = await service.invoice_etag(filename, "pdf", pdf_service.template_version())
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    invoice = await service.get_invoice(filename)
     data = invoice.model_dump(by_alias=True, exclude_none=False)  # Не исключаем None/пустые строки
     pdf_bytes = await pdf_service.generate_pdf(data)
     
     download_filename = f"Invoice_{invoice.number}.pdf"
     
-    return Response(
+    response = Response(
         content=pdf_bytes,
         media_type="application/pdf",
         headers={"Content-Disposition": f"attachment; filename={download_filename}"}
     )
+    set_etag(response, etag)
+    return response
+
+@router.get("/{filename}/revisions", response_model=List[InvoiceRevision])
+async def list_invoice_revisions(
+    filename: str,
+    service: InvoiceService = Depends(get_invoice_service)
+):
+    """
+    Revision history of an invoice, oldest first.
+    Edits made outside the API show up as `external` revisions on the next save.
+    """
+    return await service.list_revisions(filename)
+
+@router.get("/{filename}/revisions/{rev}", response_model=Dict)
+async def get_invoice_revision(
+    filename: str,
+    rev: int,
+    service: InvoiceService = Depends(get_invoice_service)
+):
+    """
+    Invoice data as of a revision, rebuilt from the nearest full snapshot
+    and the patches after it.
+    """
+    return await service.get_revision(filename, rev)
 
 @router.get("/{filename}", response_model=Invoice)
 async def get_invoice(
     filename: str,
+    request: Request,
     service: InvoiceService = Depends(get_invoice_service)
 ):
     """
     Get full invoice data by filename.
+    `If-None-Match` with the current ETag returns 304 without reading the file.
+    Files written by this service are sent as stored; legacy files are
+    normalized to that format on first read.
     """
-    return service.get_invoice(filename)
+    etag = await service.invoice_etag(filename)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+    path = await service.get_invoice_file(filename)
+    if path is not None:
+        # Stored by save_invoice: sent as is (pathsend/sendfile where the server supports it)
+        result = FileResponse(path, media_type="application/json")
+        # A legacy file may have just been normalized, i.e. changed version
+        etag = await service.invoice_etag(filename)
+    else:
+        # Serialized by pydantic-core in one pass instead of re-validating through
+        # response_model; same shape as the stored files (no null fields)
+        invoice = await service.get_invoice(filename)
+        result = Response(
+            content=invoice.model_dump_json(by_alias=True, exclude_none=True),
+            media_type="application/json",
+        )
+    set_etag(result, etag)
+    return result
 
 @router.post("/", response_model=Dict)
 async def save_invoice(
     invoice: Invoice,
+    response: Response,
+    if_match: Optional[str] = Header(None),
     service: InvoiceService = Depends(get_invoice_service)
 ):
     """
     Save or update an invoice.
+    With `If-Match` (the ETag from GET) the save fails with 412 if the
+    invoice was changed since; the new ETag is returned in the `ETag` header.
     """
-    return service.save_invoice(invoice)
+    result = await service.save_invoice(invoice, if_match=if_match)
+    set_etag(response, await service.invoice_etag(result["filename"]))
+    return result
 
 
 @router.delete("/{filename}", response_model=Dict)
@@ -82,4 +291,4 @@ async def delete_invoice(
     """
     Delete an invoice by filename.
     """
-    return service.delete_invoice(filename)
+    return await service.delete_invoice(filename)
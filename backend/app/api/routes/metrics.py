@@ -0,0 +1,17 @@
+import asyncio
+from typing import Any
+
+from fastapi import APIRouter
+
+from app.services.invoice_service import get_invoice_cache
+from app.services.pdf_cache import get_pdf_cache
+
+router = APIRouter(tags=["metrics"], prefix="/metrics")
+
+
+@router.get("", summary="Внутренние метрики процесса")
+async def metrics() -> dict[str, Any]:
+    return {
+        "invoice_cache": get_invoice_cache().stats(),
+        "pdf_cache": await asyncio.to_thread(get_pdf_cache().stats),
+    }
@@ -0,0 +1,18 @@
+from typing import List
+
+from fastapi import APIRouter, Depends
+
+from app.schemas.organization import Organization
+from app.services.organizations import OrganizationRegistry, get_organization_registry
+
+router = APIRouter(tags=["organizations"], prefix="/organizations")
+
+
+@router.get("", response_model=List[Organization], summary="Организации для КП")
+async def list_organizations(
+    registry: OrganizationRegistry = Depends(get_organization_registry),
+) -> List[dict]:
+    """
+    Organizations from js/organizations.js, the same cached copy the PDF renderer uses.
+    """
+    return registry.list()
@@ -0,0 +1,390 @@
+"""CLI утилита для обслуживания архива инвойсов."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+from datetime import date
+from typing import Optional
+
+import typer
+from sqlalchemy import select
+
+from app.core.config import get_settings
+from app.db.session import AsyncSessionFactory
+from app.models.invoice import InvoiceRecord
+from app.repositories.invoice import get_invoice_repository
+from app.repositories.invoice_postgres import delete_records, lock_invoices, record_values, upsert_records
+from app.services.invoice_import import read_records, shutdown_validation_pool
+from app.services.invoice_index import InvoiceIndex, default_index_path, scan_archive, shard_dir, shard_dirs
+from app.services.invoice_packs import (
+    PACK_DIR,
+    PACK_SUFFIX,
+    PackError,
+    open_pack,
+    pack_names,
+    packed_path,
+    read_archive_file,
+    remove_from_pack,
+    scan_packs,
+    write_pack,
+)
+from app.utils import jsonio
+
+app = typer.Typer(help="Обслуживание архива инвойсов KP")
+
+
+@app.callback()
+def main() -> None:
+    """Обслуживание архива инвойсов KP."""
+
+
+def _archive_files(storage_path: str, packed: bool = False) -> dict[str, str]:
+    """Файлы архива обеих раскладок (и паков, если ``packed``): имя -> путь относительно архива."""
+    files = {**scan_packs(storage_path), **scan_archive(storage_path)} if packed else scan_archive(storage_path)
+    return {name: rel_path for name, (rel_path, _) in sorted(files.items())}
+
+
+def _open_index(storage_path: str) -> InvoiceIndex:
+    settings = get_settings()
+    return InvoiceIndex(storage_path, settings.invoice_index_path or default_index_path(storage_path))
+
+
+@app.command(name="sync-postgres")
+def sync_postgres(
+    storage_path: Optional[str] = typer.Option(None, "--path", help="Директория архива (по умолчанию INVOICE_STORAGE_PATH)"),
+    batch_size: int = typer.Option(500, "--batch-size", help="Сколько инвойсов записывать за одну транзакцию"),
+    prune: bool = typer.Option(False, "--prune", help="Удалить из Postgres инвойсы, которых нет в архиве"),
+) -> None:
+    """Перенести (или досинхронизировать) JSON-архив в Postgres.
+
+    Команда идемпотентна: существующие записи обновляются, её можно запускать
+    повторно до переключения INVOICE_STORAGE_BACKEND=postgres.
+    """
+    asyncio.run(_sync_postgres(storage_path or get_settings().invoice_storage_path, batch_size, prune))
+
+
+async def _sync_postgres(storage_path: str, batch_size: int, prune: bool) -> None:
+    files = _archive_files(storage_path, packed=True)
+    filenames = list(files)
+    typer.echo(f"📂 Файлов в архиве: {len(filenames)}")
+
+    synced = 0
+    skipped = 0
+    for start in range(0, len(filenames), batch_size):
+        rows = []
+        for filename in filenames[start:start + batch_size]:
+            try:
+                data = jsonio.loads(read_archive_file(storage_path, files[filename]))
+            except (ValueError, OSError) as e:
+                typer.echo(f"⚠️  Пропущен {filename}: {e}", err=True)
+                skipped += 1
+                continue
+            if not isinstance(data, dict):
+                skipped += 1
+                continue
+            rows.append(record_values(filename, data))
+        if not rows:
+            continue
+
+        # Ревизии не пишутся, но сводки обновляются вместе с записями
+        async with AsyncSessionFactory() as session, session.begin():
+            await lock_invoices(session, [row["filename"] for row in rows])
+            await upsert_records(session, rows)
+        synced += len(rows)
+        typer.echo(f"   ... {synced} / {len(filenames)}")
+
+    pruned = 0
+    if prune:
+        async with AsyncSessionFactory() as session, session.begin():
+            existing = set((await session.execute(select(InvoiceRecord.filename))).scalars())
+            missing = sorted(existing - set(filenames))
+            for start in range(0, len(missing), batch_size):
+                await lock_invoices(session, missing[start:start + batch_size])
+                await delete_records(session, missing[start:start + batch_size])
+            pruned = len(missing)
+
+    typer.echo(f"✅ Синхронизировано: {synced}, пропущено: {skipped}, удалено: {pruned}")
+
+
+@app.command()
+def shard(
+    storage_path: Optional[str] = typer.Option(None, "--path", help="Директория архива (по умолчанию INVOICE_STORAGE_PATH)"),
+    to_flat: bool = typer.Option(False, "--to-flat", help="Вернуть файлы из YYYY/MM/ в корень архива"),
+    limit: int = typer.Option(0, "--limit", help="Перенести не больше N файлов за запуск (0 — все)"),
+    dry_run: bool = typer.Option(False, "--dry-run", help="Только показать, что будет перенесено"),
+) -> None:
+    """Разложить архив по каталогам YYYY/MM/ (по дате инвойса) или вернуть обратно.
+
+    Каждый файл переносится атомарным rename с сохранением mtime, и запись индекса
+    сразу обновляется, поэтому API продолжает работать во время переноса.
+    Команду можно прервать и запустить снова: перенесённые файлы пропускаются.
+    Legacy PHP-эндпоинты видят только корень архива — раскладывать его стоит
+    после их отключения, вместе с INVOICE_STORAGE_LAYOUT=sharded.
+    """
+    storage_path = storage_path or get_settings().invoice_storage_path
+    index = _open_index(storage_path)
+    try:
+        _shard_archive(storage_path, index, to_flat, limit, dry_run)
+    finally:
+        index.close()
+
+
+def _shard_target(storage_path: str, rel_path: str, to_flat: bool) -> str:
+    filename = os.path.basename(rel_path)
+    if to_flat:
+        return filename
+    try:
+        data = jsonio.load_file(os.path.join(storage_path, rel_path))
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        data = {}
+    if not isinstance(data, dict):
+        data = {}
+    return f"{shard_dir(data, os.stat(os.path.join(storage_path, rel_path)).st_mtime)}/{filename}"
+
+
+def _shard_archive(storage_path: str, index: InvoiceIndex, to_flat: bool, limit: int, dry_run: bool) -> dict[str, int]:
+    files = _archive_files(storage_path)
+    # Уже на месте: в корне для --to-flat, в шарде для прямого переноса
+    pending = [rel_path for rel_path in files.values() if ("/" in rel_path) == to_flat]
+    typer.echo(f"📂 Файлов в архиве: {len(files)}, к переносу: {len(pending)}")
+    if limit:
+        pending = pending[:limit]
+
+    moved = 0
+    skipped = 0
+    for rel_path in pending:
+        try:
+            target = _shard_target(storage_path, rel_path, to_flat)
+        except OSError as e:
+            # Файл удалили или переписали во время переноса
+            typer.echo(f"⚠️  Пропущен {rel_path}: {e}", err=True)
+            skipped += 1
+            continue
+        target_path = os.path.join(storage_path, target)
+        if os.path.exists(target_path):
+            typer.echo(f"⚠️  Пропущен {rel_path}: {target} уже существует", err=True)
+            skipped += 1
+            continue
+        if dry_run:
+            typer.echo(f"   {rel_path} -> {target}")
+            moved += 1
+            continue
+        try:
+            os.makedirs(os.path.dirname(target_path), mode=0o777, exist_ok=True)
+            os.rename(os.path.join(storage_path, rel_path), target_path)
+        except OSError as e:
+            typer.echo(f"⚠️  Пропущен {rel_path}: {e}", err=True)
+            skipped += 1
+            continue
+        index.refresh(target)
+        moved += 1
+        if moved % 500 == 0:
+            typer.echo(f"   ... {moved} / {len(pending)}")
+
+    if to_flat and not dry_run:
+        # Пустые каталоги шардов больше не нужны
+        for rel_dir in reversed(shard_dirs(storage_path)):
+            for directory in (rel_dir, os.path.dirname(rel_dir)):
+                try:
+                    os.rmdir(os.path.join(storage_path, directory))
+                except OSError:
+                    pass
+
+    typer.echo(f"✅ Перенесено: {moved}, пропущено: {skipped}")
+    return {"moved": moved, "skipped": skipped}
+
+
+@app.command()
+def pack(
+    storage_path: Optional[str] = typer.Option(None, "--path", help="Директория архива (по умолчанию INVOICE_STORAGE_PATH)"),
+    older_than: int = typer.Option(12, "--older-than", min=1, help="Упаковать инвойсы старше N месяцев (по дате инвойса)"),
+    limit: int = typer.Option(0, "--limit", help="Упаковать не больше N файлов за запуск (0 — все)"),
+    dry_run: bool = typer.Option(False, "--dry-run", help="Только показать, сколько файлов будет упаковано"),
+) -> None:
+    """Упаковать старые инвойсы в сжатые паки (<архив>/.packs/, пак на год).
+
+    Каждый инвойс сжимается отдельно со словарём пака, поэтому API читает его
+    одним seek и распаковкой; список, поиск и статистика по-прежнему их включают.
+    Пак пишется атомарно, затем записи индекса переводятся на него, и только потом
+    удаляются исходные файлы — если их не изменили за время упаковки. Команду можно
+    прервать и запустить снова. Сохранение инвойса через API возвращает его в архив.
+    """
+    storage_path = storage_path or get_settings().invoice_storage_path
+    index = _open_index(storage_path)
+    try:
+        _pack_archive(storage_path, index, _months_ago(date.today(), older_than), limit, dry_run)
+    finally:
+        index.close()
+
+
+def _months_ago(today: date, months: int) -> str:
+    """Месяц ``YYYY/MM`` за ``months`` месяцев до ``today`` (в формате ``shard_dir``)."""
+    month = today.year * 12 + today.month - 1 - months
+    return f"{month // 12:04d}/{month % 12 + 1:02d}"
+
+
+def _pack_archive(storage_path: str, index: InvoiceIndex, before: str, limit: int, dry_run: bool) -> dict[str, int]:
+    """Пакует файлы с месяцем (``shard_dir``) раньше ``before``."""
+    files = _archive_files(storage_path)
+    by_year: dict[str, list[tuple[str, str, bytes, os.stat_result]]] = {}
+    selected = 0
+    skipped = 0
+    for filename, rel_path in files.items():
+        if limit and selected >= limit:
+            break
+        file_path = os.path.join(storage_path, rel_path)
+        try:
+            st = os.stat(file_path)
+            with open(file_path, "rb") as f:
+                content = f.read()
+            data = jsonio.loads(content)
+        except (ValueError, OSError):
+            skipped += 1  # Битые файлы остаются в архиве как есть
+            continue
+        if not isinstance(data, dict):
+            skipped += 1
+            continue
+        month = shard_dir(data, st.st_mtime)
+        if month >= before:
+            continue
+        by_year.setdefault(month[:4], []).append((filename, rel_path, content, st))
+        selected += 1
+    typer.echo(f"📂 Файлов в архиве: {len(files)}, к упаковке (до {before}): {selected}")
+
+    packed = 0
+    for year, entries in sorted(by_year.items()):
+        name = f"{year}_{time.strftime('%Y%m%d-%H%M%S')}{PACK_SUFFIX}"
+        if dry_run:
+            typer.echo(f"   {year}: {len(entries)} -> {PACK_DIR}/{name}")
+            continue
+        table = write_pack(
+            os.path.join(storage_path, PACK_DIR, name),
+            [(filename, content, st.st_mtime_ns) for filename, _, content, st in entries],
+        )
+        index.relocate({filename: packed_path(name, filename) for filename, *_ in entries})
+
+        changed = []
+        for filename, rel_path, _, st in entries:
+            file_path = os.path.join(storage_path, rel_path)
+            try:
+                current = os.stat(file_path)
+                if (current.st_mtime_ns, current.st_size) == (st.st_mtime_ns, st.st_size):
+                    os.remove(file_path)
+                    continue
+            except FileNotFoundError:
+                pass  # Удалён или уже пересохранён через API
+            changed.append((filename, rel_path))
+        for filename, rel_path in changed:
+            # Файл изменили во время упаковки: в паке его копия устарела
+            with index.transaction():
+                remove_from_pack(storage_path, packed_path(name, filename))
+            index.refresh(rel_path)
+        packed += len(table) - len(changed)
+        typer.echo(f"   {year}: {len(table) - len(changed)} -> {PACK_DIR}/{name}")
+
+    typer.echo(f"✅ Упаковано: {packed}, пропущено: {skipped}")
+    return {"packed": packed, "skipped": skipped}
+
+
+@app.command()
+def unpack(
+    storage_path: Optional[str] = typer.Option(None, "--path", help="Директория архива (по умолчанию INVOICE_STORAGE_PATH)"),
+) -> None:
+    """Вернуть инвойсы из паков обычными файлами (по INVOICE_STORAGE_LAYOUT) и удалить паки.
+
+    Файлы получают прежнюю дату изменения. Инвойсы, которые уже есть в архиве
+    обычными файлами, не восстанавливаются.
+    """
+    storage_path = storage_path or get_settings().invoice_storage_path
+    index = _open_index(storage_path)
+    try:
+        _unpack_archive(storage_path, index, get_settings().invoice_storage_layout)
+    finally:
+        index.close()
+
+
+def _unpack_archive(storage_path: str, index: InvoiceIndex, layout: str) -> int:
+    loose = scan_archive(storage_path)
+    restored = 0
+    # Новые паки первыми: инвойс, упакованный дважды, восстанавливается из последнего
+    for name in reversed(pack_names(storage_path)):
+        pack_path = os.path.join(storage_path, PACK_DIR, name)
+        try:
+            reader = open_pack(pack_path)
+        except (OSError, PackError) as e:
+            typer.echo(f"⚠️  Пропущен {name}: {e}", err=True)
+            continue
+        for filename, entry in reader.entries.items():
+            if filename in loose:
+                continue
+            content = reader.read(filename)
+            rel_dir = ""
+            if layout == "sharded":
+                try:
+                    data = jsonio.loads(content)
+                except ValueError:
+                    data = {}
+                rel_dir = shard_dir(data if isinstance(data, dict) else {}, entry.mtime_ns / 1e9)
+            file_path = os.path.join(storage_path, rel_dir, filename)
+            temp_path = f"{file_path}.tmp"
+            os.makedirs(os.path.dirname(file_path), mode=0o777, exist_ok=True)
+            with open(temp_path, "wb") as f:
+                f.write(content)
+            os.chmod(temp_path, 0o666)
+            os.utime(temp_path, ns=(entry.mtime_ns, entry.mtime_ns))
+            os.replace(temp_path, file_path)
+            rel_path = os.path.relpath(file_path, storage_path)
+            loose[filename] = (rel_path, None)
+            # mtime и размер те же: индекс только меняет путь
+            index.refresh(rel_path)
+            restored += 1
+        os.remove(pack_path)
+        typer.echo(f"   {name}: {len(reader.entries)}")
+    typer.echo(f"✅ Восстановлено: {restored}")
+    return restored
+
+
+@app.command(name="import")
+def import_invoices(
+    source: str = typer.Argument(..., help="NDJSON-файл (инвойс на строку) или ZIP с JSON-файлами"),
+    overwrite: bool = typer.Option(False, "--overwrite", help="Перезаписывать инвойсы с существующими именами файлов"),
+    dry_run: bool = typer.Option(False, "--dry-run", help="Только проверить записи, ничего не сохранять"),
+) -> None:
+    """Массовый импорт инвойсов в хранилище INVOICE_STORAGE_BACKEND.
+
+    Записи валидируются параллельно в нескольких процессах, ошибки выводятся
+    по каждой записи и не прерывают импорт.
+    """
+    try:
+        with open(source, "rb") as f:
+            records = read_records(f)
+    except OSError as e:
+        typer.echo(f"❌ {e}", err=True)
+        raise typer.Exit(code=1)
+    typer.echo(f"📄 Записей: {len(records)}")
+    result = asyncio.run(_import_invoices(records, overwrite, dry_run))
+
+    for error in result.errors:
+        typer.echo(f"⚠️  {error.source}{f' ({error.filename})' if error.filename else ''}: {error.error}", err=True)
+    prefix = "Проверено" if dry_run else "Импортировано"
+    typer.echo(f"✅ {prefix}: {result.imported}, с ошибками: {result.failed}")
+    if result.failed:
+        raise typer.Exit(code=1)
+
+
+async def _import_invoices(records, overwrite: bool, dry_run: bool):
+    from app.services.invoice_service import InvoiceService
+
+    repository = get_invoice_repository()
+    try:
+        return await InvoiceService(repository).import_invoices(records, overwrite=overwrite, dry_run=dry_run)
+    finally:
+        await repository.shutdown()
+        shutdown_validation_pool()
+
+
+if __name__ == "__main__":
+    app()
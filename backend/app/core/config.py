@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from functools import lru_cache
-from typing import List
+from typing import List, Literal
 
 from pydantic import AnyHttpUrl, Field, field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -51,7 +51,55 @@ class Settings(BaseSettings):
         default="/var/www/kp/@archiv 2025",
         alias="INVOICE_STORAGE_PATH"
     )
-    
+    # Хранилище инвойсов: "file" — JSON-файлы архива, "postgres" — JSONB в DATABASE_URL
+    invoice_storage_backend: Literal["file", "postgres"] = Field(
+        default="file",
+        alias="INVOICE_STORAGE_BACKEND",
+    )
+    # Раскладка новых файлов архива: "flat" — все в одном каталоге (его читают PHP-эндпоинты),
+    # "sharded" — по подкаталогам YYYY/MM. Читаются обе раскладки; перенос — `invoices shard`
+    invoice_storage_layout: Literal["flat", "sharded"] = Field(
+        default="flat",
+        alias="INVOICE_STORAGE_LAYOUT",
+    )
+    # SQLite-индекс архива; по умолчанию <INVOICE_STORAGE_PATH>/.index/invoices.sqlite3
+    invoice_index_path: str | None = Field(default=None, alias="INVOICE_INDEX_PATH")
+    # Размер пула потоков для блокирующего ввода-вывода файлового архива
+    invoice_io_concurrency: int = Field(default=8, ge=1, alias="INVOICE_IO_CONCURRENCY")
+    # Следить за изменениями архива со стороны PHP (inotify, иначе опрос каталога)
+    invoice_watch_archive: bool = Field(default=True, alias="INVOICE_WATCH_ARCHIVE")
+    # Период опроса каталога, если inotify недоступен, секунд
+    invoice_watch_poll_interval: float = Field(default=5.0, gt=0, alias="INVOICE_WATCH_POLL_INTERVAL")
+    # Сколько провалидированных инвойсов держать в памяти (0 — без кэша)
+    invoice_cache_size: int = Field(default=512, ge=0, alias="INVOICE_CACHE_SIZE")
+    # Сколько PDF рендерится одновременно при выгрузке в ZIP и сколько инвойсов в одной выгрузке
+    invoice_export_pdf_concurrency: int = Field(default=3, ge=1, alias="INVOICE_EXPORT_PDF_CONCURRENCY")
+    invoice_export_max_items: int = Field(default=2000, ge=1, alias="INVOICE_EXPORT_MAX_ITEMS")
+    # Процессов для валидации при массовом импорте (по умолчанию — по числу CPU)
+    invoice_import_workers: int | None = Field(default=None, ge=1, alias="INVOICE_IMPORT_WORKERS")
+    # Пул браузеров Chromium для PDF: сколько браузеров и страниц (рендеров) на каждый
+    pdf_browser_pool_size: int = Field(default=2, ge=1, alias="PDF_BROWSER_POOL_SIZE")
+    pdf_pages_per_browser: int = Field(default=4, ge=1, alias="PDF_PAGES_PER_BROWSER")
+    # Перезапускать браузер после N рендеров или когда его процессы заняли больше N МБ (0 — не ограничивать)
+    pdf_browser_max_renders: int = Field(default=1000, ge=0, alias="PDF_BROWSER_MAX_RENDERS")
+    pdf_browser_max_rss_mb: int = Field(default=1024, ge=0, alias="PDF_BROWSER_MAX_RSS_MB")
+    # Период проверки браузеров пула, секунд (0 — не проверять)
+    pdf_browser_health_interval: float = Field(default=30.0, ge=0, alias="PDF_BROWSER_HEALTH_INTERVAL")
+    # Дисковый кэш готовых PDF; по умолчанию <INVOICE_STORAGE_PATH>/.pdf-cache
+    pdf_cache_path: str | None = Field(default=None, alias="PDF_CACHE_PATH")
+    # Предельный размер кэша PDF в МБ (0 — без кэша) и число файлов в нём (0 — без ограничения)
+    pdf_cache_max_mb: int = Field(default=512, ge=0, alias="PDF_CACHE_MAX_MB")
+    pdf_cache_max_entries: int = Field(default=20000, ge=0, alias="PDF_CACHE_MAX_ENTRIES")
+    # Переписывать файлы PHP/старых версий в формат FastAPI при первом чтении,
+    # чтобы дальше GET /invoices/{filename} отдавал файл как есть
+    invoice_normalize_on_read: bool = Field(default=True, alias="INVOICE_NORMALIZE_ON_READ")
+    # История правок: полный снимок инвойса каждые N ревизий, между ними — JSON-патчи
+    invoice_revision_snapshot_every: int = Field(default=20, ge=1, alias="INVOICE_REVISION_SNAPSHOT_EVERY")
+    # Сколько секунд номер, выданный /invoices/next-number, зарезервирован за клиентом
+    invoice_number_reservation_ttl: int = Field(default=900, ge=0, alias="INVOICE_NUMBER_RESERVATION_TTL")
+    # Организации (реквизиты, логотипы, подписи) — файл фронтенда, общий с PHP
+    organizations_file: str = Field(default="/var/www/kp/js/organizations.js", alias="ORGANIZATIONS_FILE")
+
     dadata_api_key: str = Field(
         default="0f1a2df340f6231ed018d99db0a69fedba08f819",
         alias="DADATA_API_KEY"
@@ -1,16 +1,58 @@
 from __future__ import annotations
 
+import logging
+import sqlite3
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from playwright.async_api import Error as PlaywrightError
 
 from app.api.router import api_router
 from app.core.config import get_settings
+from app.repositories.invoice import get_invoice_repository
+from app.services.browser_pool import get_browser_pool
+from app.services.invoice_import import shutdown_validation_pool
+from app.services.invoice_service import get_invoice_cache
+from app.services.pdf_service import get_pdf_service
+from app.utils.jsonio import FastJSONResponse
 
 settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    # Файловое хранилище сверяет индекс с директорией архива и следит за записью PHP
+    repository = None
+    try:
+        repository = get_invoice_repository()
+        repository.add_change_listener(get_invoice_cache().invalidate)
+        await repository.startup()
+    except (OSError, RuntimeError, sqlite3.Error) as e:
+        logger.warning("Invoice storage startup skipped: %s", e)
+    # Браузеры для PDF запускаются заранее, страницы — с загруженной оболочкой шаблона;
+    # если не вышло — при первом рендере
+    browser_pool = get_browser_pool()
+    try:
+        await get_pdf_service().warm_up()
+    except (PlaywrightError, OSError) as e:
+        logger.warning("PDF browser pool startup skipped: %s", e)
+    yield
+    await browser_pool.stop()
+    if repository is not None:
+        await repository.shutdown()
+    shutdown_validation_pool()
 
 
 def create_application() -> FastAPI:
-    app = FastAPI(title=settings.app_name, version="0.1.0")
+    app = FastAPI(
+        title=settings.app_name,
+        version="0.1.0",
+        lifespan=lifespan,
+        default_response_class=FastJSONResponse,
+    )
 
     # Для локальной разработки разрешаем все origins, если не указаны явно
     if settings.environment == "local" and not settings.cors_origins:
@@ -20,6 +62,7 @@ def create_application() -> FastAPI:
             allow_credentials=True,
             allow_methods=["*"],
             allow_headers=["*"],
+            expose_headers=["X-Next-Cursor", "ETag"],
         )
     elif settings.cors_origins:
         app.add_middleware(
@@ -28,6 +71,7 @@ def create_application() -> FastAPI:
             allow_credentials=True,
             allow_methods=["*"],
             allow_headers=["*"],
+            expose_headers=["X-Next-Cursor", "ETag"],
         )
 
     app.include_router(api_router, prefix=settings.api_prefix)
@@ -1,5 +1,13 @@
 from app.models.audit_log import AuditLog
 from app.models.base import Base
+from app.models.invoice import (
+    CatalogItem,
+    InvoiceItem,
+    InvoiceNumberReservation,
+    InvoiceRecord,
+    InvoiceRevision,
+    InvoiceRollup,
+)
 from app.models.password_reset import PasswordReset
 from app.models.session import Session
 from app.models.trusted_device import TrustedDevice
@@ -8,6 +16,12 @@ from app.models.user import User
 __all__ = [
     "AuditLog",
     "Base",
+    "CatalogItem",
+    "InvoiceItem",
+    "InvoiceNumberReservation",
+    "InvoiceRecord",
+    "InvoiceRevision",
+    "InvoiceRollup",
     "PasswordReset",
     "Session",
     "TrustedDevice",
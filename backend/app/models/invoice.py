@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+from datetime import datetime
+
+from sqlalchemy import DateTime, Float, Index, Integer, String, Text, func, text
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import Mapped, mapped_column
+
+from app.models.base import Base
+
+
+class InvoiceRecord(Base):
+    """Инвойс в Postgres: исходный JSON в ``data`` + денормализованные поля списка."""
+
+    __tablename__ = "invoices"
+
+    filename: Mapped[str] = mapped_column(String(255), primary_key=True)
+    number: Mapped[str] = mapped_column(String(128), nullable=False, index=True)
+    number_date: Mapped[str | None] = mapped_column(String(128))
+    number_seq: Mapped[int | None] = mapped_column(Integer)
+    date: Mapped[str] = mapped_column(String(32), nullable=False, index=True)
+    recipient: Mapped[str] = mapped_column(Text, nullable=False, index=True)
+    total: Mapped[float] = mapped_column(Float, nullable=False, default=0)
+    currency: Mapped[str] = mapped_column(String(32), nullable=False)
+    document_type: Mapped[str] = mapped_column(String(32), nullable=False)
+    organization_id: Mapped[str | None] = mapped_column(String(64))
+    saved_at: Mapped[str] = mapped_column(String(64), nullable=False, default="")
+    search_text: Mapped[str] = mapped_column(Text, nullable=False, default="")
+    data: Mapped[dict] = mapped_column(JSONB, nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        onupdate=func.now(),
+        nullable=False,
+    )
+
+    __table_args__ = (
+        Index("ix_invoices_updated_at_filename", "updated_at", "filename"),
+        Index("ix_invoices_number_seq", "number_date", "number_seq"),
+        Index(
+            "ix_invoices_search",
+            text("to_tsvector('russian'::regconfig, search_text)"),
+            postgresql_using="gin",
+        ),
+    )
+
+
+class InvoiceNumberReservation(Base):
+    """Временная резервация номера, выданного /invoices/next-number."""
+
+    __tablename__ = "invoice_number_reservations"
+
+    number: Mapped[str] = mapped_column(String(128), primary_key=True)
+    number_date: Mapped[str] = mapped_column(String(128), nullable=False)
+    number_seq: Mapped[int] = mapped_column(Integer, nullable=False)
+    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+
+    __table_args__ = (
+        Index("ix_invoice_number_reservations_seq", "number_date", "number_seq"),
+    )
+
+
+class InvoiceRevision(Base):
+    """Ревизия инвойса: полный снимок в ``snapshot`` или JSON-патч к предыдущей в ``patch``."""
+
+    __tablename__ = "invoice_revisions"
+
+    filename: Mapped[str] = mapped_column(String(255), primary_key=True)
+    rev: Mapped[int] = mapped_column(Integer, primary_key=True)
+    saved_at: Mapped[str] = mapped_column(String(64), nullable=False)
+    saved_by: Mapped[str | None] = mapped_column(String(64))
+    snapshot: Mapped[dict | None] = mapped_column(JSONB)
+    patch: Mapped[list | None] = mapped_column(JSONB)
+
+
+class InvoiceRollup(Base):
+    """Сводка архива: число и сумма инвойсов по измерению (месяц, получатель, ...) и валюте."""
+
+    __tablename__ = "invoice_rollups"
+
+    dimension: Mapped[str] = mapped_column(String(32), primary_key=True)
+    key: Mapped[str] = mapped_column(Text, primary_key=True)
+    currency: Mapped[str] = mapped_column(String(32), primary_key=True)
+    count: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    total: Mapped[float] = mapped_column(Float, nullable=False, default=0)
+
+    __table_args__ = (
+        # Топ получателей по сумме
+        Index("ix_invoice_rollups_total", "dimension", text("total DESC")),
+    )
+
+
+class InvoiceItem(Base):
+    """Позиция инвойса с ключами каталога (``catalog_key``) — для каталога и истории цен."""
+
+    __tablename__ = "invoice_items"
+
+    filename: Mapped[str] = mapped_column(String(255), primary_key=True)
+    position: Mapped[int] = mapped_column(Integer, primary_key=True)
+    item_key: Mapped[str] = mapped_column(Text, nullable=False)
+    model_key: Mapped[str] = mapped_column(Text, nullable=False)
+    description_key: Mapped[str] = mapped_column(Text, nullable=False)
+    model: Mapped[str] = mapped_column(Text, nullable=False)
+    name: Mapped[str] = mapped_column(Text, nullable=False)
+    description: Mapped[str] = mapped_column(Text, nullable=False)
+    price: Mapped[float] = mapped_column(Float, nullable=False)
+    quantity: Mapped[float] = mapped_column(Float, nullable=False)
+    unit: Mapped[str] = mapped_column(Text, nullable=False)
+    hs_code: Mapped[str] = mapped_column(Text, nullable=False)
+    country: Mapped[str] = mapped_column(Text, nullable=False)
+    reducer_specs: Mapped[dict] = mapped_column(JSONB, nullable=False)
+    currency: Mapped[str] = mapped_column(String(32), nullable=False)
+    # Полная дата YYYY-MM-DD или "" — такие позиции старше любых датированных
+    date: Mapped[str] = mapped_column(String(32), nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), nullable=False
+    )
+
+    __table_args__ = (
+        Index("ix_invoice_items_key", "item_key", text("date DESC"), text("updated_at DESC")),
+        # История цен: по модели и/или описанию, от свежих
+        Index("ix_invoice_items_model", "model_key", text("date DESC"), text("updated_at DESC")),
+        Index(
+            "ix_invoice_items_description", "description_key", text("date DESC"), text("updated_at DESC")
+        ),
+    )
+
+
+class CatalogItem(Base):
+    """Позиция каталога: число использований и поля из самого свежего инвойса."""
+
+    __tablename__ = "item_catalog"
+
+    item_key: Mapped[str] = mapped_column(Text, primary_key=True)
+    # Сортировка "C" (по кодам символов): поиск по префиксу — диапазон обычного индекса
+    model_key: Mapped[str] = mapped_column(Text(collation="C"), nullable=False, index=True)
+    name_key: Mapped[str] = mapped_column(Text(collation="C"), nullable=False, index=True)
+    description_key: Mapped[str] = mapped_column(Text(collation="C"), nullable=False, index=True)
+    uses: Mapped[int] = mapped_column(Integer, nullable=False)
+    model: Mapped[str] = mapped_column(Text, nullable=False)
+    name: Mapped[str] = mapped_column(Text, nullable=False)
+    description: Mapped[str] = mapped_column(Text, nullable=False)
+    price: Mapped[float] = mapped_column(Float, nullable=False)
+    unit: Mapped[str] = mapped_column(Text, nullable=False)
+    hs_code: Mapped[str] = mapped_column(Text, nullable=False)
+    country: Mapped[str] = mapped_column(Text, nullable=False)
+    reducer_specs: Mapped[dict] = mapped_column(JSONB, nullable=False)
+    currency: Mapped[str] = mapped_column(String(32), nullable=False)
+    date: Mapped[str] = mapped_column(String(32), nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), server_default=func.now(), nullable=False
+    )
+    filename: Mapped[str] = mapped_column(String(255), nullable=False)
@@ -0,0 +1,660 @@
+from __future__ import annotations
+
+import asyncio
+import fcntl
+import json
+import logging
+import os
+import sqlite3
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from collections.abc import Callable, Hashable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache, partial
+from typing import Any, TypeVar
+
+from app.core.config import get_settings
+from app.services.invoice_index import (
+    InvoiceIndex,
+    default_index_path,
+    get_invoice_index,
+    shard_dir,
+)
+from app.services.invoice_packs import (
+    PackError,
+    read_archive_file,
+    remove_from_pack,
+    split_packed,
+    stat_archive_file,
+)
+from app.services.invoice_revisions import RevisionLog
+from app.services.invoice_watcher import ArchiveWatcher, create_archive_watcher
+from app.utils import jsonio
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Условие записи: получает текущую версию инвойса (``version``, None — его нет)
+Precondition = Callable[[Hashable | None], bool]
+
+# Межпроцессные блокировки записи инвойсов: файлы-полосы locks/NN.lock рядом с индексом,
+# который воркеры и так делят
+LOCK_STRIPES = 64
+
+
+class InvoiceStorageError(Exception):
+    """Ошибка хранилища инвойсов (файловая система, индекс или БД)."""
+
+
+class InvoiceVersionConflictError(InvoiceStorageError):
+    """Инвойс изменился после версии, которую видел клиент (не выполнено условие записи)."""
+
+
+class InvoiceRepository(ABC):
+    """Хранилище инвойсов: сырые JSON-данные, адресуемые по имени файла.
+
+    ``InvoiceService`` работает только через этот интерфейс, поэтому файловый
+    архив и Postgres взаимозаменяемы (см. ``INVOICE_STORAGE_BACKEND``).
+    """
+
+    async def startup(self) -> None:
+        """Подготовка хранилища при старте приложения."""
+        return None
+
+    async def shutdown(self) -> None:
+        """Освобождение ресурсов при остановке приложения."""
+        return None
+
+    def add_change_listener(self, callback: Callable[[str], None]) -> None:
+        """Подписка на изменения инвойсов, сделанные в обход репозитория.
+
+        ``callback(filename)`` вызывается из фонового потока. По умолчанию таких
+        изменений нет, и подписка ничего не делает.
+        """
+        return None
+
+    @abstractmethod
+    async def list_page(
+        self,
+        limit: int | None = None,
+        after: str | None = None,
+        filters: dict[str, Any] | None = None,
+    ) -> tuple[list[dict], str | None]:
+        """Страница списка (новые первыми) и курсор следующей страницы.
+
+        Некорректный курсор — ``ValueError``.
+        """
+
+    async def list_version(self) -> Hashable | None:
+        """Версия списка инвойсов: меняется при любом сохранении или удалении. None — не поддерживается."""
+        return None
+
+    @abstractmethod
+    async def search(self, query: str, limit: int = 50) -> list[dict]:
+        """Полнотекстовый поиск, результаты в формате элементов списка."""
+
+    @abstractmethod
+    async def stats(self, recipients_limit: int = 20) -> dict[str, Any]:
+        """Итоги архива по месяцам, получателям (топ по сумме), валютам и типам документов."""
+
+    @abstractmethod
+    async def catalog(self, prefix: str, limit: int = 20) -> list[dict]:
+        """Каталог позиций из всех инвойсов: модель, название или описание начинаются с ``prefix``.
+
+        Каждая позиция — с ценой и атрибутами из самого свежего инвойса и числом
+        использований ``uses``; популярные первыми.
+        """
+
+    @abstractmethod
+    async def price_history(
+        self, model: str | None = None, description: str | None = None, limit: int = 100
+    ) -> dict[str, Any]:
+        """История цен позиции по модели и/или описанию (без учёта регистра и пробелов).
+
+        ``history`` — последние ``limit`` строк (новые первыми) с номером инвойса и
+        получателем, ``aggregates`` — min/avg/max по валютам по всем строкам.
+        Позиции без цены не учитываются.
+        """
+
+    @abstractmethod
+    async def get(self, filename: str) -> dict | None:
+        """Сырые данные инвойса или None, если его нет."""
+
+    async def raw_path(self, filename: str) -> str | None:
+        """Путь к файлу инвойса, который можно отдать клиенту как есть, без валидации.
+
+        Только для файлов в каноническом формате FastAPI (записанных ``save_invoice``
+        или нормализованных ``normalize``). None — читать через ``get``.
+        """
+        return None
+
+    async def normalize(self, filename: str, version: Hashable, data: dict) -> bool:
+        """Перезаписывает инвойс в каноническом формате, если он не менялся с ``version``.
+
+        Это не правка: дата изменения и история ревизий не трогаются. False — не
+        поддерживается или файл успел измениться.
+        """
+        return False
+
+    async def version(self, filename: str) -> Hashable | None:
+        """Дешёвый идентификатор версии инвойса (без чтения данных) или None, если его нет.
+
+        Меняется при каждой записи; используется для кэширования.
+        """
+        return None
+
+    @abstractmethod
+    async def save(
+        self, filename: str, data: dict, precondition: Precondition | None = None
+    ) -> str | None:
+        """Создаёт или перезаписывает инвойс. Возвращает путь к файлу, если он есть.
+
+        ``precondition`` проверяется с текущей версией инвойса под блокировкой
+        записи, атомарно с самой записью; если оно не выполнено — ``InvoiceVersionConflictError``.
+        """
+
+    async def save_many(
+        self, items: list[tuple[str, dict]], overwrite: bool = True
+    ) -> dict[str, str]:
+        """Сохраняет пачку инвойсов ``(filename, data)``.
+
+        Возвращает ошибки по именам файлов; остальные записи сохранены. Без
+        ``overwrite`` существующие инвойсы не трогаются и попадают в ошибки.
+        """
+        errors: dict[str, str] = {}
+        for filename, data in items:
+            try:
+                if not overwrite and await self.version(filename) is not None:
+                    errors[filename] = "Invoice already exists"
+                    continue
+                await self.save(filename, data)
+            except InvoiceStorageError as e:
+                errors[filename] = str(e)
+        return errors
+
+    @abstractmethod
+    async def delete(self, filename: str) -> bool:
+        """Удаляет инвойс. False, если его не было."""
+
+    async def revisions(self, filename: str) -> list[dict]:
+        """Ревизии инвойса от старых к новым: ``rev``, ``saved_at``, ``saved_by``, ``snapshot``.
+
+        Пустой список — истории нет (или хранилище её не ведёт).
+        """
+        return []
+
+    async def get_revision(self, filename: str, rev: int) -> dict | None:
+        """Данные инвойса в ревизии ``rev`` или None, если такой ревизии нет."""
+        return None
+
+    @abstractmethod
+    async def next_number(self, date_key: str, reserve_ttl: float = 0) -> str:
+        """Следующий номер ``<date_key>-NN``, опционально зарезервированный на ``reserve_ttl`` секунд."""
+
+    @abstractmethod
+    async def release_number(self, number: str) -> bool:
+        """Снимает резервацию номера; False, если её не было."""
+
+
+class FileInvoiceRepository(InvoiceRepository):
+    """Инвойсы как JSON-файлы в архиве + SQLite-индекс для списка, поиска и нумерации.
+
+    Блокирующий файловый ввод-вывод и запросы к индексу выполняются в собственном
+    пуле потоков ограниченного размера (``INVOICE_IO_CONCURRENCY``), чтобы
+    медленный диск не останавливал event loop для остальных запросов.
+
+    Запись в архив legacy PHP-эндпоинтами отслеживается ``ArchiveWatcher``
+    (``INVOICE_WATCH_ARCHIVE``): индекс обновляется по одному файлу, подписчики
+    ``add_change_listener`` получают имя изменённого файла.
+
+    Каждое сохранение дописывает ревизию в историю инвойса (``RevisionLog``,
+    ``<архив>/.revisions/``); правки PHP попадают в неё при следующем сохранении.
+
+    Новые инвойсы кладутся в корень архива (``flat``) или в ``YYYY/MM/`` по дате
+    инвойса (``sharded``, ``INVOICE_STORAGE_LAYOUT``). Существующие файлы
+    перезаписываются на месте и находятся в любой из раскладок.
+
+    Холодные инвойсы, упакованные ``invoices pack`` в ``<архив>/.packs/``, читаются
+    прямо из пака; при сохранении инвойс снова становится обычным файлом и
+    удаляется из пака.
+    """
+
+    def __init__(
+        self,
+        storage_path: str,
+        index: InvoiceIndex | None = None,
+        max_workers: int | None = None,
+        layout: str | None = None,
+    ) -> None:
+        self.storage_path = storage_path
+        self.layout = layout or get_settings().invoice_storage_layout
+        self._ensure_storage_access()
+        self.index = index or InvoiceIndex(storage_path, default_index_path(storage_path))
+        self.revision_log = RevisionLog(
+            storage_path, self.index, get_settings().invoice_revision_snapshot_every
+        )
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or get_settings().invoice_io_concurrency,
+            thread_name_prefix="invoice-io",
+        )
+        self._listeners: list[Callable[[str], None]] = []
+        self._watcher: ArchiveWatcher | None = None
+        # Файлы, которые сейчас пишет/удаляет сам репозиторий, и отложенные для них события
+        self._own_changes: set[str] = set()
+        self._deferred_events: set[str] = set()
+        self._own_lock = threading.Lock()
+
+    def _ensure_storage_access(self) -> None:
+        if not os.path.exists(self.storage_path):
+            try:
+                os.makedirs(self.storage_path, mode=0o777, exist_ok=True)
+            except OSError as e:
+                raise RuntimeError(f"Failed to create storage directory {self.storage_path}: {e}")
+
+        if not os.access(self.storage_path, os.W_OK):
+            # For a service that NEEDS to write, failing is better than silently degrading.
+            # We assume permissions are set correctly by ops.
+            raise RuntimeError(f"Storage directory {self.storage_path} is not writable by current user {os.getuid()}")
+
+    def _locate(self, filename: str) -> str | None:
+        try:
+            rel_path = self.index.locate(filename)
+        except sqlite3.Error as e:
+            raise InvoiceStorageError(f"Failed to query index: {e}") from e
+        return os.path.join(self.storage_path, rel_path) if rel_path else None
+
+    def _packed_path(self, file_path: str | None) -> str | None:
+        """Путь относительно архива, если файл лежит в паке, иначе None."""
+        if file_path is None:
+            return None
+        rel_path = os.path.relpath(file_path, self.storage_path)
+        return rel_path if split_packed(rel_path) is not None else None
+
+    def _unpack(self, rel_path: str) -> None:
+        """Удаляет инвойс из пака (после записи его обычным файлом или при удалении)."""
+        try:
+            # Пак переписывается целиком: транзакция индекса не даёт двум процессам делать это разом
+            with self.index.transaction():
+                remove_from_pack(self.storage_path, rel_path)
+        except (OSError, PackError) as e:
+            raise InvoiceStorageError(f"Failed to update pack: {e}") from e
+        except sqlite3.Error as e:
+            raise InvoiceStorageError(f"Failed to update index: {e}") from e
+
+    async def _run(self, func: Callable[..., T], *args: Any) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args))
+
+    async def startup(self) -> None:
+        # Перечитываются только новые и изменённые файлы; если индекс занят другим
+        # процессом, слежение всё равно запускается — его собственные записи индексируются
+        try:
+            await self._run(self.index.reconcile)
+        except sqlite3.OperationalError as e:
+            logger.warning("Invoice index reconcile failed: %s", e)
+        settings = get_settings()
+        if settings.invoice_watch_archive:
+            self.start_watching(settings.invoice_watch_poll_interval)
+
+    async def shutdown(self) -> None:
+        self.stop_watching()
+        self._executor.shutdown(wait=True)
+
+    def add_change_listener(self, callback: Callable[[str], None]) -> None:
+        self._listeners.append(callback)
+
+    def start_watching(self, poll_interval: float = 5.0) -> ArchiveWatcher:
+        if self._watcher is None:
+            self._watcher = create_archive_watcher(
+                self.storage_path, self._on_external_change, self.index.reconcile, poll_interval
+            )
+            self._watcher.start()
+        return self._watcher
+
+    def stop_watching(self) -> None:
+        if self._watcher is not None:
+            self._watcher.stop()
+            self._watcher = None
+
+    def _on_external_change(self, rel_path: str) -> None:
+        filename = os.path.basename(rel_path)
+        with self._own_lock:
+            if filename in self._own_changes:
+                # Событие нашей же записи пришло раньше обновления индекса: разберём после
+                self._deferred_events.add(rel_path)
+                return
+        # Собственные записи уже в индексе: mtime/size совпадают, refresh вернёт False
+        if self.index.refresh(rel_path):
+            for callback in self._listeners:
+                callback(filename)
+
+    def _claim(self, filenames: Iterable[str]) -> None:
+        with self._own_lock:
+            self._own_changes.update(filenames)
+
+    def _release(self, filenames: Iterable[str]) -> None:
+        names = set(filenames)
+        with self._own_lock:
+            self._own_changes.difference_update(names)
+            deferred = sorted(
+                rel_path for rel_path in self._deferred_events
+                if os.path.basename(rel_path) in names
+            )
+            self._deferred_events.difference_update(deferred)
+        # Если между записью и обновлением индекса файл успел поменять PHP — подхватим
+        for rel_path in deferred:
+            self._on_external_change(rel_path)
+
+    @contextmanager
+    def _own_change(self, filename: str) -> Iterator[None]:
+        self._claim([filename])
+        try:
+            yield
+        finally:
+            self._release([filename])
+
+    @contextmanager
+    def _file_lock(self, filename: str) -> Iterator[None]:
+        """Блокировка записи инвойса между потоками и воркерами (flock на файле-полосе)."""
+        stripe = zlib.crc32(filename.encode("utf-8")) % LOCK_STRIPES
+        lock_path = os.path.join(os.path.dirname(self.index.index_path), "locks", f"{stripe:02d}.lock")
+        try:
+            os.makedirs(os.path.dirname(lock_path), mode=0o777, exist_ok=True)
+            fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o666)
+        except OSError as e:
+            raise InvoiceStorageError(f"Failed to lock invoice: {e}") from e
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)  # Закрытие снимает блокировку
+
+    async def list_page(
+        self,
+        limit: int | None = None,
+        after: str | None = None,
+        filters: dict[str, Any] | None = None,
+    ) -> tuple[list[dict], str | None]:
+        try:
+            return await self._run(self.index.query_entries, limit, after, filters)
+        except sqlite3.Error as e:
+            raise InvoiceStorageError(str(e)) from e
+
+    async def list_version(self) -> Hashable | None:
+        try:
+            return await self._run(self.index.generation)
+        except sqlite3.Error as e:
+            raise InvoiceStorageError(str(e)) from e
+
+    async def search(self, query: str, limit: int = 50) -> list[dict]:
+        try:
+            return await self._run(self.index.search, query, limit)
+        except sqlite3.Error as e:
+            raise InvoiceStorageError(str(e)) from e
+
+    async def stats(self, recipients_limit: int = 20) -> dict[str, Any]:
+        try:
+            return await self._run(self.index.stats, recipients_limit)
+        except sqlite3.Error as e:
+            raise InvoiceStorageError(str(e)) from e
+
+    async def catalog(self, prefix: str, limit: int = 20) -> list[dict]:
+        try:
+            return await self._run(self.index.catalog, prefix, limit)
+        except sqlite3.Error as e:
+            raise InvoiceStorageError(str(e)) from e
+
+    async def price_history(
+        self, model: str | None = None, description: str | None = None, limit: int = 100
+    ) -> dict[str, Any]:
+        try:
+            return await self._run(self.index.price_history, model, description, limit)
+        except sqlite3.Error as e:
+            raise InvoiceStorageError(str(e)) from e
+
+    async def get(self, filename: str) -> dict | None:
+        return await self._run(self._read, filename)
+
+    async def version(self, filename: str) -> Hashable | None:
+        return await self._run(self._stat_version, filename)
+
+    async def raw_path(self, filename: str) -> str | None:
+        try:
+            rel_path = await self._run(self.index.canonical_path, filename)
+        except sqlite3.Error as e:
+            raise InvoiceStorageError(f"Failed to query index: {e}") from e
+        return os.path.join(self.storage_path, rel_path) if rel_path else None
+
+    async def normalize(self, filename: str, version: Hashable, data: dict) -> bool:
+        return await self._run(self._normalize, filename, version, data)
+
+    async def save(
+        self, filename: str, data: dict, precondition: Precondition | None = None
+    ) -> str | None:
+        return await self._run(self._write, filename, data, precondition)
+
+    async def save_many(
+        self, items: list[tuple[str, dict]], overwrite: bool = True, batch_size: int = 200
+    ) -> dict[str, str]:
+        # Файлы пишутся пачками параллельно в пуле ввода-вывода, индекс — одной транзакцией в конце
+        filenames = [filename for filename, _ in items]
+        self._claim(filenames)
+        try:
+            results = await asyncio.gather(*(
+                self._run(self._write_files, items[start:start + batch_size], overwrite)
+                for start in range(0, len(items), batch_size)
+            ))
+            written = [entry for batch_written, _ in results for entry in batch_written]
+            errors = {name: error for _, batch_errors in results for name, error in batch_errors.items()}
+            try:
+                await self._run(self.index.refresh_many, written)
+            except sqlite3.Error as e:
+                raise InvoiceStorageError(f"Failed to update index: {e}") from e
+        finally:
+            await self._run(self._release, filenames)
+        return errors
+
+    async def delete(self, filename: str) -> bool:
+        return await self._run(self._remove, filename)
+
+    async def revisions(self, filename: str) -> list[dict]:
+        try:
+            return await self._run(self.revision_log.list, filename)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            raise InvoiceStorageError(f"Failed to read revisions: {e}") from e
+
+    async def get_revision(self, filename: str, rev: int) -> dict | None:
+        try:
+            return await self._run(self.revision_log.get, filename, rev)
+        except (OSError, ValueError, sqlite3.Error) as e:
+            raise InvoiceStorageError(f"Failed to read revisions: {e}") from e
+
+    async def next_number(self, date_key: str, reserve_ttl: float = 0) -> str:
+        try:
+            return await self._run(self.index.next_number, date_key, reserve_ttl)
+        except sqlite3.Error as e:
+            raise InvoiceStorageError(str(e)) from e
+
+    async def release_number(self, number: str) -> bool:
+        try:
+            return await self._run(self.index.release_number, number)
+        except sqlite3.Error as e:
+            raise InvoiceStorageError(str(e)) from e
+
+    # --- Blocking implementations (run in the I/O pool) ---------------------
+
+    def _stat_version(self, filename: str) -> tuple[int, int] | None:
+        file_path = self._locate(filename)
+        if file_path is None:
+            return None
+        try:
+            st = stat_archive_file(self.storage_path, os.path.relpath(file_path, self.storage_path))
+        except FileNotFoundError:
+            return None
+        except (OSError, PackError) as e:
+            raise InvoiceStorageError(f"Failed to read file: {e}") from e
+        return st.st_mtime_ns, st.st_size
+
+    def _read(self, filename: str) -> dict | None:
+        # Вторая попытка — если файл перенесли в другой каталог между поиском и чтением
+        for _ in range(2):
+            file_path = self._locate(filename)
+            if file_path is None:
+                return None
+            try:
+                raw = read_archive_file(self.storage_path, os.path.relpath(file_path, self.storage_path))
+            except FileNotFoundError:
+                continue
+            except (OSError, PackError) as e:
+                raise InvoiceStorageError(f"Failed to read file: {e}") from e
+            try:
+                return jsonio.loads(raw)
+            except (json.JSONDecodeError, UnicodeDecodeError) as e:
+                raise InvoiceStorageError("Invalid JSON file") from e
+        return None
+
+    def _write(self, filename: str, data: dict, precondition: Precondition | None = None) -> str:
+        with self._own_change(filename), self._file_lock(filename):
+            if precondition is not None and not precondition(self._stat_version(filename)):
+                raise InvoiceVersionConflictError(f"Invoice {filename} was modified")
+            return self._write_file(filename, data)
+
+    def _write_file(self, filename: str, data: dict) -> str:
+        file_path = self._locate(filename)
+        previous = self._read_previous(file_path)
+        packed = self._packed_path(file_path)
+        # Упакованный инвойс записывается заново по раскладке, затем удаляется из пака
+        rel_path = self._write_json(filename, None if packed else file_path, data)
+        try:
+            self.index.refresh(rel_path, data)
+        except sqlite3.Error as e:
+            raise InvoiceStorageError(f"Failed to update index: {e}") from e
+        if packed:
+            self._unpack(packed)
+        self._record_revision(filename, previous, data)
+        return os.path.join(self.storage_path, rel_path)
+
+    def _read_previous(self, file_path: str | None) -> dict | None:
+        """Текущее содержимое перезаписываемого файла — для истории правок."""
+        if file_path is None:
+            return None
+        try:
+            data = jsonio.loads(read_archive_file(self.storage_path, os.path.relpath(file_path, self.storage_path)))
+        except (OSError, ValueError):
+            return None
+        return data if isinstance(data, dict) else None
+
+    def _record_revision(self, filename: str, previous: dict | None, data: dict) -> None:
+        # Файл уже сохранён: сбой истории не должен превращаться в ошибку сохранения
+        try:
+            self.revision_log.record(filename, previous, data)
+        except (OSError, ValueError, sqlite3.Error):
+            logger.exception("Failed to record revision of %s", filename)
+
+    def _write_files(
+        self, items: list[tuple[str, dict]], overwrite: bool
+    ) -> tuple[list[tuple[str, dict]], dict[str, str]]:
+        written: list[tuple[str, dict]] = []
+        errors: dict[str, str] = {}
+        for filename, data in items:
+            try:
+                with self._file_lock(filename):
+                    file_path = self._locate(filename)
+                    if file_path is not None and not overwrite:
+                        errors[filename] = "Invoice already exists"
+                        continue
+                    previous = self._read_previous(file_path)
+                    packed = self._packed_path(file_path)
+                    written.append((self._write_json(filename, None if packed else file_path, data), data))
+                    if packed:
+                        # Индекс обновится в конце пачки: до этого файл находится по раскладке
+                        self._unpack(packed)
+                    self._record_revision(filename, previous, data)
+            except InvoiceStorageError as e:
+                errors[filename] = str(e)
+        return written, errors
+
+    def _write_json(self, filename: str, file_path: str | None, data: dict) -> str:
+        """Атомарно пишет JSON инвойса, возвращает путь относительно архива (индекс не трогает)."""
+        # Существующий файл перезаписывается на месте, новый кладётся по раскладке
+        if file_path is None:
+            rel_dir = shard_dir(data) if self.layout == "sharded" else ""
+            file_path = os.path.join(self.storage_path, rel_dir, filename)
+        rel_path = os.path.relpath(file_path, self.storage_path)
+
+        # Atomic write
+        temp_path = f"{file_path}.tmp"
+        try:
+            os.makedirs(os.path.dirname(file_path), mode=0o777, exist_ok=True)
+            # Те же байты, что json.dump(..., ensure_ascii=False, indent=2): файлы читает PHP
+            with open(temp_path, 'wb') as f:
+                f.write(jsonio.dumps_document(data))
+
+            # Set permissions to 666 so PHP/Others can read/write if needed
+            os.chmod(temp_path, 0o666)
+            os.replace(temp_path, file_path)
+        except OSError as e:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise InvoiceStorageError(f"Failed to save file: {e}") from e
+        return rel_path
+
+    def _normalize(self, filename: str, version: Hashable, data: dict) -> bool:
+        with self._own_change(filename), self._file_lock(filename):
+            file_path = self._locate(filename)
+            if file_path is None or self._packed_path(file_path):
+                return False
+            try:
+                st = os.stat(file_path)
+            except OSError:
+                return False
+            if (st.st_mtime_ns, st.st_size) != version:
+                return False  # Файл изменили после чтения — нормализуем в следующий раз
+            rel_path = self._write_json(filename, file_path, data)
+            try:
+                # Прежняя дата изменения: по ней сортируется список, а содержимое по сути то же
+                os.utime(file_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+                self.index.refresh(rel_path, data)
+            except OSError as e:
+                raise InvoiceStorageError(f"Failed to save file: {e}") from e
+            except sqlite3.Error as e:
+                raise InvoiceStorageError(f"Failed to update index: {e}") from e
+        return True
+
+    def _remove(self, filename: str) -> bool:
+        with self._own_change(filename), self._file_lock(filename):
+            return self._remove_file(filename)
+
+    def _remove_file(self, filename: str) -> bool:
+        file_path = self._locate(filename)
+        if file_path is None:
+            return False
+        packed = self._packed_path(file_path)
+        if packed:
+            self._unpack(packed)
+        else:
+            try:
+                os.remove(file_path)
+            except OSError as e:
+                raise InvoiceStorageError(f"Failed to delete file: {e}") from e
+
+        try:
+            self.index.remove(filename)
+        except sqlite3.Error as e:
+            raise InvoiceStorageError(f"Failed to update index: {e}") from e
+        return True
+
+
+@lru_cache
+def get_invoice_repository() -> InvoiceRepository:
+    """Хранилище инвойсов процесса, выбранное настройкой ``INVOICE_STORAGE_BACKEND``."""
+    settings = get_settings()
+    if settings.invoice_storage_backend == "postgres":
+        from app.db.session import AsyncSessionFactory
+        from app.repositories.invoice_postgres import PostgresInvoiceRepository
+
+        return PostgresInvoiceRepository(AsyncSessionFactory)
+    return FileInvoiceRepository(settings.invoice_storage_path, get_invoice_index())
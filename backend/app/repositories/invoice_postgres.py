@@ -0,0 +1,828 @@
+from __future__ import annotations
+
+from collections import Counter
+from collections.abc import Hashable, Iterable, Mapping
+from datetime import datetime, timedelta, timezone
+from typing import Any
+
+from sqlalchemy import (
+    Integer,
+    Text,
+    case,
+    column,
+    delete,
+    func,
+    literal,
+    literal_column,
+    or_,
+    select,
+    tuple_,
+    update,
+    values,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+from sqlalchemy.orm import load_only
+
+from app.core.config import get_settings
+from app.models.invoice import (
+    CatalogItem,
+    InvoiceItem,
+    InvoiceNumberReservation,
+    InvoiceRecord,
+    InvoiceRevision,
+    InvoiceRollup,
+)
+from app.repositories.invoice import (
+    InvoiceRepository,
+    InvoiceStorageError,
+    InvoiceVersionConflictError,
+    Precondition,
+)
+from app.services.invoice_index import (
+    ITEM_DATE_RE,
+    ROLLUP_DIMENSIONS,
+    catalog_key,
+    decode_cursor,
+    encode_cursor,
+    item_fields,
+    item_key,
+    list_fields,
+    number_parts,
+    rollup_keys,
+    search_text,
+)
+from app.services.invoice_revisions import plan_revisions, replay, snapshot_entry
+from app.utils.text import tokenize
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Литерал, а не bind-параметр: иначе Postgres не применит GIN-индекс ix_invoices_search
+_TS_CONFIG = literal_column("'russian'::regconfig")
+
+# Строк позиций и каталога в одном INSERT (лимит asyncpg — 32767 параметров)
+_ITEM_BATCH = 1000
+
+# Колонки позиции, которые каталог берёт из самого свежего инвойса
+_CATALOG_COLUMNS = (
+    "model",
+    "name",
+    "description",
+    "price",
+    "unit",
+    "hs_code",
+    "country",
+    "reducer_specs",
+    "currency",
+    "date",
+    "updated_at",
+    "filename",
+)
+
+# Фильтр списка -> условие по колонке
+_FILTERS = {
+    "date_from": lambda value: InvoiceRecord.date >= value,
+    "date_to": lambda value: InvoiceRecord.date <= value,
+    "documentType": lambda value: InvoiceRecord.document_type == value,
+    "currency": lambda value: InvoiceRecord.currency == value,
+    "organizationId": lambda value: InvoiceRecord.organization_id == value,
+    "total_min": lambda value: InvoiceRecord.total >= value,
+    "total_max": lambda value: InvoiceRecord.total <= value,
+}
+
+
+# Колонки элемента списка: JSONB ``data`` для списка и поиска не читается
+_LIST_COLUMNS = load_only(
+    InvoiceRecord.filename,
+    InvoiceRecord.number,
+    InvoiceRecord.date,
+    InvoiceRecord.recipient,
+    InvoiceRecord.total,
+    InvoiceRecord.currency,
+    InvoiceRecord.document_type,
+    InvoiceRecord.saved_at,
+    InvoiceRecord.organization_id,
+    InvoiceRecord.updated_at,
+)
+
+
+def _to_micros(value: datetime) -> int:
+    delta = value - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 10**6 + delta.microseconds
+
+
+def _from_micros(value: int) -> datetime:
+    return _EPOCH + timedelta(microseconds=value)
+
+
+def _entry(record: InvoiceRecord) -> dict:
+    return {
+        "filename": record.filename,
+        "number": record.number,
+        "date": record.date,
+        "recipient": record.recipient,
+        "total": record.total,
+        "currency": record.currency,
+        "documentType": record.document_type,
+        "saved_at": record.saved_at,
+        "organizationId": record.organization_id,
+    }
+
+
+def record_values(filename: str, data: dict) -> dict[str, Any]:
+    """Значения колонок ``invoices`` для сырых данных инвойса."""
+    fields = list_fields(data)
+    number_date, number_seq = number_parts(fields["number"])
+    return {
+        "filename": filename,
+        "number": fields["number"],
+        "number_date": number_date,
+        "number_seq": number_seq,
+        "date": fields["date"],
+        "recipient": fields["recipient"],
+        "total": fields["total"],
+        "currency": fields["currency"],
+        "document_type": fields["documentType"],
+        "organization_id": fields["organizationId"],
+        "saved_at": fields["saved_at"],
+        "search_text": search_text(data),
+        "data": data,
+    }
+
+
+# Колонки ``invoices``, из которых складываются сводки
+_ROLLUP_COLUMNS = (
+    InvoiceRecord.filename,
+    InvoiceRecord.date,
+    InvoiceRecord.recipient,
+    InvoiceRecord.total,
+    InvoiceRecord.currency,
+    InvoiceRecord.document_type,
+)
+
+
+def rollup_rows(changes: Iterable[tuple[Mapping[str, Any], int]]) -> list[dict[str, Any]]:
+    """Изменения ``invoice_rollups`` для строк ``invoices`` (знак 1 — добавлена, -1 — удалена).
+
+    Строки отсортированы по ключу: параллельные транзакции блокируют их в одном порядке.
+    """
+    deltas: dict[tuple[str, str, str], list] = {}
+    for record, sign in changes:
+        keys = rollup_keys(record["date"], record["recipient"], record["currency"], record["document_type"])
+        for dimension in ROLLUP_DIMENSIONS:
+            delta = deltas.setdefault((dimension, keys[dimension], record["currency"]), [0, 0.0])
+            delta[0] += sign
+            delta[1] += sign * record["total"]
+    return [
+        {"dimension": dimension, "key": key, "currency": currency, "count": count, "total": total}
+        for (dimension, key, currency), (count, total) in sorted(deltas.items())
+        if count or total
+    ]
+
+
+async def _update_rollups(session: AsyncSession, changes: Iterable[tuple[Mapping[str, Any], int]]) -> None:
+    rows = rollup_rows(changes)
+    if not rows:
+        return
+    stmt = insert(InvoiceRollup).values(rows)
+    await session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[InvoiceRollup.dimension, InvoiceRollup.key, InvoiceRollup.currency],
+            set_={
+                "count": InvoiceRollup.count + stmt.excluded["count"],
+                "total": InvoiceRollup.total + stmt.excluded["total"],
+            },
+        )
+    )
+    emptied = [(row["dimension"], row["key"], row["currency"]) for row in rows if row["count"] < 0]
+    if emptied:
+        await session.execute(
+            delete(InvoiceRollup).where(
+                tuple_(InvoiceRollup.dimension, InvoiceRollup.key, InvoiceRollup.currency).in_(emptied),
+                InvoiceRollup.count <= 0,
+            )
+        )
+
+
+def item_rows(record: Mapping[str, Any]) -> list[dict[str, Any]]:
+    """Строки ``invoice_items`` для строки ``invoices``: позиции с моделью, названием или описанием."""
+    items = record["data"].get("items")
+    if not isinstance(items, list):
+        return []
+    date = record["date"] if ITEM_DATE_RE.match(record["date"]) else ""
+    rows = []
+    for position, item in enumerate(items):
+        fields = item_fields(item)
+        if fields is None:
+            continue
+        key = item_key(fields)
+        model_key, _, description_key = key.split("\x1f")
+        rows.append({
+            "filename": record["filename"],
+            "position": position,
+            "item_key": key,
+            "model_key": model_key,
+            "description_key": description_key,
+            "model": fields["model"],
+            "name": fields["name"],
+            "description": fields["description"],
+            "price": fields["price"],
+            "quantity": fields["quantity"],
+            "unit": fields["unit"],
+            "hs_code": fields["hsCode"],
+            "country": fields["countryOfOrigin"],
+            "reducer_specs": fields["reducerSpecs"],
+            "currency": record["currency"],
+            "date": date,
+        })
+    return rows
+
+
+def catalog_rows(items: Iterable[Mapping[str, Any]]) -> list[dict[str, Any]]:
+    """Строки ``item_catalog`` для строк ``invoice_items``: число использований и самая свежая позиция.
+
+    Строки отсортированы по ключу, как и сводки.
+    """
+    uses: Counter[str] = Counter()
+    latest: dict[str, dict[str, Any]] = {}
+    for item in items:
+        key = item["item_key"]
+        uses[key] += 1
+        if key not in latest or item["date"] >= latest[key]["date"]:
+            latest[key] = item
+    catalog = []
+    for key, item in sorted(latest.items()):
+        model_key, name_key, description_key = key.split("\x1f")
+        catalog.append({
+            "item_key": key,
+            "model_key": model_key,
+            "name_key": name_key,
+            "description_key": description_key,
+            "uses": uses[key],
+            **{column: item[column] for column in _CATALOG_COLUMNS if column != "updated_at"},
+        })
+    return catalog
+
+
+async def _index_items(session: AsyncSession, records: list[Mapping[str, Any]]) -> None:
+    """Добавляет позиции инвойсов и учитывает их в каталоге."""
+    items = [item for record in records for item in item_rows(record)]
+    if not items:
+        return
+    for start in range(0, len(items), _ITEM_BATCH):
+        await session.execute(insert(InvoiceItem).values(items[start:start + _ITEM_BATCH]))
+
+    catalog = catalog_rows(items)
+    for start in range(0, len(catalog), _ITEM_BATCH):
+        stmt = insert(CatalogItem).values(catalog[start:start + _ITEM_BATCH])
+        # Поля берутся из более свежей позиции: по дате, затем по времени записи
+        newer = tuple_(stmt.excluded.date, stmt.excluded.updated_at) >= tuple_(
+            CatalogItem.date, CatalogItem.updated_at
+        )
+        await session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[CatalogItem.item_key],
+                set_={
+                    "uses": CatalogItem.uses + stmt.excluded.uses,
+                    **{
+                        column: case((newer, stmt.excluded[column]), else_=getattr(CatalogItem, column))
+                        for column in _CATALOG_COLUMNS
+                    },
+                },
+            )
+        )
+
+
+async def _unindex_items(session: AsyncSession, filenames: list[str]) -> None:
+    """Удаляет позиции инвойсов и вычитает их из каталога."""
+    removed = Counter(
+        (
+            await session.execute(
+                delete(InvoiceItem).where(InvoiceItem.filename.in_(filenames)).returning(InvoiceItem.item_key)
+            )
+        ).scalars()
+    )
+    if not removed:
+        return
+    keys = sorted(removed)
+    counts = values(column("item_key", Text), column("count", Integer), name="removed").data(
+        [(key, removed[key]) for key in keys]
+    )
+    await session.execute(
+        update(CatalogItem)
+        .where(CatalogItem.item_key == counts.c.item_key)
+        .values(uses=CatalogItem.uses - counts.c.count)
+    )
+    await session.execute(delete(CatalogItem).where(CatalogItem.item_key.in_(keys), CatalogItem.uses <= 0))
+    # Поля позиции были взяты из удалённого инвойса — их даёт следующий по свежести
+    latest = (
+        select(InvoiceItem.item_key, *(getattr(InvoiceItem, name) for name in _CATALOG_COLUMNS))
+        .where(InvoiceItem.item_key.in_(keys))
+        .distinct(InvoiceItem.item_key)
+        .order_by(InvoiceItem.item_key, InvoiceItem.date.desc(), InvoiceItem.updated_at.desc())
+        .subquery()
+    )
+    await session.execute(
+        update(CatalogItem)
+        .where(CatalogItem.item_key == latest.c.item_key, CatalogItem.filename.in_(filenames))
+        .values({name: latest.c[name] for name in _CATALOG_COLUMNS})
+    )
+
+
+async def lock_invoices(session: AsyncSession, filenames: Iterable[str]) -> None:
+    """Транзакционные блокировки инвойсов — в порядке имён, чтобы пакеты не блокировали друг друга."""
+    names = func.unnest(literal(sorted(set(filenames)), ARRAY(Text))).table_valued("name")
+    await session.execute(
+        select(func.pg_advisory_xact_lock(func.hashtext(literal("invoice:") + names.c.name))).select_from(names)
+    )
+
+
+async def upsert_records(session: AsyncSession, rows: list[dict[str, Any]], overwrite: bool = True) -> set[str]:
+    """Записывает строки ``invoices`` (``record_values``) и в той же транзакции обновляет сводки и каталог.
+
+    Вызывающий держит ``lock_invoices`` на эти файлы. Возвращает имена записанных
+    файлов: без ``overwrite`` существующие пропускаются.
+    """
+    filenames = [row["filename"] for row in rows]
+    previous = []
+    if overwrite:
+        previous = (
+            await session.execute(select(*_ROLLUP_COLUMNS).where(InvoiceRecord.filename.in_(filenames)))
+        ).mappings().all()
+    stmt = insert(InvoiceRecord).values(rows)
+    if overwrite:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[InvoiceRecord.filename],
+            # onupdate не срабатывает в ON CONFLICT DO UPDATE: без updated_at версия,
+            # ETag и ключ кэша не изменились бы
+            set_={
+                **{key: stmt.excluded[key] for key in rows[0] if key != "filename"},
+                "updated_at": func.now(),
+            },
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=[InvoiceRecord.filename])
+    saved = set((await session.execute(stmt.returning(InvoiceRecord.filename))).scalars())
+    await _update_rollups(
+        session, [(row, 1) for row in rows if row["filename"] in saved] + [(row, -1) for row in previous]
+    )
+    await _unindex_items(session, sorted(saved))
+    await _index_items(session, [row for row in rows if row["filename"] in saved])
+    return saved
+
+
+async def delete_records(session: AsyncSession, filenames: list[str]) -> set[str]:
+    """Удаляет инвойсы и вычитает их из сводок и каталога; вызывающий держит ``lock_invoices``."""
+    deleted = (
+        await session.execute(
+            delete(InvoiceRecord).where(InvoiceRecord.filename.in_(filenames)).returning(*_ROLLUP_COLUMNS)
+        )
+    ).mappings().all()
+    await _update_rollups(session, [(row, -1) for row in deleted])
+    filenames = {row["filename"] for row in deleted}
+    await _unindex_items(session, sorted(filenames))
+    return filenames
+
+
+def _revision_row(filename: str, entry: dict) -> dict[str, Any]:
+    return {
+        "filename": filename,
+        "rev": entry["rev"],
+        "saved_at": entry["saved_at"],
+        "saved_by": entry["saved_by"],
+        "snapshot": entry.get("snapshot"),
+        "patch": entry.get("patch"),
+    }
+
+
+def _last_snapshot(filename: str, rev: int | None = None):
+    """Номер последнего снимка не позже ``rev`` — с него начинается восстановление."""
+    stmt = select(func.max(InvoiceRevision.rev)).where(
+        InvoiceRevision.filename == filename, InvoiceRevision.snapshot.isnot(None)
+    )
+    if rev is not None:
+        stmt = stmt.where(InvoiceRevision.rev <= rev)
+    return stmt.scalar_subquery()
+
+
+async def _replay(session: AsyncSession, filename: str, rev: int) -> dict | None:
+    rows = await session.execute(
+        select(InvoiceRevision.snapshot, InvoiceRevision.patch)
+        .where(
+            InvoiceRevision.filename == filename,
+            InvoiceRevision.rev <= rev,
+            InvoiceRevision.rev >= _last_snapshot(filename, rev),
+        )
+        .order_by(InvoiceRevision.rev)
+    )
+    return replay(
+        {"snapshot": snapshot} if snapshot is not None else {"patch": patch} for snapshot, patch in rows
+    )
+
+
+class PostgresInvoiceRepository(InvoiceRepository):
+    """Инвойсы в Postgres (JSONB). Подходит для нескольких воркеров и узлов."""
+
+    def __init__(
+        self, session_factory: async_sessionmaker[AsyncSession], snapshot_every: int | None = None
+    ) -> None:
+        self.session_factory = session_factory
+        self.snapshot_every = snapshot_every or get_settings().invoice_revision_snapshot_every
+
+    async def list_page(
+        self,
+        limit: int | None = None,
+        after: str | None = None,
+        filters: dict[str, Any] | None = None,
+    ) -> tuple[list[dict], str | None]:
+        stmt = select(InvoiceRecord).options(_LIST_COLUMNS)
+        for name, value in (filters or {}).items():
+            if value is not None:
+                stmt = stmt.where(_FILTERS[name](value))
+        if after:
+            micros, filename = decode_cursor(after)
+            stmt = stmt.where(
+                tuple_(InvoiceRecord.updated_at, InvoiceRecord.filename)
+                < tuple_(_from_micros(micros), filename)
+            )
+        stmt = stmt.order_by(InvoiceRecord.updated_at.desc(), InvoiceRecord.filename.desc())
+        if limit is not None:
+            stmt = stmt.limit(limit + 1)
+
+        try:
+            async with self.session_factory() as session:
+                records = list((await session.execute(stmt)).scalars().all())
+        except SQLAlchemyError as e:
+            raise InvoiceStorageError(str(e)) from e
+
+        next_cursor = None
+        if limit is not None and len(records) > limit:
+            records = records[:limit]
+            last = records[-1]
+            next_cursor = encode_cursor(_to_micros(last.updated_at), last.filename)
+        return [_entry(record) for record in records], next_cursor
+
+    async def list_version(self) -> Hashable | None:
+        # Удаление не меняет max(updated_at), поэтому в версию входит и число записей
+        try:
+            async with self.session_factory() as session:
+                row = (await session.execute(
+                    select(func.count(), func.max(InvoiceRecord.updated_at))
+                )).one()
+        except SQLAlchemyError as e:
+            raise InvoiceStorageError(str(e)) from e
+        return tuple(row)
+
+    async def search(self, query: str, limit: int = 50) -> list[dict]:
+        terms = tokenize(query)
+        if not terms:
+            return []
+        # Каждый термин — префикс; стемминг делает конфигурация 'russian'
+        tsquery = func.to_tsquery(_TS_CONFIG, " & ".join(f"{term}:*" for term in terms))
+        vector = func.to_tsvector(_TS_CONFIG, InvoiceRecord.search_text)
+        stmt = (
+            select(InvoiceRecord)
+            .options(_LIST_COLUMNS)
+            .where(vector.op("@@")(tsquery))
+            .order_by(func.ts_rank(vector, tsquery).desc(), InvoiceRecord.updated_at.desc())
+            .limit(limit)
+        )
+        try:
+            async with self.session_factory() as session:
+                records = (await session.execute(stmt)).scalars().all()
+        except SQLAlchemyError as e:
+            raise InvoiceStorageError(str(e)) from e
+        return [_entry(record) for record in records]
+
+    async def stats(self, recipients_limit: int = 20) -> dict[str, Any]:
+        # Сводки поддерживаются при записи (invoice_rollups): цена запроса не зависит от размера архива
+        columns = (
+            InvoiceRollup.dimension,
+            InvoiceRollup.key,
+            InvoiceRollup.currency,
+            InvoiceRollup.count,
+            InvoiceRollup.total,
+        )
+        others = (
+            select(*columns)
+            .where(InvoiceRollup.dimension != "recipient")
+            .order_by(InvoiceRollup.dimension, InvoiceRollup.key.desc(), InvoiceRollup.currency)
+        )
+        recipients = (
+            select(*columns)
+            .where(InvoiceRollup.dimension == "recipient")
+            .order_by(InvoiceRollup.total.desc())
+            .limit(recipients_limit)
+        )
+        buckets: dict[str, list[dict]] = {dimension: [] for dimension in ROLLUP_DIMENSIONS}
+        try:
+            async with self.session_factory() as session:
+                rows = [*(await session.execute(others)), *(await session.execute(recipients))]
+        except SQLAlchemyError as e:
+            raise InvoiceStorageError(str(e)) from e
+        for row in rows:
+            buckets[row.dimension].append({
+                "key": row.key or None,
+                "currency": row.currency,
+                "count": row.count,
+                "total": round(row.total, 2),
+            })
+        return {
+            "count": sum(bucket["count"] for bucket in buckets["currency"]),
+            "by_month": buckets["month"],
+            "by_recipient": buckets["recipient"],
+            "by_currency": buckets["currency"],
+            "by_document_type": buckets["documentType"],
+        }
+
+    async def catalog(self, prefix: str, limit: int = 20) -> list[dict]:
+        low = catalog_key(prefix)
+        if not low:
+            return []
+        high = low[:-1] + chr(ord(low[-1]) + 1)
+        # Каталог поддерживается при записи (item_catalog): три диапазона по индексам ключей
+        stmt = (
+            select(CatalogItem)
+            .where(or_(*(
+                (key >= low) & (key < high)
+                for key in (CatalogItem.model_key, CatalogItem.name_key, CatalogItem.description_key)
+            )))
+            .order_by(CatalogItem.uses.desc(), CatalogItem.date.desc())
+            .limit(limit)
+        )
+        try:
+            async with self.session_factory() as session:
+                items = (await session.execute(stmt)).scalars().all()
+        except SQLAlchemyError as e:
+            raise InvoiceStorageError(str(e)) from e
+        return [
+            {
+                "model": item.model,
+                "name": item.name,
+                "description": item.description,
+                "price": item.price,
+                "currency": item.currency,
+                "unit": item.unit,
+                "hsCode": item.hs_code,
+                "countryOfOrigin": item.country,
+                "reducerSpecs": item.reducer_specs,
+                "uses": item.uses,
+                "date": item.date or None,
+                "filename": item.filename,
+            }
+            for item in items
+        ]
+
+    async def price_history(
+        self, model: str | None = None, description: str | None = None, limit: int = 100
+    ) -> dict[str, Any]:
+        conditions = [InvoiceItem.price > 0]
+        if model:
+            conditions.append(InvoiceItem.model_key == catalog_key(model))
+        if description:
+            conditions.append(InvoiceItem.description_key == catalog_key(description))
+        count = func.count().label("count")
+        aggregates_stmt = (
+            select(
+                InvoiceItem.currency,
+                count,
+                func.min(InvoiceItem.price).label("min"),
+                func.avg(InvoiceItem.price).label("avg"),
+                func.max(InvoiceItem.price).label("max"),
+            )
+            .where(*conditions)
+            .group_by(InvoiceItem.currency)
+            .order_by(count.desc(), InvoiceItem.currency)
+        )
+        history_stmt = (
+            select(InvoiceItem, InvoiceRecord.number, InvoiceRecord.recipient)
+            .join(InvoiceRecord, InvoiceRecord.filename == InvoiceItem.filename)
+            .where(*conditions)
+            .order_by(InvoiceItem.date.desc(), InvoiceItem.updated_at.desc())
+            .limit(limit)
+        )
+        try:
+            async with self.session_factory() as session:
+                aggregates = (await session.execute(aggregates_stmt)).all()
+                rows = (await session.execute(history_stmt)).all()
+        except SQLAlchemyError as e:
+            raise InvoiceStorageError(str(e)) from e
+        return {
+            "aggregates": [
+                {"currency": row.currency, "count": row.count, "min": row.min,
+                 "avg": round(row.avg, 2), "max": row.max}
+                for row in aggregates
+            ],
+            "history": [
+                {"date": item.date or None, "price": item.price, "quantity": item.quantity,
+                 "currency": item.currency, "model": item.model, "name": item.name,
+                 "description": item.description, "number": number,
+                 "recipient": recipient, "filename": item.filename}
+                for item, number, recipient in rows
+            ],
+        }
+
+    async def get(self, filename: str) -> dict | None:
+        try:
+            async with self.session_factory() as session:
+                return await session.scalar(
+                    select(InvoiceRecord.data).where(InvoiceRecord.filename == filename)
+                )
+        except SQLAlchemyError as e:
+            raise InvoiceStorageError(str(e)) from e
+
+    async def version(self, filename: str) -> Hashable | None:
+        try:
+            async with self.session_factory() as session:
+                return await session.scalar(
+                    select(InvoiceRecord.updated_at).where(InvoiceRecord.filename == filename)
+                )
+        except SQLAlchemyError as e:
+            raise InvoiceStorageError(str(e)) from e
+
+    async def save(
+        self, filename: str, data: dict, precondition: Precondition | None = None
+    ) -> str | None:
+        values = record_values(filename, data)
+        try:
+            async with self.session_factory() as session, session.begin():
+                # Блокировка на инвойс: условие записи, ревизии и сводки — без гонок между узлами
+                await lock_invoices(session, [filename])
+                previous, version = (
+                    await session.execute(
+                        select(InvoiceRecord.data, InvoiceRecord.updated_at).where(
+                            InvoiceRecord.filename == filename
+                        )
+                    )
+                ).one_or_none() or (None, None)
+                if precondition is not None and not precondition(version):
+                    raise InvoiceVersionConflictError(f"Invoice {filename} was modified")
+                await upsert_records(session, [values])
+                await self._record_revisions(session, filename, previous, data)
+                if values["number_date"] is not None:
+                    # Номер занят — резервация больше не нужна
+                    await session.execute(
+                        delete(InvoiceNumberReservation).where(
+                            InvoiceNumberReservation.number
+                            == f"{values['number_date']}-{values['number_seq']}"
+                        )
+                    )
+        except SQLAlchemyError as e:
+            raise InvoiceStorageError(f"Failed to save invoice: {e}") from e
+        return None
+
+    async def save_many(
+        self, items: list[tuple[str, dict]], overwrite: bool = True, batch_size: int = 200
+    ) -> dict[str, str]:
+        errors: dict[str, str] = {}
+        for start in range(0, len(items), batch_size):
+            rows = [record_values(filename, data) for filename, data in items[start:start + batch_size]]
+            numbers = [
+                f"{row['number_date']}-{row['number_seq']}" for row in rows if row["number_date"] is not None
+            ]
+            try:
+                async with self.session_factory() as session, session.begin():
+                    await lock_invoices(session, [row["filename"] for row in rows])
+                    saved = await upsert_records(session, rows, overwrite)
+                    if saved:
+                        await self._record_snapshots(
+                            session, [(row["filename"], row["data"]) for row in rows if row["filename"] in saved]
+                        )
+                    if numbers:
+                        await session.execute(
+                            delete(InvoiceNumberReservation).where(InvoiceNumberReservation.number.in_(numbers))
+                        )
+            except SQLAlchemyError as e:
+                errors.update((row["filename"], f"Failed to save invoice: {e}") for row in rows)
+                continue
+            errors.update(
+                (row["filename"], "Invoice already exists") for row in rows if row["filename"] not in saved
+            )
+        return errors
+
+    async def delete(self, filename: str) -> bool:
+        try:
+            async with self.session_factory() as session, session.begin():
+                await lock_invoices(session, [filename])
+                deleted = await delete_records(session, [filename])
+        except SQLAlchemyError as e:
+            raise InvoiceStorageError(f"Failed to delete invoice: {e}") from e
+        return bool(deleted)
+
+    async def revisions(self, filename: str) -> list[dict]:
+        try:
+            async with self.session_factory() as session:
+                rows = await session.execute(
+                    select(
+                        InvoiceRevision.rev,
+                        InvoiceRevision.saved_at,
+                        InvoiceRevision.saved_by,
+                        InvoiceRevision.snapshot.isnot(None),
+                    )
+                    .where(InvoiceRevision.filename == filename)
+                    .order_by(InvoiceRevision.rev)
+                )
+                return [
+                    {"rev": rev, "saved_at": saved_at, "saved_by": saved_by, "snapshot": snapshot}
+                    for rev, saved_at, saved_by, snapshot in rows
+                ]
+        except SQLAlchemyError as e:
+            raise InvoiceStorageError(str(e)) from e
+
+    async def get_revision(self, filename: str, rev: int) -> dict | None:
+        try:
+            async with self.session_factory() as session:
+                exists = await session.scalar(
+                    select(InvoiceRevision.rev).where(
+                        InvoiceRevision.filename == filename, InvoiceRevision.rev == rev
+                    )
+                )
+                return await _replay(session, filename, rev) if exists is not None else None
+        except SQLAlchemyError as e:
+            raise InvoiceStorageError(str(e)) from e
+
+    async def _record_revisions(
+        self, session: AsyncSession, filename: str, previous: dict | None, data: dict
+    ) -> None:
+        last_rev, last_snapshot_rev = (
+            await session.execute(
+                select(func.max(InvoiceRevision.rev), _last_snapshot(filename)).where(
+                    InvoiceRevision.filename == filename
+                )
+            )
+        ).one()
+        head = await _replay(session, filename, last_rev) if last_rev else None
+        entries = plan_revisions(
+            last_rev or 0, last_snapshot_rev or 0, head, previous, data, self.snapshot_every
+        )
+        if entries:
+            await session.execute(
+                insert(InvoiceRevision).values([_revision_row(filename, entry) for entry in entries])
+            )
+
+    async def _record_snapshots(self, session: AsyncSession, items: list[tuple[str, dict]]) -> None:
+        # Массовый импорт: по снимку на инвойс, без сравнения с предыдущей версией
+        filenames = [filename for filename, _ in items]
+        last = dict(
+            (
+                await session.execute(
+                    select(InvoiceRevision.filename, func.max(InvoiceRevision.rev))
+                    .where(InvoiceRevision.filename.in_(filenames))
+                    .group_by(InvoiceRevision.filename)
+                )
+            ).all()
+        )
+        await session.execute(
+            insert(InvoiceRevision).values([
+                _revision_row(filename, snapshot_entry(last.get(filename, 0) + 1, data))
+                for filename, data in items
+            ])
+        )
+
+    async def next_number(self, date_key: str, reserve_ttl: float = 0) -> str:
+        key = date_key.lower()
+        now = datetime.now(timezone.utc)
+        try:
+            async with self.session_factory() as session, session.begin():
+                # Транзакционная блокировка на дату сериализует выдачу номеров между узлами
+                await session.execute(select(func.pg_advisory_xact_lock(func.hashtext(key))))
+                await session.execute(
+                    delete(InvoiceNumberReservation).where(InvoiceNumberReservation.expires_at <= now)
+                )
+                saved = await session.scalar(
+                    select(func.max(InvoiceRecord.number_seq)).where(InvoiceRecord.number_date == key)
+                )
+                reserved = await session.scalar(
+                    select(func.max(InvoiceNumberReservation.number_seq)).where(
+                        InvoiceNumberReservation.number_date == key
+                    )
+                )
+                next_seq = max(saved or 0, reserved or 0) + 1
+                if reserve_ttl > 0:
+                    session.add(
+                        InvoiceNumberReservation(
+                            number=f"{key}-{next_seq}",
+                            number_date=key,
+                            number_seq=next_seq,
+                            expires_at=now + timedelta(seconds=reserve_ttl),
+                        )
+                    )
+        except SQLAlchemyError as e:
+            raise InvoiceStorageError(str(e)) from e
+        return f"{date_key}-{next_seq:02d}"
+
+    async def release_number(self, number: str) -> bool:
+        number_date, number_seq = number_parts(number)
+        if number_date is None:
+            return False
+        try:
+            async with self.session_factory() as session, session.begin():
+                result = await session.execute(
+                    delete(InvoiceNumberReservation).where(
+                        InvoiceNumberReservation.number == f"{number_date}-{number_seq}"
+                    )
+                )
+        except SQLAlchemyError as e:
+            raise InvoiceStorageError(str(e)) from e
+        return result.rowcount > 0
@@ -129,3 +129,117 @@ class Invoice(BaseModel):
         populate_by_name=True,
     )
 
+
+
+class InvoiceListQuery(BaseModel):
+    """Параметры списка инвойсов: курсорная пагинация, фильтры и проекция полей."""
+    limit: Optional[int] = Field(default=None, ge=1, le=1000)
+    after: Optional[str] = None  # Курсор из заголовка X-Next-Cursor предыдущей страницы
+    fields: Optional[str] = None  # Список полей через запятую, например "number,total"
+
+    date_from: Optional[str] = None  # YYYY-MM-DD, включительно
+    date_to: Optional[str] = None
+    documentType: Optional[str] = None
+    currency: Optional[str] = None
+    organizationId: Optional[str] = None
+    total_min: Optional[float] = None
+    total_max: Optional[float] = None
+
+
+class InvoiceExportRequest(BaseModel):
+    """Выгрузка в ZIP: явный список файлов или фильтр списка (по умолчанию — весь архив)."""
+    filenames: Optional[List[str]] = None
+    filter: InvoiceListQuery = Field(default_factory=InvoiceListQuery)
+    include_json: bool = True
+    include_pdf: bool = True
+
+
+class InvoiceImportError(BaseModel):
+    source: str  # Имя файла в ZIP или "line N" для NDJSON
+    filename: Optional[str] = None
+    error: str
+
+
+class InvoiceImportResult(BaseModel):
+    total: int
+    imported: int
+    failed: int
+    dry_run: bool = False
+    filenames: List[str] = Field(default_factory=list)
+    errors: List[InvoiceImportError] = Field(default_factory=list)
+
+
+class InvoiceStatsBucket(BaseModel):
+    """Итог по одному значению измерения в одной валюте."""
+    key: Optional[str] = None  # Месяц YYYY-MM, получатель или тип документа; None — не указан
+    currency: str
+    count: int
+    total: float
+
+
+class InvoiceStats(BaseModel):
+    """Сводка по архиву; суммы в разных валютах не смешиваются."""
+    count: int
+    by_month: List[InvoiceStatsBucket]
+    by_recipient: List[InvoiceStatsBucket]
+    by_currency: List[InvoiceStatsBucket]
+    by_document_type: List[InvoiceStatsBucket]
+
+
+class InvoiceCatalogItem(BaseModel):
+    """Позиция каталога, собранного из всех инвойсов, — для автодополнения.
+
+    Поля позиции (цена, единица, ТН ВЭД, страна, параметры редуктора) — из самого
+    свежего инвойса с такой моделью, названием и описанием.
+    """
+    model: str
+    name: str
+    description: str
+    price: float
+    currency: str  # Валюта инвойса, из которого взята цена
+    unit: str
+    hsCode: str
+    countryOfOrigin: str
+    reducerSpecs: Dict[str, Any]
+    uses: int  # Сколько раз позиция встречается в архиве
+    date: Optional[str] = None  # Дата инвойса, из которого взята цена
+    filename: str
+
+
+class InvoicePricePoint(BaseModel):
+    """Цена позиции в одном инвойсе."""
+    date: Optional[str] = None  # Дата инвойса; None — не YYYY-MM-DD
+    price: float
+    quantity: float
+    currency: str
+    model: str
+    name: str
+    description: str
+    number: str
+    recipient: str
+    filename: str
+
+
+class InvoicePriceAggregate(BaseModel):
+    """Минимальная, средняя и максимальная цена в одной валюте."""
+    currency: str
+    count: int
+    min: float
+    avg: float
+    max: float
+
+
+class InvoicePriceHistory(BaseModel):
+    """История цен позиции: последние строки (новые первыми) и итоги по всем строкам."""
+    model: Optional[str] = None
+    description: Optional[str] = None
+    aggregates: List[InvoicePriceAggregate]
+    history: List[InvoicePricePoint]
+
+
+class InvoiceRevision(BaseModel):
+    """Ревизия из истории правок инвойса; данные — GET /invoices/{filename}/revisions/{rev}."""
+    rev: int
+    saved_at: str
+    saved_by: Optional[str] = None  # "external" — правка в обход API (PHP) или файл до истории
+    snapshot: bool  # Хранится полным снимком, а не патчем
@@ -0,0 +1,42 @@
+from typing import Any
+
+from pydantic import BaseModel, ConfigDict, field_validator
+
+
+class Organization(BaseModel):
+    """Организация-отправитель КП из js/organizations.js: реквизиты, изображения, банк.
+
+    Изображения (logo, stamp, signature) — пути относительно корня сайта. Поля,
+    которых нет в схеме, передаются как есть.
+    """
+    id: str
+    name: str = ""
+    shortName: str = ""
+    code: str = ""
+    INN_vektor: str = ""
+    address: str = ""
+    phone: str = ""
+    email: str = ""
+    logo: str = ""
+    stamp: str = ""
+    signature: str = ""
+
+    # Банковские реквизиты
+    bankName: str = ""
+    bankAddress: str = ""
+    account: str = ""
+    bik: str = ""
+    correspondentAccount: str = ""
+    beneficiary: str = ""
+
+    model_config = ConfigDict(extra='allow')
+
+    @field_validator('*', mode='before')
+    @classmethod
+    def scalar_to_str(cls, value: Any) -> Any:
+        """organizations.js может содержать null, числа и true/false — как в PDF, строкой."""
+        if value is None:
+            return ''
+        if isinstance(value, (bool, int, float)):
+            return str(value)
+        return value
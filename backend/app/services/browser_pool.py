@@ -0,0 +1,433 @@
+"""
+Пул долгоживущих браузеров Chromium для рендеринга PDF.
+
+Браузер перезапускается после ``max_renders`` рендеров, при превышении
+``max_rss_mb`` или если перестал отвечать; страницы с загруженной оболочкой
+шаблона (``shell``) держатся открытыми между рендерами.
+"""
+import asyncio
+import logging
+import os
+import secrets
+import time
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set, Tuple, TypeVar
+
+from playwright.async_api import Browser, Page, Playwright, async_playwright
+from playwright.async_api import Error as PlaywrightError
+
+from app.core.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+LAUNCH_ARGS = ["--no-sandbox", "--disable-setuid-sandbox", "--disable-dev-shm-usage", "--disable-gpu"]
+
+# Unknown switch added to each browser's command line to find its processes in /proc
+MARKER_SWITCH = "--kp-pdf-browser"
+
+# How long a health check waits for a browser to open a context
+PING_TIMEOUT = 5.0
+
+
+class BrowserCrashedError(RuntimeError):
+    """The browser serving a render disconnected in the middle of it."""
+
+
+class _Slot:
+    """One browser of the pool and its bookkeeping."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.browser: Optional[Browser] = None
+        self.marker = ""
+        self.active = 0
+        self.renders = 0
+        self.started_at = 0.0
+        self.retiring = False
+        # Idle pages kept open between renders, with the shell each one has loaded
+        self.pages: List[Tuple[str, Page]] = []
+
+    @property
+    def available(self) -> bool:
+        return self.browser is not None and not self.retiring and self.browser.is_connected()
+
+
+def process_tree_rss(markers: List[str]) -> Dict[str, int]:
+    """
+    Resident memory in bytes of the process tree of each browser (the process
+    whose command line has the marker switch, plus all its descendants).
+    Empty where /proc is not available.
+    """
+    if not os.path.isdir("/proc"):
+        return {}
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    wanted = set(markers)
+    parents: Dict[int, int] = {}
+    rss: Dict[int, int] = {}
+    roots: Dict[int, str] = {}
+    for entry in os.scandir("/proc"):
+        if not entry.name.isdigit():
+            continue
+        pid = int(entry.name)
+        try:
+            with open(f"/proc/{pid}/stat", "rb") as f:
+                stat = f.read()
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                cmdline = f.read().split(b"\0")
+        except OSError:
+            continue  # The process has exited
+        # The command name may contain spaces and parentheses: fields follow the last ")"
+        fields = stat[stat.rindex(b")") + 2:].split()
+        parents[pid] = int(fields[1])
+        rss[pid] = int(fields[21]) * page_size
+        for arg in cmdline:
+            marker = arg.decode("utf-8", "replace")
+            if marker in wanted:
+                roots[pid] = marker
+                break
+
+    children: Dict[int, List[int]] = {}
+    for pid, parent in parents.items():
+        children.setdefault(parent, []).append(pid)
+    totals = dict.fromkeys(markers, 0)
+    for root, marker in roots.items():
+        if roots.get(parents.get(root)) == marker:
+            continue  # A child that inherited the switch: counted with its parent
+        stack = [root]
+        while stack:
+            pid = stack.pop()
+            totals[marker] += rss.get(pid, 0)
+            stack.extend(children.get(pid, ()))
+    return totals
+
+
+class BrowserPool:
+    """Pool of ``browsers`` Chromium instances shared by all PDF renders of the process."""
+
+    def __init__(
+        self,
+        browsers: int = 2,
+        pages_per_browser: int = 4,
+        max_renders: int = 1000,
+        max_rss_mb: int = 1024,
+        health_interval: float = 30.0,
+        acquire_timeout: float = 30.0,
+        launch_args: Optional[List[str]] = None,
+    ):
+        self.pages_per_browser = pages_per_browser
+        self.max_renders = max_renders
+        self.max_rss_mb = max_rss_mb
+        self.health_interval = health_interval
+        self.acquire_timeout = acquire_timeout
+        self.launch_args = list(launch_args if launch_args is not None else LAUNCH_ARGS)
+        self.counters = {"renders": 0, "recycled": 0, "crashed": 0, "retried": 0}
+        self._slots = [_Slot(index) for index in range(browsers)]
+        self._playwright: Optional[Playwright] = None
+        self._started = False
+        self._closed = False
+        self._start_lock = asyncio.Lock()
+        # Guards slot bookkeeping; notified whenever a page or a browser frees up
+        self._changed = asyncio.Condition()
+        self._health_task: Optional[asyncio.Task] = None
+        self._tasks: Set[asyncio.Task] = set()
+        # Shell preloaded into the pages of every (re)launched browser
+        self._shell: Optional[str] = None
+
+    # --- Lifecycle ----------------------------------------------------------
+
+    async def start(self) -> None:
+        """Launches the browsers; a no-op when the pool is already running."""
+        if self._started:
+            return
+        async with self._start_lock:
+            if self._started:
+                return
+            self._closed = False
+            try:
+                await asyncio.gather(*(self._launch(slot) for slot in self._slots))
+            except BaseException:
+                await self._shutdown()
+                raise
+            self._started = True
+            if self.health_interval > 0:
+                self._health_task = asyncio.create_task(self._health_loop())
+            logger.info("PDF browser pool started: %d browsers", len(self._slots))
+
+    async def stop(self) -> None:
+        async with self._start_lock:
+            await self._shutdown()
+
+    async def _shutdown(self) -> None:
+        self._closed = True
+        self._started = False
+        for task in [self._health_task, *self._tasks]:
+            if task is not None:
+                task.cancel()
+        await asyncio.gather(*[t for t in [self._health_task, *self._tasks] if t is not None], return_exceptions=True)
+        self._health_task = None
+        for slot in self._slots:
+            browser, slot.browser = slot.browser, None
+            slot.pages = []
+            await self._close_browser(browser)
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+        async with self._changed:
+            self._changed.notify_all()
+
+    async def _launch_browser(self, marker: str) -> Browser:
+        if self._playwright is None:
+            self._playwright = await async_playwright().start()
+        return await self._playwright.chromium.launch(headless=True, args=[*self.launch_args, marker])
+
+    async def _launch(self, slot: _Slot) -> None:
+        marker = f"{MARKER_SWITCH}={secrets.token_hex(6)}"
+        browser = await self._launch_browser(marker)
+        browser.on("disconnected", lambda _: self._on_disconnected(slot, browser))
+        async with self._changed:
+            slot.browser = browser
+            slot.marker = marker
+            slot.renders = 0
+            slot.retiring = False
+            slot.started_at = time.monotonic()
+            slot.pages = []
+            self._changed.notify_all()
+        if self._shell is not None:
+            self._spawn(self._warm_slot(slot, self._shell))
+
+    @staticmethod
+    async def _close_browser(browser: Optional[Browser]) -> None:
+        if browser is None:
+            return
+        try:
+            await browser.close()
+        except PlaywrightError:
+            pass  # Already gone
+
+    def _on_disconnected(self, slot: _Slot, browser: Browser) -> None:
+        # Browsers closed by the pool are detached from their slot first
+        if slot.browser is not browser or self._closed:
+            return
+        logger.warning("PDF browser %d disconnected, relaunching", slot.index)
+        self.counters["crashed"] += 1
+        slot.browser = None
+        slot.pages = []
+        self._spawn(self._relaunch(slot))
+
+    def _retire(self, slot: _Slot, reason: str) -> None:
+        """Stops handing out the browser and replaces it once its renders finish."""
+        if slot.retiring:
+            return
+        logger.info("Recycling PDF browser %d (%s)", slot.index, reason)
+        slot.retiring = True
+        self.counters["recycled"] += 1
+        self._spawn(self._relaunch(slot))
+
+    def _spawn(self, coro: Awaitable[None]) -> None:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _relaunch(self, slot: _Slot) -> None:
+        async with self._changed:
+            await self._changed.wait_for(lambda: slot.active == 0 or self._closed)
+            browser, slot.browser = slot.browser, None
+            slot.pages = []
+        await self._close_browser(browser)
+        delay = 1.0
+        while not self._closed:
+            try:
+                await self._launch(slot)
+                return
+            except PlaywrightError as e:
+                logger.error("Failed to relaunch PDF browser %d: %s", slot.index, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+
+    # --- Rendering ----------------------------------------------------------
+
+    async def _acquire(self) -> _Slot:
+        async with self._changed:
+            while True:
+                if self._closed:
+                    raise RuntimeError("PDF browser pool is closed")
+                free = [s for s in self._slots if s.available and s.active < self.pages_per_browser]
+                if free:
+                    slot = min(free, key=lambda s: s.active)
+                    slot.active += 1
+                    return slot
+                await self._changed.wait()
+
+    async def _release(self, slot: _Slot) -> None:
+        async with self._changed:
+            slot.active -= 1
+            slot.renders += 1
+            self.counters["renders"] += 1
+            if self.max_renders and slot.renders >= self.max_renders:
+                self._retire(slot, f"{slot.renders} renders")
+            self._changed.notify_all()
+
+    @staticmethod
+    async def _new_page(browser: Browser, shell: Optional[str]) -> Page:
+        page = await browser.new_page()
+        if shell is not None:
+            # The shell is self-contained: "load" is reached without the network
+            await page.set_content(shell)
+        return page
+
+    @staticmethod
+    def _take_page(slot: _Slot, shell: Optional[str]) -> Optional[Page]:
+        if shell is None:
+            return None
+        for i, (loaded, page) in enumerate(slot.pages):
+            if loaded == shell:
+                del slot.pages[i]
+                return page
+        return None
+
+    async def _keep_page(self, slot: _Slot, browser: Browser, shell: str, page: Page) -> None:
+        """Returns a page to its browser's idle pages (the oldest one is closed when full)."""
+        if slot.browser is not browser or slot.retiring:
+            await page.close()
+            return
+        slot.pages.append((shell, page))
+        while len(slot.pages) > self.pages_per_browser:
+            _, oldest = slot.pages.pop(0)
+            await oldest.close()
+
+    async def _warm_slot(self, slot: _Slot, shell: str) -> None:
+        browser = slot.browser
+        if browser is None:
+            return
+        missing = self.pages_per_browser - sum(1 for loaded, _ in slot.pages if loaded == shell)
+        try:
+            pages = await asyncio.gather(*(self._new_page(browser, shell) for _ in range(missing)))
+            for page in pages:
+                await self._keep_page(slot, browser, shell, page)
+        except PlaywrightError as e:
+            logger.warning("Failed to warm up PDF browser %d: %s", slot.index, e)
+
+    async def warm(self, shell: str) -> None:
+        """
+        Preloads ``shell`` into ``pages_per_browser`` idle pages of every browser;
+        browsers launched later (recycled, crashed) are warmed up the same way.
+        """
+        await self.start()
+        self._shell = shell
+        await asyncio.gather(*(self._warm_slot(slot, shell) for slot in self._slots))
+
+    @asynccontextmanager
+    async def page(self, shell: Optional[str] = None) -> AsyncIterator[Page]:
+        """
+        A page of a pooled browser. Without ``shell`` it is a fresh page, closed
+        afterwards; with it, a page that has ``shell`` loaded and is kept for the
+        next render with the same shell if this one succeeds.
+        """
+        await self.start()
+        try:
+            slot = await asyncio.wait_for(self._acquire(), self.acquire_timeout)
+        except asyncio.TimeoutError:
+            raise RuntimeError("No PDF browser available") from None
+        browser = slot.browser
+        page = None
+        reusable = False
+        try:
+            page = self._take_page(slot, shell) or await self._new_page(browser, shell)
+            yield page
+            reusable = shell is not None
+        except PlaywrightError as e:
+            if not browser.is_connected():
+                raise BrowserCrashedError(str(e)) from e
+            raise
+        finally:
+            if page is not None and browser.is_connected():
+                try:
+                    if reusable:
+                        await self._keep_page(slot, browser, shell, page)
+                    else:
+                        await page.close()
+                except PlaywrightError:
+                    pass
+            await self._release(slot)
+
+    async def run(self, render: Callable[[Page], Awaitable[T]], shell: Optional[str] = None) -> T:
+        """
+        Runs ``render(page)`` on a pooled page (see :meth:`page` for ``shell``).
+        A render whose browser crashed under it is retried once (on the next
+        available browser).
+        """
+        try:
+            async with self.page(shell) as page:
+                return await render(page)
+        except BrowserCrashedError as e:
+            logger.warning("PDF render lost its browser, retrying: %s", e)
+            self.counters["retried"] += 1
+        async with self.page(shell) as page:
+            return await render(page)
+
+    # --- Health ---------------------------------------------------------------
+
+    async def _health_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_interval)
+            try:
+                await self.check_health()
+            except Exception:
+                logger.exception("PDF browser health check failed")
+
+    async def _ping(self, browser: Browser) -> bool:
+        try:
+            context = await asyncio.wait_for(browser.new_context(), PING_TIMEOUT)
+            await context.close()
+        except (PlaywrightError, asyncio.TimeoutError):
+            return False
+        return True
+
+    async def check_health(self) -> None:
+        """Recycles browsers that do not respond or use more than ``max_rss_mb``."""
+        slots = [slot for slot in self._slots if slot.browser is not None and not slot.retiring]
+        rss = {}
+        if self.max_rss_mb:
+            rss = await asyncio.to_thread(process_tree_rss, [slot.marker for slot in slots])
+        for slot in slots:
+            browser = slot.browser
+            if browser is None or slot.retiring:
+                continue
+            if not browser.is_connected():
+                self._on_disconnected(slot, browser)
+            elif not await self._ping(browser):
+                self._retire(slot, "not responding")
+            elif rss.get(slot.marker, 0) > self.max_rss_mb * 2**20:
+                self._retire(slot, f"RSS {rss[slot.marker] // 2**20} MB")
+
+    def status(self) -> List[Dict]:
+        """State of every browser: whether it is up, renders in flight and in total, idle pages, uptime."""
+        now = time.monotonic()
+        return [
+            {
+                "browser": slot.index,
+                "connected": slot.browser is not None and slot.browser.is_connected(),
+                "retiring": slot.retiring,
+                "active": slot.active,
+                "renders": slot.renders,
+                "idle_pages": len(slot.pages),
+                "uptime_s": round(now - slot.started_at, 1) if slot.browser is not None else None,
+            }
+            for slot in self._slots
+        ]
+
+
+@lru_cache
+def get_browser_pool() -> BrowserPool:
+    """Process-wide browser pool; started by the application lifespan (or the first render)."""
+    settings = get_settings()
+    return BrowserPool(
+        browsers=settings.pdf_browser_pool_size,
+        pages_per_browser=settings.pdf_pages_per_browser,
+        max_renders=settings.pdf_browser_max_renders,
+        max_rss_mb=settings.pdf_browser_max_rss_mb,
+        health_interval=settings.pdf_browser_health_interval,
+    )
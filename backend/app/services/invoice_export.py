@@ -0,0 +1,131 @@
+"""
+Потоковая выгрузка инвойсов в ZIP (JSON и/или PDF).
+
+PDF рендерятся окном по несколько штук и пишутся в порядке запроса; память
+ограничена окном рендеринга, а не размером выгрузки.
+"""
+import asyncio
+import io
+import os
+import zipfile
+from collections import deque
+from datetime import datetime
+from itertools import islice
+from typing import AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from app.services.invoice_service import InvoiceService
+from app.services.pdf_service import PdfService
+from app.utils import jsonio
+
+
+class _ZipSink(io.RawIOBase):
+    """Write-only, unseekable buffer that is emptied by ``drain()``."""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+# (filename, invoice JSON, PDF bytes, error message)
+_Rendered = Tuple[str, Optional[bytes], Optional[bytes], Optional[str]]
+
+
+class InvoiceExport:
+    def __init__(
+        self,
+        service: InvoiceService,
+        pdf_service: PdfService,
+        filenames: List[str],
+        include_json: bool = True,
+        include_pdf: bool = True,
+        concurrency: int = 3,
+    ):
+        self.service = service
+        self.pdf_service = pdf_service
+        self.filenames = filenames
+        self.include_json = include_json
+        self.include_pdf = include_pdf
+        self.concurrency = concurrency
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def _render(self, filename: str) -> _Rendered:
+        try:
+            invoice = await self.service.get_invoice(filename)
+        except HTTPException as e:
+            return filename, None, None, str(e.detail)
+
+        document = None
+        if self.include_json:
+            document = jsonio.dumps_document(invoice.model_dump(by_alias=True, exclude_none=True))
+        pdf = None
+        if self.include_pdf:
+            async with self._semaphore:
+                try:
+                    pdf = await self.pdf_service.generate_pdf(
+                        invoice.model_dump(by_alias=True, exclude_none=False)
+                    )
+                except HTTPException as e:
+                    return filename, document, None, str(e.detail)
+        return filename, document, pdf, None
+
+    @staticmethod
+    def _entry(name: str, compress_type: int) -> zipfile.ZipInfo:
+        info = zipfile.ZipInfo(name, date_time=datetime.now().timetuple()[:6])
+        info.compress_type = compress_type
+        return info
+
+    async def stream(self) -> AsyncIterator[bytes]:
+        """Yields the ZIP archive chunk by chunk."""
+        sink = _ZipSink()
+        errors: Dict[str, str] = {}
+        names = iter(self.filenames)
+        # Rendering runs ahead of the writer by a bounded window; results are written in order
+        window = self.concurrency * 2
+        pending: Deque[asyncio.Task[_Rendered]] = deque(
+            asyncio.ensure_future(self._render(name)) for name in islice(names, window)
+        )
+        try:
+            with zipfile.ZipFile(sink, "w") as archive:
+                while pending:
+                    filename, document, pdf, error = await pending.popleft()
+                    following = next(names, None)
+                    if following is not None:
+                        pending.append(asyncio.ensure_future(self._render(following)))
+
+                    stem = os.path.splitext(filename)[0]
+                    if document is not None:
+                        entry = self._entry(f"json/{filename}", zipfile.ZIP_DEFLATED)
+                        archive.writestr(entry, document)
+                    if pdf is not None:
+                        # PDF streams are compressed already
+                        archive.writestr(self._entry(f"pdf/{stem}.pdf", zipfile.ZIP_STORED), pdf)
+                    if error is not None:
+                        errors[filename] = error
+                    chunk = sink.drain()
+                    if chunk:
+                        yield chunk
+
+                if errors:
+                    archive.writestr(
+                        self._entry("errors.json", zipfile.ZIP_DEFLATED),
+                        jsonio.dumps_document(errors),
+                    )
+            yield sink.drain()
+        finally:
+            # Client went away: stop rendering what nobody will receive
+            for task in pending:
+                task.cancel()
@@ -0,0 +1,131 @@
+"""
+Массовый импорт инвойсов из NDJSON или ZIP с JSON-файлами.
+
+Валидация идёт в пуле процессов, запись — пакетами через ``save_many``.
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import BinaryIO, List, Optional, Tuple
+
+from pydantic import ValidationError
+
+from app.core.config import get_settings
+from app.schemas.invoice import Invoice
+from app.utils import jsonio
+
+# Records per task sent to a worker process; smaller imports are validated in-process
+CHUNK_SIZE = 100
+
+# Larger ZIP entries are rejected instead of being inflated into memory
+MAX_RECORD_SIZE = 5 * 1024 * 1024
+
+# (source, raw JSON text or None, read error)
+RawRecord = Tuple[str, Optional[str], Optional[str]]
+# (source, validated invoice or None, validation error)
+ValidatedRecord = Tuple[str, Optional[Invoice], Optional[str]]
+
+
+def read_records(fileobj: BinaryIO) -> List[RawRecord]:
+    """
+    Splits an upload into records: the ``*.json`` entries of a ZIP archive,
+    otherwise one record per non-empty NDJSON line. Sources are the entry
+    names or ``line N``.
+    """
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        records: List[RawRecord] = []
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                name = info.filename
+                if info.is_dir() or not name.endswith(".json") or name.startswith("__MACOSX/"):
+                    continue
+                if info.file_size > MAX_RECORD_SIZE:
+                    records.append((name, None, "File is too large"))
+                    continue
+                try:
+                    records.append((name, archive.read(info).decode("utf-8-sig"), None))
+                except (UnicodeDecodeError, zipfile.BadZipFile) as e:
+                    records.append((name, None, str(e)))
+        return records
+
+    fileobj.seek(0)
+    records = []
+    for number, line in enumerate(fileobj, start=1):
+        try:
+            text = line.decode("utf-8-sig" if number == 1 else "utf-8").strip()
+        except UnicodeDecodeError as e:
+            records.append((f"line {number}", None, str(e)))
+            continue
+        if text:
+            records.append((f"line {number}", text, None))
+    return records
+
+
+def _format_validation_error(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(part) for part in item['loc']) or 'invoice'}: {item['msg']}"
+        for item in error.errors()
+    )
+
+
+def validate_chunk(records: List[RawRecord]) -> List[ValidatedRecord]:
+    """Parses and validates records; runs in a worker process."""
+    result: List[ValidatedRecord] = []
+    for source, text, error in records:
+        if error is not None or text is None:
+            result.append((source, None, error or "Empty record"))
+            continue
+        try:
+            raw = jsonio.loads(text)
+        except json.JSONDecodeError as e:
+            result.append((source, None, f"Invalid JSON: {e}"))
+            continue
+        if not isinstance(raw, dict):
+            result.append((source, None, "Expected a JSON object"))
+            continue
+        try:
+            result.append((source, Invoice.model_validate(raw), None))
+        except ValidationError as e:
+            result.append((source, None, _format_validation_error(e)))
+    return result
+
+
+@lru_cache
+def get_validation_pool() -> ProcessPoolExecutor:
+    """
+    Process-wide pool for import validation. Workers are spawned rather than
+    forked: the API process runs threads (I/O pool, archive watcher) that a
+    fork would copy in an arbitrary state.
+    """
+    settings = get_settings()
+    return ProcessPoolExecutor(
+        max_workers=settings.invoice_import_workers or os.cpu_count(),
+        mp_context=multiprocessing.get_context("spawn"),
+    )
+
+
+def shutdown_validation_pool() -> None:
+    if get_validation_pool.cache_info().currsize:
+        get_validation_pool().shutdown(wait=False, cancel_futures=True)
+        get_validation_pool.cache_clear()
+
+
+async def validate_records(
+    records: List[RawRecord], pool: Optional[ProcessPoolExecutor] = None
+) -> List[ValidatedRecord]:
+    """Validates records in chunks across the process pool, keeping their order."""
+    if len(records) <= CHUNK_SIZE:
+        return await asyncio.to_thread(validate_chunk, records)
+
+    loop = asyncio.get_running_loop()
+    pool = pool or get_validation_pool()
+    chunks = await asyncio.gather(*(
+        loop.run_in_executor(pool, validate_chunk, records[start:start + CHUNK_SIZE])
+        for start in range(0, len(records), CHUNK_SIZE)
+    ))
+    return [record for chunk in chunks for record in chunk]
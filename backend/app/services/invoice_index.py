@@ -0,0 +1,1083 @@
+"""
+Постоянный SQLite-индекс архива инвойсов.
+
+Хранит поля списка, полнотекстовый поиск (FTS5), сводки, позиции и каталог
+позиций для каждого файла архива — плоского, разбитого по ``YYYY/MM/`` или
+упакованного; сверяется с архивом по mtime/size файлов.
+"""
+import base64
+import json
+import logging
+import os
+import re
+import sqlite3
+import secrets
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, ContextManager, Dict, Iterator, List, Optional, Tuple
+
+from app.core.config import get_settings
+from app.services.invoice_packs import (
+    packed_exists,
+    read_archive_file,
+    scan_packs,
+    split_packed,
+    stat_archive_file,
+)
+from app.utils import jsonio
+from app.utils.text import search_terms
+
+logger = logging.getLogger(__name__)
+
+# Bump when the schema or the extracted fields change: the index is then rebuilt
+# from the archive on the next reconcile.
+SCHEMA_VERSION = 8
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS invoices (
+    filename        TEXT PRIMARY KEY,
+    rel_path        TEXT NOT NULL,
+    mtime_ns        INTEGER NOT NULL,
+    size            INTEGER NOT NULL,
+    number          TEXT NOT NULL,
+    date            TEXT NOT NULL,
+    recipient       TEXT NOT NULL,
+    total           REAL NOT NULL,
+    currency        TEXT NOT NULL,
+    document_type   TEXT NOT NULL,
+    saved_at        TEXT NOT NULL,
+    organization_id TEXT,
+    number_date     TEXT,
+    number_seq      INTEGER,
+    canonical       INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS ix_invoices_mtime ON invoices (mtime_ns DESC, filename DESC);
+CREATE INDEX IF NOT EXISTS ix_invoices_date ON invoices (date);
+CREATE INDEX IF NOT EXISTS ix_invoices_document_type ON invoices (document_type, mtime_ns DESC);
+CREATE INDEX IF NOT EXISTS ix_invoices_organization ON invoices (organization_id, mtime_ns DESC);
+CREATE INDEX IF NOT EXISTS ix_invoices_number_seq ON invoices (number_date, number_seq);
+CREATE TABLE IF NOT EXISTS number_reservations (
+    number      TEXT PRIMARY KEY,
+    number_date TEXT NOT NULL,
+    number_seq  INTEGER NOT NULL,
+    expires_at  REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_number_reservations_seq ON number_reservations (number_date, number_seq);
+CREATE TABLE IF NOT EXISTS index_meta (
+    key   TEXT PRIMARY KEY,
+    value
+);
+CREATE TABLE IF NOT EXISTS invoice_rollups (
+    dimension TEXT NOT NULL,
+    key       TEXT NOT NULL,
+    currency  TEXT NOT NULL,
+    count     INTEGER NOT NULL,
+    total     REAL NOT NULL,
+    PRIMARY KEY (dimension, key, currency)
+);
+CREATE INDEX IF NOT EXISTS ix_invoice_rollups_total ON invoice_rollups (dimension, total DESC);
+CREATE TABLE IF NOT EXISTS invoice_revisions (
+    filename TEXT NOT NULL,
+    rev      INTEGER NOT NULL,
+    log_offset INTEGER NOT NULL,
+    log_length INTEGER NOT NULL,
+    snapshot INTEGER NOT NULL,
+    saved_at TEXT NOT NULL,
+    saved_by TEXT,
+    PRIMARY KEY (filename, rev)
+);
+CREATE TABLE IF NOT EXISTS invoice_items (
+    filename        TEXT NOT NULL,
+    position        INTEGER NOT NULL,
+    item_key        TEXT NOT NULL,
+    model_key       TEXT NOT NULL,
+    description_key TEXT NOT NULL,
+    model           TEXT NOT NULL,
+    name            TEXT NOT NULL,
+    description     TEXT NOT NULL,
+    price           REAL NOT NULL,
+    quantity        REAL NOT NULL,
+    unit            TEXT NOT NULL,
+    hs_code         TEXT NOT NULL,
+    country         TEXT NOT NULL,
+    reducer_specs   TEXT NOT NULL,
+    currency        TEXT NOT NULL,
+    date            TEXT NOT NULL,
+    mtime_ns        INTEGER NOT NULL,
+    PRIMARY KEY (filename, position)
+);
+CREATE INDEX IF NOT EXISTS ix_invoice_items_key ON invoice_items (item_key, date, mtime_ns);
+CREATE INDEX IF NOT EXISTS ix_invoice_items_model ON invoice_items (model_key, date);
+CREATE INDEX IF NOT EXISTS ix_invoice_items_description ON invoice_items (description_key, date);
+CREATE TABLE IF NOT EXISTS item_catalog (
+    item_key        TEXT PRIMARY KEY,
+    model_key       TEXT NOT NULL,
+    name_key        TEXT NOT NULL,
+    description_key TEXT NOT NULL,
+    model           TEXT NOT NULL,
+    name            TEXT NOT NULL,
+    description     TEXT NOT NULL,
+    price           REAL NOT NULL,
+    unit            TEXT NOT NULL,
+    hs_code         TEXT NOT NULL,
+    country         TEXT NOT NULL,
+    reducer_specs   TEXT NOT NULL,
+    currency        TEXT NOT NULL,
+    date            TEXT NOT NULL,
+    mtime_ns        INTEGER NOT NULL,
+    filename        TEXT NOT NULL,
+    uses            INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_item_catalog_model ON item_catalog (model_key);
+CREATE INDEX IF NOT EXISTS ix_item_catalog_name ON item_catalog (name_key);
+CREATE INDEX IF NOT EXISTS ix_item_catalog_description ON item_catalog (description_key);
+CREATE VIRTUAL TABLE IF NOT EXISTS invoice_search USING fts5 (
+    content,
+    tokenize = 'unicode61 remove_diacritics 2',
+    prefix = '2 3 4'
+);
+"""
+
+# Files read and indexed per reconcile transaction
+RECONCILE_BATCH = 500
+
+DERIVED_TABLES = ("invoice_search", "invoice_rollups", "item_catalog", "invoice_items", "invoices")
+
+# Rollup dimension -> key of an ``invoices`` row; totals are always split by currency
+ROLLUP_DIMENSIONS = ("month", "recipient", "currency", "documentType")
+
+SEARCH_ITEM_FIELDS = ("description", "model", "name")
+
+# Catalog columns of an ``invoice_items`` row (copied to ``item_catalog`` for the latest one)
+ITEM_COLUMNS = (
+    "model", "name", "description", "price", "unit", "hs_code", "country", "reducer_specs",
+    "currency", "date", "mtime_ns", "filename",
+)
+
+# Only full dates order catalog entries; anything else counts as older than all of them
+ITEM_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+# ``_metadata.version`` of files written by the FastAPI service: their content is
+# the dump of a validated ``Invoice`` and can be served as stored
+FASTAPI_VERSION = "2.0 (FastAPI)"
+
+# Sharded layout: <storage>/YYYY/MM/<filename>
+YEAR_DIR_RE = re.compile(r"^\d{4}$")
+MONTH_DIR_RE = re.compile(r"^(0[1-9]|1[0-2])$")
+SHARD_DATE_RE = re.compile(r"^(\d{4})-(0[1-9]|1[0-2])")
+
+# Sequence numbers look like DDMMYY-NN; the prefix is kept generic like the legacy scan
+NUMBER_RE = re.compile(r"^(.+)-(\d+)$")
+
+LIST_COLUMNS = (
+    "filename, number, date, recipient, total, currency, document_type, saved_at, organization_id"
+)
+
+# Keys of a list-view entry (the API names of LIST_COLUMNS)
+LIST_FIELDS = (
+    "filename", "number", "date", "recipient", "total", "currency",
+    "documentType", "saved_at", "organizationId",
+)
+
+# List filter name -> SQL condition
+LIST_FILTERS = {
+    "date_from": "date >= ?",
+    "date_to": "date <= ?",
+    "documentType": "document_type = ?",
+    "currency": "currency = ?",
+    "organizationId": "organization_id = ?",
+    "total_min": "total >= ?",
+    "total_max": "total <= ?",
+}
+
+
+def is_archive_file(name: str) -> bool:
+    # Temporary files of atomic writes (``*.json.tmp``) and dot-files are ignored
+    return name.endswith(".json") and not name.startswith(".")
+
+
+def shard_dir(data: dict, mtime: Optional[float] = None) -> str:
+    """
+    ``YYYY/MM`` shard of an invoice: its ``date`` field, or the file's mtime
+    (the current time when unknown) for invoices without a valid date.
+    """
+    match = SHARD_DATE_RE.match(str(data.get("date") or ""))
+    if match:
+        return f"{match.group(1)}/{match.group(2)}"
+    return time.strftime("%Y/%m", time.localtime(mtime))
+
+
+def shard_dirs(storage_path: str) -> List[str]:
+    """Existing ``YYYY/MM`` shard directories, relative to the archive."""
+    result = []
+    try:
+        years = sorted(entry.name for entry in os.scandir(storage_path)
+                       if entry.is_dir() and YEAR_DIR_RE.match(entry.name))
+    except FileNotFoundError:
+        return result
+    for year in years:
+        with os.scandir(os.path.join(storage_path, year)) as entries:
+            result.extend(
+                f"{year}/{entry.name}" for entry in sorted(entries, key=lambda e: e.name)
+                if entry.is_dir() and MONTH_DIR_RE.match(entry.name)
+            )
+    return result
+
+
+def scan_archive(storage_path: str) -> Dict[str, Tuple[str, os.stat_result]]:
+    """
+    All archive files of both layouts: filename -> (path relative to the archive, stat).
+    A name present in both places (an interrupted copy) resolves to the shard.
+    """
+    files = {}
+    for rel_dir in ["", *shard_dirs(storage_path)]:
+        with os.scandir(os.path.join(storage_path, rel_dir)) as entries:
+            for entry in entries:
+                if is_archive_file(entry.name) and entry.is_file():
+                    files[entry.name] = (f"{rel_dir}/{entry.name}" if rel_dir else entry.name, entry.stat())
+    return files
+
+
+def calculate_total(data: dict) -> float:
+    total = 0.0
+    items = data.get("items", [])
+    if isinstance(items, list):
+        for item in items:
+            if isinstance(item, dict):
+                try:
+                    q = float(item.get("quantity", 0))
+                    p = float(item.get("price", 0))
+                    total += q * p
+                except (ValueError, TypeError):
+                    pass
+    return total
+
+
+def list_fields(data: dict) -> Dict:
+    """Extracts the list-view fields from raw invoice data."""
+    metadata = data.get("_metadata")
+    if not isinstance(metadata, dict):
+        metadata = {}
+    return {
+        "number": str(data.get("number", "N/A")),
+        "date": str(data.get("date", "N/A")),
+        "recipient": str(data.get("recipient", "N/A")),
+        "total": calculate_total(data),
+        "currency": str(data.get("currency", "Руб.")),
+        "documentType": str(data.get("documentType", "regular")),
+        "saved_at": str(metadata.get("saved_at", "")),
+        "organizationId": data.get("organizationId", None),
+    }
+
+
+def is_canonical(data: dict) -> bool:
+    metadata = data.get("_metadata")
+    return isinstance(metadata, dict) and metadata.get("version") == FASTAPI_VERSION
+
+
+def number_parts(number: str) -> Tuple[Optional[str], Optional[int]]:
+    match = NUMBER_RE.match(number.strip())
+    if not match:
+        return None, None
+    return match.group(1).lower(), int(match.group(2))
+
+
+def search_text(data: dict) -> str:
+    """Raw text of the searchable invoice fields."""
+    parts = [
+        str(data.get(field) or "")
+        for field in ("number", "recipient", "recipientINN", "tenderId")
+    ]
+    items = data.get("items", [])
+    if isinstance(items, list):
+        for item in items:
+            if isinstance(item, dict):
+                parts.extend(str(item.get(field) or "") for field in SEARCH_ITEM_FIELDS)
+    return " ".join(part for part in parts if part)
+
+
+def _search_content(data: dict) -> str:
+    """Stemmed text of the searchable invoice fields."""
+    return " ".join(search_terms(search_text(data)))
+
+
+def _match_expression(query: str) -> Optional[str]:
+    """Builds an FTS5 query: every term must match as a prefix."""
+    terms = search_terms(query)
+    if not terms:
+        return None
+    return " AND ".join(f'"{term}"*' for term in terms)
+
+
+def _item_text(item: dict, *keys: str) -> str:
+    """First non-blank of ``keys`` with whitespace collapsed."""
+    for key in keys:
+        value = item.get(key)
+        if value is not None and str(value).strip():
+            return " ".join(str(value).split())
+    return ""
+
+
+def _item_number(value: Any) -> float:
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def item_fields(item: Any) -> Optional[Dict]:
+    """
+    Catalog fields of a raw line item (legacy ``type``/``country`` included), or
+    None for items without a model, name or description.
+    """
+    if not isinstance(item, dict):
+        return None
+    model = _item_text(item, "model")
+    name = _item_text(item, "name")
+    description = _item_text(item, "description", "type")
+    if not (model or name or description):
+        return None
+    specs = item.get("reducerSpecs")
+    return {
+        "model": model,
+        "name": name,
+        "description": description,
+        "price": _item_number(item.get("price")),
+        "quantity": _item_number(item.get("quantity")),
+        "unit": _item_text(item, "unit"),
+        "hsCode": _item_text(item, "hsCode"),
+        "countryOfOrigin": _item_text(item, "countryOfOrigin", "country"),
+        "reducerSpecs": specs if isinstance(specs, dict) else {},
+    }
+
+
+def catalog_key(text: str) -> str:
+    """Case- and whitespace-insensitive form of a catalog field, for matching."""
+    return " ".join(text.split()).casefold()
+
+
+def item_key(fields: Dict) -> str:
+    """Identity of a catalog item: its model, name and description."""
+    return "\x1f".join(catalog_key(fields[key]) for key in ("model", "name", "description"))
+
+
+def _catalog_entry(row: sqlite3.Row) -> Dict:
+    return {
+        "model": row["model"],
+        "name": row["name"],
+        "description": row["description"],
+        "price": row["price"],
+        "currency": row["currency"],
+        "unit": row["unit"],
+        "hsCode": row["hs_code"],
+        "countryOfOrigin": row["country"],
+        "reducerSpecs": json.loads(row["reducer_specs"]),
+        "uses": row["uses"],
+        "date": row["date"] or None,
+        "filename": row["filename"],
+    }
+
+
+def rollup_keys(date: str, recipient: str, currency: str, document_type: str) -> Dict[str, str]:
+    """Rollup keys of an invoice; the month is "" when the date is not YYYY-MM-DD."""
+    match = SHARD_DATE_RE.match(date)
+    return {
+        "month": f"{match.group(1)}-{match.group(2)}" if match else "",
+        "recipient": recipient.strip(),
+        "currency": currency,
+        "documentType": document_type,
+    }
+
+
+def encode_cursor(mtime_ns: int, filename: str) -> str:
+    raw = json.dumps([mtime_ns, filename], ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[int, str]:
+    """Raises ValueError for malformed cursors."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        mtime_ns, filename = json.loads(raw)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    if not isinstance(mtime_ns, int) or not isinstance(filename, str):
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return mtime_ns, filename
+
+
+def _row_to_entry(row: sqlite3.Row) -> Dict:
+    return {
+        "filename": row["filename"],
+        "number": row["number"],
+        "date": row["date"],
+        "recipient": row["recipient"],
+        "total": row["total"],
+        "currency": row["currency"],
+        "documentType": row["document_type"],
+        "saved_at": row["saved_at"],
+        "organizationId": row["organization_id"],
+    }
+
+
+class InvoiceIndex:
+    def __init__(self, storage_path: str, index_path: str):
+        self.storage_path = storage_path
+        self.index_path = index_path
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+
+        self._lock = threading.RLock()
+        # isolation_level=None: transactions are managed explicitly with BEGIN IMMEDIATE
+        # so that several API workers sharing the same index file serialize their writes.
+        self._conn = sqlite3.connect(index_path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._migrate()
+
+    def _migrate(self) -> None:
+        with self._transaction() as conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version != SCHEMA_VERSION:
+                # Derived data only: dropping it makes the next reconcile re-read the archive.
+                for table in DERIVED_TABLES:
+                    conn.execute(f"DROP TABLE IF EXISTS {table}")
+            for statement in SCHEMA.split(";"):
+                if statement.strip():
+                    conn.execute(statement)
+            # index_meta survives rebuilds, so the generation never goes backwards;
+            # the random epoch tells apart generations of a re-created index file.
+            conn.execute(
+                "INSERT OR IGNORE INTO index_meta (key, value) VALUES ('epoch', ?), ('generation', 0)",
+                (secrets.token_hex(4),),
+            )
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def transaction(self) -> ContextManager[sqlite3.Connection]:
+        """
+        Write transaction for stores that keep their own tables in the index
+        file (see ``RevisionLog``); serialized across workers like index writes.
+        """
+        return self._transaction()
+
+    def query(self, sql: str, params: Tuple = ()) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    # --- Maintenance -------------------------------------------------------
+
+    def _read_file(self, rel_path: str) -> Optional[dict]:
+        try:
+            data = jsonio.loads(read_archive_file(self.storage_path, rel_path))
+        except (ValueError, OSError):
+            return None  # Skip broken files
+        return data if isinstance(data, dict) else None
+
+    def _exists(self, rel_path: str) -> bool:
+        try:
+            stat_archive_file(self.storage_path, rel_path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _bump_generation(self, conn: sqlite3.Connection) -> None:
+        conn.execute("UPDATE index_meta SET value = value + 1 WHERE key = 'generation'")
+
+    def _rollup(self, conn: sqlite3.Connection, row: Any, sign: int) -> None:
+        """Adds (sign=1) or subtracts (sign=-1) an ``invoices`` row to the rollups."""
+        keys = rollup_keys(row["date"], row["recipient"], row["currency"], row["document_type"])
+        for dimension in ROLLUP_DIMENSIONS:
+            params = (dimension, keys[dimension], row["currency"])
+            conn.execute(
+                """
+                INSERT INTO invoice_rollups (dimension, key, currency, count, total)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(dimension, key, currency) DO UPDATE SET
+                    count = count + excluded.count,
+                    total = total + excluded.total
+                """,
+                (*params, sign, sign * row["total"]),
+            )
+            if sign < 0:
+                conn.execute(
+                    "DELETE FROM invoice_rollups"
+                    " WHERE dimension = ? AND key = ? AND currency = ? AND count <= 0",
+                    params,
+                )
+
+    def _index_items(self, conn: sqlite3.Connection, filename: str, data: dict, fields: Dict, mtime_ns: int) -> None:
+        """Adds the line items of an invoice and folds them into the catalog."""
+        items = data.get("items")
+        if not isinstance(items, list):
+            return
+        date = fields["date"] if ITEM_DATE_RE.match(fields["date"]) else ""
+        for position, item in enumerate(items):
+            item_data = item_fields(item)
+            if item_data is None:
+                continue
+            key = item_key(item_data)
+            model_key, _, description_key = key.split("\x1f")
+            values = (
+                item_data["model"], item_data["name"], item_data["description"], item_data["price"],
+                item_data["unit"], item_data["hsCode"], item_data["countryOfOrigin"],
+                json.dumps(item_data["reducerSpecs"], ensure_ascii=False, sort_keys=True),
+                fields["currency"], date, mtime_ns, filename,
+            )
+            conn.execute(
+                "INSERT INTO invoice_items"
+                f" (position, item_key, model_key, description_key, quantity, {', '.join(ITEM_COLUMNS)})"
+                f" VALUES (?, ?, ?, ?, ?, {', '.join('?' * len(ITEM_COLUMNS))})",
+                (position, key, model_key, description_key, item_data["quantity"], *values),
+            )
+            conn.execute(
+                f"""
+                INSERT INTO item_catalog (
+                    item_key, model_key, name_key, description_key, uses, {', '.join(ITEM_COLUMNS)}
+                ) VALUES (?, ?, ?, ?, 1, {', '.join('?' * len(ITEM_COLUMNS))})
+                ON CONFLICT(item_key) DO UPDATE SET uses = uses + 1
+                """,
+                (key, *key.split("\x1f"), *values),
+            )
+            # The most recent invoice (by date, then file mtime) provides the price and attributes
+            conn.execute(
+                f"UPDATE item_catalog SET {', '.join(f'{column} = ?' for column in ITEM_COLUMNS)}"
+                " WHERE item_key = ? AND (date, mtime_ns) <= (?, ?)",
+                (*values, key, date, mtime_ns),
+            )
+
+    def _unindex_items(self, conn: sqlite3.Connection, filename: str) -> None:
+        """Removes the line items of an invoice from the item table and the catalog."""
+        keys = Counter(
+            row[0] for row in conn.execute("SELECT item_key FROM invoice_items WHERE filename = ?", (filename,))
+        )
+        if not keys:
+            return
+        conn.execute("DELETE FROM invoice_items WHERE filename = ?", (filename,))
+        columns = ", ".join(ITEM_COLUMNS)
+        for key, count in keys.items():
+            row = conn.execute(
+                "UPDATE item_catalog SET uses = uses - ? WHERE item_key = ? RETURNING uses, filename",
+                (count, key),
+            ).fetchone()
+            if row is None:
+                continue
+            if row["uses"] <= 0:
+                conn.execute("DELETE FROM item_catalog WHERE item_key = ?", (key,))
+            elif row["filename"] == filename:
+                # The catalog entry came from this invoice: take the next most recent one
+                latest = conn.execute(
+                    f"SELECT {columns} FROM invoice_items WHERE item_key = ?"
+                    " ORDER BY date DESC, mtime_ns DESC LIMIT 1",
+                    (key,),
+                ).fetchone()
+                conn.execute(
+                    f"UPDATE item_catalog SET ({columns}) = ({', '.join('?' * len(ITEM_COLUMNS))})"
+                    " WHERE item_key = ?",
+                    (*latest, key),
+                )
+
+    def _upsert(self, conn: sqlite3.Connection, rel_path: str, st: os.stat_result, data: dict) -> None:
+        filename = os.path.basename(rel_path)
+        fields = list_fields(data)
+        number_date, number_seq = number_parts(fields["number"])
+        previous = conn.execute(
+            "SELECT date, recipient, total, currency, document_type FROM invoices WHERE filename = ?",
+            (filename,),
+        ).fetchone()
+        if previous is not None:
+            self._rollup(conn, previous, -1)
+        conn.execute(
+            """
+            INSERT INTO invoices (
+                filename, rel_path, mtime_ns, size, number, date, recipient, total,
+                currency, document_type, saved_at, organization_id, number_date, number_seq,
+                canonical
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(filename) DO UPDATE SET
+                rel_path = excluded.rel_path,
+                mtime_ns = excluded.mtime_ns,
+                size = excluded.size,
+                number = excluded.number,
+                date = excluded.date,
+                recipient = excluded.recipient,
+                total = excluded.total,
+                currency = excluded.currency,
+                document_type = excluded.document_type,
+                saved_at = excluded.saved_at,
+                organization_id = excluded.organization_id,
+                number_date = excluded.number_date,
+                number_seq = excluded.number_seq,
+                canonical = excluded.canonical
+            """,
+            (
+                filename, rel_path, st.st_mtime_ns, st.st_size, fields["number"], fields["date"],
+                fields["recipient"], fields["total"], fields["currency"],
+                fields["documentType"], fields["saved_at"], fields["organizationId"],
+                number_date, number_seq, is_canonical(data),
+            ),
+        )
+        self._bump_generation(conn)
+        self._rollup(conn, {
+            "date": fields["date"],
+            "recipient": fields["recipient"],
+            "total": fields["total"],
+            "currency": fields["currency"],
+            "document_type": fields["documentType"],
+        }, 1)
+        if number_date is not None:
+            # The number is taken now, its reservation (if any) is no longer needed
+            conn.execute(
+                "DELETE FROM number_reservations WHERE number = ?",
+                (f"{number_date}-{number_seq}",),
+            )
+        rowid = conn.execute(
+            "SELECT rowid FROM invoices WHERE filename = ?", (filename,)
+        ).fetchone()[0]
+        conn.execute("DELETE FROM invoice_search WHERE rowid = ?", (rowid,))
+        conn.execute(
+            "INSERT INTO invoice_search (rowid, content) VALUES (?, ?)",
+            (rowid, _search_content(data)),
+        )
+        self._unindex_items(conn, filename)
+        self._index_items(conn, filename, data, fields, st.st_mtime_ns)
+
+    def _delete(self, conn: sqlite3.Connection, filename: str) -> bool:
+        row = conn.execute(
+            "SELECT rowid, date, recipient, total, currency, document_type FROM invoices WHERE filename = ?",
+            (filename,),
+        ).fetchone()
+        if row is None:
+            return False
+        self._bump_generation(conn)
+        self._rollup(conn, row, -1)
+        self._unindex_items(conn, filename)
+        conn.execute("DELETE FROM invoice_search WHERE rowid = ?", (row[0],))
+        conn.execute("DELETE FROM invoices WHERE rowid = ?", (row[0],))
+        return True
+
+    def reconcile(self) -> Dict[str, int]:
+        """
+        Brings the index in line with the storage directory.
+        Only new files and files whose mtime/size changed are read. A file that
+        is both packed and loose (being unpacked) resolves to the loose one.
+        Files are read outside the write lock and committed in batches of
+        ``RECONCILE_BATCH``, so other workers can keep writing meanwhile.
+        """
+        # The snapshot precedes the scan: a file saved in between is then
+        # seen as new rather than as removed
+        with self._lock:
+            known = {
+                row["filename"]: (row["rel_path"], row["mtime_ns"], row["size"])
+                for row in self._conn.execute("SELECT filename, rel_path, mtime_ns, size FROM invoices")
+            }
+        on_disk = {**scan_packs(self.storage_path), **scan_archive(self.storage_path)}
+
+        changed, moved = [], []
+        for name, (rel_path, st) in on_disk.items():
+            previous = known.get(name)
+            if previous is None or previous[1:] != (st.st_mtime_ns, st.st_size):
+                changed.append(name)
+            elif previous[0] != rel_path:
+                moved.append(name)
+        removed = [name for name in known if name not in on_disk]
+
+        updated = deleted = 0
+        for start in range(0, len(changed), RECONCILE_BATCH):
+            batch = []
+            for name in changed[start:start + RECONCILE_BATCH]:
+                rel_path = on_disk[name][0]
+                try:
+                    st = stat_archive_file(self.storage_path, rel_path)
+                except FileNotFoundError:
+                    continue  # Deleted meanwhile: handled by its own event or the next reconcile
+                batch.append((name, rel_path, st, self._read_file(rel_path)))
+            with self._transaction() as conn:
+                for name, rel_path, st, data in batch:
+                    row = conn.execute(
+                        "SELECT mtime_ns, size FROM invoices WHERE filename = ?", (name,)
+                    ).fetchone()
+                    # Re-indexed by another writer since the snapshot: that version wins
+                    current = None if row is None else (row["mtime_ns"], row["size"])
+                    if current != (known[name][1:] if name in known else None):
+                        continue
+                    if data is None:
+                        self._delete(conn, name)
+                        continue
+                    self._upsert(conn, rel_path, st, data)
+                    updated += 1
+        with self._transaction() as conn:
+            for name in moved:
+                # Same file in another directory (sharding): no need to re-read it
+                conn.execute(
+                    "UPDATE invoices SET rel_path = ? WHERE filename = ?", (on_disk[name][0], name)
+                )
+            for name in removed:
+                # Re-checked under the lock: the file may have been written since the scan
+                row = conn.execute(
+                    "SELECT rel_path FROM invoices WHERE filename = ?", (name,)
+                ).fetchone()
+                if row is not None and not self._exists(row["rel_path"]):
+                    deleted += self._delete(conn, name)
+
+        stats = {"files": len(on_disk), "updated": updated, "removed": deleted}
+        logger.info("Invoice index reconciled: %s", stats)
+        return stats
+
+    def refresh(self, rel_path: str, data: Optional[dict] = None) -> bool:
+        """
+        Re-indexes a single file given by its path relative to the archive
+        (``name.json`` or ``YYYY/MM/name.json``). When ``data`` is given (e.g. right
+        after a save) the file is only stat'ed, not re-read. Without ``data`` a file
+        whose mtime/size already match the index is skipped, so replaying events
+        for our own writes and moves is free. Returns whether the index changed.
+        """
+        filename = os.path.basename(rel_path)
+        try:
+            st = stat_archive_file(self.storage_path, rel_path)
+        except FileNotFoundError:
+            with self._transaction() as conn:
+                row = conn.execute(
+                    "SELECT rel_path FROM invoices WHERE filename = ?", (filename,)
+                ).fetchone()
+                # A file that moved to another directory keeps its row
+                if row is None or row["rel_path"] != rel_path:
+                    return False
+                return self._delete(conn, filename)
+
+        if data is None:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT rel_path, mtime_ns, size FROM invoices WHERE filename = ?", (filename,)
+                ).fetchone()
+            if row is not None and (row["mtime_ns"], row["size"]) == (st.st_mtime_ns, st.st_size):
+                if row["rel_path"] == rel_path:
+                    return False
+                with self._transaction() as conn:
+                    conn.execute(
+                        "UPDATE invoices SET rel_path = ? WHERE filename = ?", (rel_path, filename)
+                    )
+                return True
+            data = self._read_file(rel_path)
+        with self._transaction() as conn:
+            if data is None:
+                self._delete(conn, filename)
+            else:
+                self._upsert(conn, rel_path, st, data)
+        return True
+
+    def refresh_many(self, items: List[Tuple[str, dict]]) -> None:
+        """Indexes freshly written files ``(rel_path, data)`` in a single transaction."""
+        with self._transaction() as conn:
+            for rel_path, data in items:
+                try:
+                    st = stat_archive_file(self.storage_path, rel_path)
+                except FileNotFoundError:
+                    continue
+                self._upsert(conn, rel_path, st, data)
+
+    def remove(self, filename: str) -> bool:
+        with self._transaction() as conn:
+            return self._delete(conn, filename)
+
+    def relocate(self, paths: Dict[str, str]) -> int:
+        """
+        Points indexed files at new paths (filename -> path relative to the archive)
+        without re-reading them, e.g. after packing. Returns the number of rows moved.
+        """
+        with self._transaction() as conn:
+            return sum(
+                conn.execute("UPDATE invoices SET rel_path = ? WHERE filename = ?", (rel_path, name)).rowcount
+                for name, rel_path in paths.items()
+            )
+
+    # --- Queries -----------------------------------------------------------
+
+    def generation(self) -> str:
+        """
+        Version of the indexed invoice data: changes whenever an invoice is
+        indexed or removed (in any worker sharing the index file).
+        """
+        with self._lock:
+            meta = dict(self._conn.execute(
+                "SELECT key, value FROM index_meta WHERE key IN ('epoch', 'generation')"
+            ).fetchall())
+        return f"{meta['epoch']}-{meta['generation']}"
+
+    def locate(self, filename: str) -> Optional[str]:
+        """
+        Path of an invoice relative to the archive, or None if it does not exist.
+        The indexed path is verified (a packed one against its pack); otherwise the
+        flat location and then every shard are probed, so files the index has not
+        seen yet are found too.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT rel_path FROM invoices WHERE filename = ?", (filename,)
+            ).fetchone()
+        if row is not None and packed_exists(self.storage_path, row["rel_path"]):
+            return row["rel_path"]
+        candidates = [row["rel_path"]] if row is not None else []
+        candidates.append(filename)
+        for rel_path in candidates:
+            if os.path.isfile(os.path.join(self.storage_path, rel_path)):
+                return rel_path
+        for rel_dir in reversed(shard_dirs(self.storage_path)):
+            rel_path = f"{rel_dir}/{filename}"
+            if os.path.isfile(os.path.join(self.storage_path, rel_path)):
+                return rel_path
+        return None
+
+    def canonical_path(self, filename: str) -> Optional[str]:
+        """
+        Path (relative to the archive) of an invoice stored in the canonical
+        FastAPI format, or None. The file must still match the indexed
+        mtime/size, so a write the index has not seen yet is never served.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT rel_path, mtime_ns, size FROM invoices WHERE filename = ? AND canonical = 1",
+                (filename,),
+            ).fetchone()
+        if row is None or split_packed(row["rel_path"]) is not None:
+            return None  # A packed file has to be decompressed first
+        try:
+            st = os.stat(os.path.join(self.storage_path, row["rel_path"]))
+        except OSError:
+            return None
+        if (st.st_mtime_ns, st.st_size) != (row["mtime_ns"], row["size"]):
+            return None
+        return row["rel_path"]
+
+    def list_entries(self) -> List[Dict]:
+        """Returns list-view entries, newest file first."""
+        return self.query_entries()[0]
+
+    def query_entries(
+        self,
+        limit: Optional[int] = None,
+        after: Optional[str] = None,
+        filters: Optional[Dict[str, Any]] = None,
+    ) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Keyset-paginated, filtered list (newest file first).
+        ``after`` is a cursor returned for the previous page; the second element
+        of the result is the cursor for the next page, or None on the last one.
+        """
+        conditions, params = [], []
+        for name, value in (filters or {}).items():
+            if value is not None:
+                conditions.append(LIST_FILTERS[name])
+                params.append(value)
+        if after:
+            mtime_ns, filename = decode_cursor(after)
+            conditions.append("(mtime_ns < ? OR (mtime_ns = ? AND filename < ?))")
+            params.extend([mtime_ns, mtime_ns, filename])
+
+        sql = f"SELECT {LIST_COLUMNS}, mtime_ns FROM invoices"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY mtime_ns DESC, filename DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit + 1)
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1]["mtime_ns"], rows[-1]["filename"])
+        return [_row_to_entry(row) for row in rows], next_cursor
+
+    def next_number(self, date_key: str, reserve_ttl: float = 0) -> str:
+        """
+        Next ``<date_key>-NN`` number: one past the highest number taken by a saved
+        invoice or an unexpired reservation. With ``reserve_ttl`` > 0 the number
+        is reserved for that many seconds, so concurrent callers (in any worker
+        sharing the index) get distinct numbers; the reservation is dropped as soon
+        as an invoice with that number is indexed, or expires if it never is.
+        """
+        key = date_key.lower()
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM number_reservations WHERE expires_at <= ?", (now,))
+            saved = conn.execute(
+                "SELECT MAX(number_seq) FROM invoices WHERE number_date = ?", (key,)
+            ).fetchone()[0]
+            reserved = conn.execute(
+                "SELECT MAX(number_seq) FROM number_reservations WHERE number_date = ?", (key,)
+            ).fetchone()[0]
+            next_seq = max(saved or 0, reserved or 0) + 1
+            if reserve_ttl > 0:
+                conn.execute(
+                    "INSERT INTO number_reservations (number, number_date, number_seq, expires_at)"
+                    " VALUES (?, ?, ?, ?)",
+                    (f"{key}-{next_seq}", key, next_seq, now + reserve_ttl),
+                )
+        # Format with leading zero (e.g., 01, 02, ...)
+        return f"{date_key}-{next_seq:02d}"
+
+    def release_number(self, number: str) -> bool:
+        """Drops the reservation of ``number`` (e.g. the invoice was not saved)."""
+        number_date, number_seq = number_parts(number)
+        if number_date is None:
+            return False
+        with self._transaction() as conn:
+            return conn.execute(
+                "DELETE FROM number_reservations WHERE number = ?", (f"{number_date}-{number_seq}",)
+            ).rowcount > 0
+
+    def stats(self, recipients_limit: int = 20) -> Dict[str, Any]:
+        """
+        Archive totals by month, recipient (top ``recipients_limit`` by total),
+        currency and document type, each split by currency. Read straight from
+        the rollup table, so the cost does not depend on the archive size.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT dimension, key, currency, count, total FROM invoice_rollups"
+                " WHERE dimension != 'recipient' ORDER BY dimension, key DESC, currency"
+            ).fetchall()
+            rows += self._conn.execute(
+                "SELECT dimension, key, currency, count, total FROM invoice_rollups"
+                " WHERE dimension = 'recipient' ORDER BY total DESC LIMIT ?",
+                (recipients_limit,),
+            ).fetchall()
+        buckets: Dict[str, List[Dict]] = {dimension: [] for dimension in ROLLUP_DIMENSIONS}
+        for row in rows:
+            buckets[row["dimension"]].append({
+                "key": row["key"] or None,
+                "currency": row["currency"],
+                "count": row["count"],
+                "total": round(row["total"], 2),
+            })
+        return {
+            "count": sum(bucket["count"] for bucket in buckets["currency"]),
+            "by_month": buckets["month"],
+            "by_recipient": buckets["recipient"],
+            "by_currency": buckets["currency"],
+            "by_document_type": buckets["documentType"],
+        }
+
+    def search(self, query: str, limit: int = 50) -> List[Dict]:
+        """Full-text search over number, recipient, INN, tender and item fields."""
+        expression = _match_expression(query)
+        if expression is None:
+            return []
+        columns = ", ".join(f"invoices.{column.strip()}" for column in LIST_COLUMNS.split(","))
+        with self._lock:
+            rows = self._conn.execute(
+                f"""
+                SELECT {columns} FROM invoice_search
+                JOIN invoices ON invoices.rowid = invoice_search.rowid
+                WHERE invoice_search MATCH ?
+                ORDER BY bm25(invoice_search), invoices.mtime_ns DESC
+                LIMIT ?
+                """,
+                (expression, limit),
+            ).fetchall()
+        return [_row_to_entry(row) for row in rows]
+
+    def catalog(self, prefix: str, limit: int = 20) -> List[Dict]:
+        """
+        Catalog items whose model, name or description starts with ``prefix``
+        (case-insensitive), most used first. Each is a range scan of an index.
+        """
+        low = catalog_key(prefix)
+        if not low:
+            return []
+        high = low[:-1] + chr(ord(low[-1]) + 1)
+        with self._lock:
+            rows = self._conn.execute(
+                """
+                SELECT * FROM item_catalog
+                WHERE (model_key >= ?1 AND model_key < ?2)
+                   OR (name_key >= ?1 AND name_key < ?2)
+                   OR (description_key >= ?1 AND description_key < ?2)
+                ORDER BY uses DESC, date DESC
+                LIMIT ?3
+                """,
+                (low, high, limit),
+            ).fetchall()
+        return [_catalog_entry(row) for row in rows]
+
+    def price_history(
+        self, model: Optional[str] = None, description: Optional[str] = None, limit: int = 100
+    ) -> Dict[str, Any]:
+        """
+        Prices charged for a model and/or description (matched exactly, ignoring
+        case and whitespace): the ``limit`` most recent lines with the invoice's
+        number and recipient, and min/avg/max per currency over all of them.
+        Lines without a price are left out.
+        """
+        conditions, params = ["price > 0"], []
+        for column, value in (("model_key", model), ("description_key", description)):
+            if value:
+                conditions.append(f"invoice_items.{column} = ?")
+                params.append(catalog_key(value))
+        where = " AND ".join(conditions)
+        with self._lock:
+            aggregates = self._conn.execute(
+                f"""
+                SELECT currency, count(*) AS count, min(price) AS min, avg(price) AS avg, max(price) AS max
+                FROM invoice_items WHERE {where}
+                GROUP BY currency ORDER BY count DESC, currency
+                """,
+                params,
+            ).fetchall()
+            rows = self._conn.execute(
+                f"""
+                SELECT invoice_items.*, invoices.number, invoices.recipient FROM invoice_items
+                JOIN invoices ON invoices.filename = invoice_items.filename
+                WHERE {where}
+                ORDER BY invoice_items.date DESC, invoice_items.mtime_ns DESC
+                LIMIT ?
+                """,
+                (*params, limit),
+            ).fetchall()
+        return {
+            "aggregates": [
+                {"currency": row["currency"], "count": row["count"], "min": row["min"],
+                 "avg": round(row["avg"], 2), "max": row["max"]}
+                for row in aggregates
+            ],
+            "history": [
+                {"date": row["date"] or None, "price": row["price"], "quantity": row["quantity"],
+                 "currency": row["currency"], "model": row["model"], "name": row["name"],
+                 "description": row["description"], "number": row["number"],
+                 "recipient": row["recipient"], "filename": row["filename"]}
+                for row in rows
+            ],
+        }
+
+
+def default_index_path(storage_path: str) -> str:
+    return os.path.join(storage_path, ".index", "invoices.sqlite3")
+
+
+@lru_cache
+def get_invoice_index() -> InvoiceIndex:
+    """Process-wide index for the configured archive."""
+    settings = get_settings()
+    storage_path = settings.invoice_storage_path
+    return InvoiceIndex(storage_path, settings.invoice_index_path or default_index_path(storage_path))
@@ -0,0 +1,306 @@
+"""
+Сжатые пачки для холодной части архива инвойсов.
+
+Формат пачки: заголовок (MAGIC, версия, кодек, словарь), сжатые файлы подряд,
+JSON-таблица смещений и футер. Кодек — zstd (если установлен ``zstandard``)
+или zlib со словарём; упакованный файл индексируется как ``.packs/<pack>/<filename>``.
+"""
+import json
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:  # zstandard is an optional dependency
+    zstandard = None
+
+PACK_DIR = ".packs"
+PACK_SUFFIX = ".pack"
+
+MAGIC = b"KPPK"
+FORMAT_VERSION = 1
+_HEADER = struct.Struct("<4sBB")  # magic, format version, codec name length
+_DICT_SIZE = struct.Struct("<I")
+_FOOTER = struct.Struct("<QQ4s")  # table offset, table length, magic
+
+# Dictionary size: zstd trains one of this size, zlib can only use a 32 KiB window
+ZSTD_DICT_SIZE = 110 * 1024
+ZLIB_DICT_SIZE = 32 * 1024
+# Fewer samples than this are not worth a dictionary
+MIN_DICT_SAMPLES = 16
+
+
+class PackError(ValueError):
+    """A pack is damaged or uses a codec that is not available."""
+
+
+class PackEntry(NamedTuple):
+    offset: int
+    length: int
+    size: int
+    mtime_ns: int
+
+
+class PackedStat(NamedTuple):
+    """The part of ``os.stat_result`` the index uses, for a packed file."""
+    st_mtime_ns: int
+    st_size: int
+
+    @property
+    def st_mtime(self) -> float:
+        return self.st_mtime_ns / 1e9
+
+
+def default_codec() -> str:
+    return "zstd" if zstandard is not None else "zlib"
+
+
+def _build_dictionary(codec: str, samples: List[bytes]) -> bytes:
+    if len(samples) < MIN_DICT_SAMPLES:
+        return b""
+    if codec == "zstd":
+        try:
+            return zstandard.train_dictionary(ZSTD_DICT_SIZE, samples).as_bytes()
+        except zstandard.ZstdError:
+            return b""
+    # deflate looks back at most 32 KiB: a few whole invoices cover the shared keys and values
+    dictionary = b"".join(samples[:MIN_DICT_SAMPLES])
+    return dictionary[-ZLIB_DICT_SIZE:]
+
+
+class _Codec:
+    def __init__(self, name: str, dictionary: bytes):
+        if name == "zstd":
+            if zstandard is None:
+                raise PackError("The pack is zstd-compressed but zstandard is not installed")
+            zdict = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+            self._compressor = zstandard.ZstdCompressor(level=12, dict_data=zdict)
+            self._decompressor = zstandard.ZstdDecompressor(dict_data=zdict)
+        elif name != "zlib":
+            raise PackError(f"Unknown pack codec: {name}")
+        self.name = name
+        self.dictionary = dictionary
+        self._lock = threading.Lock()
+
+    def compress(self, data: bytes) -> bytes:
+        if self.name == "zstd":
+            return self._compressor.compress(data)
+        compressor = zlib.compressobj(9, zdict=self.dictionary) if self.dictionary else zlib.compressobj(9)
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, frame: bytes, size: int) -> bytes:
+        if self.name == "zstd":
+            # ZstdDecompressor instances are not thread-safe
+            with self._lock:
+                return self._decompressor.decompress(frame, max_output_size=size)
+        decompressor = zlib.decompressobj(zdict=self.dictionary) if self.dictionary else zlib.decompressobj()
+        return decompressor.decompress(frame) + decompressor.flush()
+
+
+def write_pack(
+    path: str, files: Iterable[Tuple[str, bytes, int]], codec: Optional[str] = None
+) -> Dict[str, PackEntry]:
+    """
+    Writes ``(filename, content, mtime_ns)`` items into a new pack at ``path``
+    (atomically: the pack appears complete or not at all). Returns its table.
+    """
+    files = list(files)
+    codec_name = codec or default_codec()
+    dictionary = _build_dictionary(codec_name, [content for _, content, _ in files])
+    return _write_frames(path, _Codec(codec_name, dictionary), (
+        (filename, None, content, mtime_ns) for filename, content, mtime_ns in files
+    ))
+
+
+def _write_frames(path: str, codec: _Codec, items) -> Dict[str, PackEntry]:
+    """``items`` are ``(filename, frame or None, content or size, mtime_ns)``."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.tmp"
+    table: Dict[str, PackEntry] = {}
+    try:
+        with open(temp_path, "wb") as f:
+            name = codec.name.encode("ascii")
+            f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(name)) + name)
+            f.write(_DICT_SIZE.pack(len(codec.dictionary)) + codec.dictionary)
+            for filename, frame, content, mtime_ns in items:
+                if frame is None:
+                    frame, size = codec.compress(content), len(content)
+                else:
+                    size = content
+                table[filename] = PackEntry(f.tell(), len(frame), size, mtime_ns)
+                f.write(frame)
+            table_offset = f.tell()
+            raw_table = json.dumps(
+                {name: list(entry) for name, entry in table.items()}, ensure_ascii=False
+            ).encode("utf-8")
+            f.write(raw_table)
+            f.write(_FOOTER.pack(table_offset, len(raw_table), MAGIC))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return table
+
+
+class PackReader:
+    """Random access to the files of one pack."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            magic, version, name_length = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != MAGIC or version != FORMAT_VERSION:
+                raise PackError(f"Not a pack file (or an unsupported version): {path}")
+            codec_name = f.read(name_length).decode("ascii")
+            (dict_length,) = _DICT_SIZE.unpack(f.read(_DICT_SIZE.size))
+            dictionary = f.read(dict_length)
+
+            f.seek(-_FOOTER.size, os.SEEK_END)
+            table_offset, table_length, magic = _FOOTER.unpack(f.read(_FOOTER.size))
+            if magic != MAGIC:
+                raise PackError(f"Truncated pack file: {path}")
+            f.seek(table_offset)
+            raw_table = json.loads(f.read(table_length))
+        self.codec = _Codec(codec_name, dictionary)
+        self.entries: Dict[str, PackEntry] = {
+            name: PackEntry(*entry) for name, entry in raw_table.items()
+        }
+
+    def read(self, filename: str) -> bytes:
+        entry = self.entries.get(filename)
+        if entry is None:
+            raise FileNotFoundError(f"{filename} is not in {self.path}")
+        with open(self.path, "rb") as f:
+            f.seek(entry.offset)
+            frame = f.read(entry.length)
+        try:
+            content = self.codec.decompress(frame, entry.size)
+        except (zlib.error, ValueError) as e:
+            raise PackError(f"Damaged entry {filename} in {self.path}: {e}") from e
+        if len(content) != entry.size:
+            raise PackError(f"Damaged entry {filename} in {self.path}")
+        return content
+
+    def frames(self) -> Iterable[Tuple[str, bytes, PackEntry]]:
+        """Compressed frames in pack order, for rewriting a pack without recompressing."""
+        with open(self.path, "rb") as f:
+            for name, entry in sorted(self.entries.items(), key=lambda item: item[1].offset):
+                f.seek(entry.offset)
+                yield name, f.read(entry.length), entry
+
+
+# Parsed tables of recently used packs, keyed by path and file identity
+_READERS: "OrderedDict[Tuple[str, int, int], PackReader]" = OrderedDict()
+_READERS_LOCK = threading.Lock()
+_READERS_MAX = 64
+
+
+def open_pack(path: str) -> PackReader:
+    st = os.stat(path)
+    key = (path, st.st_mtime_ns, st.st_size)
+    with _READERS_LOCK:
+        reader = _READERS.get(key)
+        if reader is not None:
+            _READERS.move_to_end(key)
+            return reader
+    reader = PackReader(path)
+    with _READERS_LOCK:
+        _READERS[key] = reader
+        while len(_READERS) > _READERS_MAX:
+            _READERS.popitem(last=False)
+    return reader
+
+
+def packed_path(pack_name: str, filename: str) -> str:
+    """Path of a packed invoice relative to the archive, as stored in the index."""
+    return f"{PACK_DIR}/{pack_name}/{filename}"
+
+
+def split_packed(rel_path: str) -> Optional[Tuple[str, str]]:
+    """``(pack path relative to the archive, filename)`` for a packed path, else None."""
+    parts = rel_path.split("/")
+    if len(parts) == 3 and parts[0] == PACK_DIR and parts[1].endswith(PACK_SUFFIX):
+        return f"{parts[0]}/{parts[1]}", parts[2]
+    return None
+
+
+def pack_names(storage_path: str) -> List[str]:
+    """Pack files of the archive, oldest first (names start with the creation time)."""
+    try:
+        with os.scandir(os.path.join(storage_path, PACK_DIR)) as entries:
+            return sorted(e.name for e in entries if e.name.endswith(PACK_SUFFIX) and e.is_file())
+    except FileNotFoundError:
+        return []
+
+
+def scan_packs(storage_path: str) -> Dict[str, Tuple[str, PackedStat]]:
+    """
+    Packed invoices: filename -> (packed path, stat as of packing). A file
+    packed more than once (an interrupted run) resolves to the newest pack.
+    """
+    files: Dict[str, Tuple[str, PackedStat]] = {}
+    for name in pack_names(storage_path):
+        reader = open_pack(os.path.join(storage_path, PACK_DIR, name))
+        for filename, entry in reader.entries.items():
+            files[filename] = (packed_path(name, filename), PackedStat(entry.mtime_ns, entry.size))
+    return files
+
+
+def packed_exists(storage_path: str, rel_path: str) -> bool:
+    packed = split_packed(rel_path)
+    if packed is None:
+        return False
+    try:
+        return packed[1] in open_pack(os.path.join(storage_path, packed[0])).entries
+    except (OSError, PackError):
+        return False
+
+
+def stat_archive_file(storage_path: str, rel_path: str):
+    """``os.stat`` of an archive file, or its :class:`PackedStat` if packed."""
+    packed = split_packed(rel_path)
+    if packed is None:
+        return os.stat(os.path.join(storage_path, rel_path))
+    entry = open_pack(os.path.join(storage_path, packed[0])).entries.get(packed[1])
+    if entry is None:
+        raise FileNotFoundError(rel_path)
+    return PackedStat(entry.mtime_ns, entry.size)
+
+
+def read_archive_file(storage_path: str, rel_path: str) -> bytes:
+    """Content of an archive file, loose or packed."""
+    packed = split_packed(rel_path)
+    if packed is None:
+        with open(os.path.join(storage_path, rel_path), "rb") as f:
+            return f.read()
+    return open_pack(os.path.join(storage_path, packed[0])).read(packed[1])
+
+
+def remove_from_pack(storage_path: str, rel_path: str) -> bool:
+    """
+    Drops a packed invoice by rewriting its pack without it (frames are copied,
+    not recompressed); an emptied pack is deleted. Returns whether it was there.
+    """
+    pack_rel, filename = split_packed(rel_path)
+    path = os.path.join(storage_path, pack_rel)
+    try:
+        reader = open_pack(path)
+    except FileNotFoundError:
+        return False
+    if filename not in reader.entries:
+        return False
+    if len(reader.entries) == 1:
+        os.remove(path)
+        return True
+    _write_frames(path, reader.codec, (
+        (name, frame, entry.size, entry.mtime_ns)
+        for name, frame, entry in reader.frames() if name != filename
+    ))
+    return True
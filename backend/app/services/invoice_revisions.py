@@ -0,0 +1,203 @@
+"""
+Журнал ревизий инвойсов: JSON-патчи и периодические полные снимки.
+
+Ревизия восстанавливается из ближайшего снимка и не более ``snapshot_every - 1``
+патчей. Для файлового архива журнал — ``<storage>/.revisions/<name>.jsonl``.
+"""
+import os
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.services.invoice_index import InvoiceIndex
+from app.utils import jsonio
+from app.utils.jsonpatch import apply_patch, make_patch
+
+EXTERNAL_AUTHOR = "external"
+
+_INSERT_ENTRY = (
+    "INSERT OR REPLACE INTO invoice_revisions"
+    " (filename, rev, log_offset, log_length, snapshot, saved_at, saved_by)"
+    " VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+# Entries needed to rebuild a revision: the nearest snapshot at or before it and the patches after it
+_SELECT_SPANS = """
+    SELECT log_offset, log_length FROM invoice_revisions
+    WHERE filename = ? AND rev <= ? AND rev >= (
+        SELECT MAX(rev) FROM invoice_revisions WHERE filename = ? AND snapshot = 1 AND rev <= ?
+    )
+    ORDER BY rev
+"""
+_SELECT_REVISIONS = (
+    "SELECT rev, saved_at, saved_by, snapshot FROM invoice_revisions WHERE filename = ? ORDER BY rev"
+)
+
+
+def _saved_at(data: dict) -> str:
+    metadata = data.get("_metadata")
+    if isinstance(metadata, dict) and metadata.get("saved_at"):
+        return str(metadata["saved_at"])
+    return datetime.now().isoformat()
+
+
+def _saved_by(data: dict) -> Optional[str]:
+    metadata = data.get("_metadata")
+    return str(metadata["updated_by"]) if isinstance(metadata, dict) and metadata.get("updated_by") else None
+
+
+def snapshot_entry(rev: int, data: dict) -> Dict[str, Any]:
+    """Full-snapshot entry, for writers that do not diff (bulk imports)."""
+    return {"rev": rev, "saved_at": _saved_at(data), "saved_by": _saved_by(data), "snapshot": data}
+
+
+def plan_revisions(
+    last_rev: int,
+    last_snapshot_rev: int,
+    head: Optional[dict],
+    previous: Optional[dict],
+    data: dict,
+    snapshot_every: int,
+) -> List[Dict[str, Any]]:
+    """
+    Log entries for a save of ``data``. ``head`` is the last recorded revision
+    (None for a new log), ``previous`` the currently stored invoice (None if
+    there is none). Each entry has ``rev``, ``saved_at``, ``saved_by`` and either
+    ``snapshot`` (the full document) or ``patch`` (against the entry before it).
+    """
+    entries: List[Dict[str, Any]] = []
+
+    def append(document: dict, saved_by: Optional[str]) -> None:
+        nonlocal last_rev, last_snapshot_rev, head
+        last_rev += 1
+        patch = make_patch(head, document) if head is not None else None
+        if (
+            patch is None
+            or last_rev - last_snapshot_rev >= snapshot_every
+            or len(jsonio.dumps(patch)) >= len(jsonio.dumps(document))
+        ):
+            entry = snapshot_entry(last_rev, document)
+            last_snapshot_rev = last_rev
+        else:
+            entry = {"rev": last_rev, "saved_at": _saved_at(document), "patch": patch}
+        entry["saved_by"] = saved_by
+        entries.append(entry)
+        head = document
+
+    if previous is not None and previous != head:
+        append(previous, EXTERNAL_AUTHOR)
+    if data != head:
+        append(data, _saved_by(data))
+    return entries
+
+
+def replay(entries: Iterable[Dict[str, Any]]) -> Optional[dict]:
+    """Document after the given entries; the first one must be a snapshot."""
+    document = None
+    for entry in entries:
+        document = entry["snapshot"] if "snapshot" in entry else apply_patch(document, entry["patch"])
+    return document
+
+
+class RevisionLog:
+    """Revision logs of the file archive, with entry offsets in the archive index."""
+
+    def __init__(self, storage_path: str, index: InvoiceIndex, snapshot_every: int = 20):
+        self.directory = os.path.join(storage_path, ".revisions")
+        self.index = index
+        self.snapshot_every = snapshot_every
+
+    def _log_path(self, filename: str) -> str:
+        return os.path.join(self.directory, f"{os.path.splitext(filename)[0]}.jsonl")
+
+    def _read_entries(self, filename: str, spans: List[Tuple[int, int]]) -> List[Dict[str, Any]]:
+        with open(self._log_path(filename), "rb") as f:
+            entries = []
+            for offset, length in spans:
+                f.seek(offset)
+                entries.append(jsonio.loads(f.read(length)))
+        return entries
+
+    def _index_log(self, conn, filename: str) -> None:
+        """Indexes an existing log that has no rows (e.g. after the index was re-created)."""
+        try:
+            f = open(self._log_path(filename), "rb")
+        except FileNotFoundError:
+            return
+        with f:
+            offset = 0
+            for line in f:
+                try:
+                    entry = jsonio.loads(line)
+                    conn.execute(
+                        _INSERT_ENTRY,
+                        (filename, entry["rev"], offset, len(line), "snapshot" in entry,
+                         entry["saved_at"], entry.get("saved_by")),
+                    )
+                except (ValueError, KeyError, TypeError):
+                    pass  # Torn write at the end of the log
+                offset += len(line)
+
+    @staticmethod
+    def _spans(rows: List[Any]) -> List[Tuple[int, int]]:
+        return [(row["log_offset"], row["log_length"]) for row in rows]
+
+    def record(self, filename: str, previous: Optional[dict], data: dict) -> None:
+        """Appends the revisions for a save (see ``plan_revisions``)."""
+        with self.index.transaction() as conn:
+            # BEGIN IMMEDIATE serializes appends to the same log across workers
+            if conn.execute(
+                "SELECT 1 FROM invoice_revisions WHERE filename = ? LIMIT 1", (filename,)
+            ).fetchone() is None:
+                self._index_log(conn, filename)
+            last = conn.execute(
+                "SELECT MAX(rev) AS rev, MAX(CASE WHEN snapshot THEN rev END) AS snapshot_rev"
+                " FROM invoice_revisions WHERE filename = ?",
+                (filename,),
+            ).fetchone()
+            last_rev, last_snapshot_rev = last["rev"] or 0, last["snapshot_rev"] or 0
+            head = None
+            if last_rev:
+                spans = self._spans(conn.execute(_SELECT_SPANS, (filename, last_rev, filename, last_rev)).fetchall())
+                head = replay(self._read_entries(filename, spans))
+
+            entries = plan_revisions(last_rev, last_snapshot_rev, head, previous, data, self.snapshot_every)
+            if not entries:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self._log_path(filename), "ab") as f:
+                offset = f.seek(0, os.SEEK_END)
+                for entry in entries:
+                    line = jsonio.dumps(entry) + b"\n"
+                    f.write(line)
+                    conn.execute(
+                        _INSERT_ENTRY,
+                        (filename, entry["rev"], offset, len(line), "snapshot" in entry,
+                         entry["saved_at"], entry["saved_by"]),
+                    )
+                    offset += len(line)
+
+    def _ensure_indexed(self, filename: str) -> List[Any]:
+        rows = self.index.query(_SELECT_REVISIONS, (filename,))
+        if not rows and os.path.exists(self._log_path(filename)):
+            with self.index.transaction() as conn:
+                self._index_log(conn, filename)
+            rows = self.index.query(_SELECT_REVISIONS, (filename,))
+        return rows
+
+    def list(self, filename: str) -> List[Dict[str, Any]]:
+        """Revisions of an invoice, oldest first."""
+        return [
+            {
+                "rev": row["rev"],
+                "saved_at": row["saved_at"],
+                "saved_by": row["saved_by"],
+                "snapshot": bool(row["snapshot"]),
+            }
+            for row in self._ensure_indexed(filename)
+        ]
+
+    def get(self, filename: str, rev: int) -> Optional[dict]:
+        """Invoice data as of revision ``rev``, or None if there is no such revision."""
+        if not any(row["rev"] == rev for row in self._ensure_indexed(filename)):
+            return None
+        spans = self._spans(self.index.query(_SELECT_SPANS, (filename, rev, filename, rev)))
+        return replay(self._read_entries(filename, spans))
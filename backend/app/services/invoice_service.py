@@ -1,166 +1,442 @@
-import json
+import logging
 import os
 import re
 from datetime import datetime
-from glob import glob
-from typing import List, Optional, Dict
+from functools import lru_cache
+from typing import Any, List, Optional, Dict, Tuple
 
 from fastapi import HTTPException, status
 from pydantic import ValidationError
 
 from app.core.config import get_settings
-from app.schemas.invoice import Invoice
+from app.repositories.invoice import (
+    InvoiceRepository,
+    InvoiceStorageError,
+    InvoiceVersionConflictError,
+    get_invoice_repository,
+)
+from app.schemas.invoice import (
+    Invoice,
+    InvoiceCatalogItem,
+    InvoiceExportRequest,
+    InvoiceImportError,
+    InvoiceImportResult,
+    InvoiceListQuery,
+    InvoicePriceHistory,
+    InvoiceRevision,
+    InvoiceStats,
+)
+from app.services.invoice_import import RawRecord, validate_records
+from app.services.invoice_index import FASTAPI_VERSION, LIST_FIELDS, LIST_FILTERS, is_canonical
+from app.utils import etag
+from app.utils.cache import VersionedLRUCache
 
 settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+def prepare_for_save(invoice: Invoice, updated_by: str = "fastapi_service") -> Tuple[str, Dict]:
+    """
+    Raw data to store for a validated invoice: stamps ``_metadata`` and assigns
+    a filename (number + timestamp) to new invoices. Returns (filename, data).
+    """
+    data = invoice.model_dump(by_alias=True, exclude_none=True)
+
+    # Handle metadata
+    if "_metadata" not in data or not data["_metadata"]:
+        data["_metadata"] = {}
+
+    data["_metadata"].update({
+        "saved_at": datetime.now().isoformat(),
+        "version": FASTAPI_VERSION,
+        "updated_by": updated_by
+    })
+
+    filename = invoice.filename
+    if not filename:
+        # If no filename, generate one based on number + timestamp
+        safe_number = re.sub(r'[^a-zA-Z0-9-_]', '_', invoice.number)
+        timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+        filename = f"{safe_number}_{timestamp}.json"
+        data["filename"] = filename
+
+    return os.path.basename(filename), data
+
+
+def _keeps_fields(dumped: Any, raw: Any) -> bool:
+    """
+    Whether ``dumped`` still has every non-null field of ``raw`` at any depth.
+    Scalars may differ (the schema coerces them, e.g. PHP's ``[]`` for an empty
+    object becomes ``{}``); non-empty lists must keep their length.
+    """
+    if isinstance(raw, dict) and raw:
+        return isinstance(dumped, dict) and all(
+            key in dumped and _keeps_fields(dumped[key], value)
+            for key, value in raw.items() if value is not None
+        )
+    if isinstance(raw, list) and raw:
+        return (
+            isinstance(dumped, list) and len(dumped) == len(raw)
+            and all(_keeps_fields(d, r) for d, r in zip(dumped, raw))
+        )
+    return True
+
+
+def normalize_data(invoice: Invoice, raw: Dict) -> Optional[Dict]:
+    """
+    The stored form of a legacy (PHP-written) invoice as ``save_invoice`` would
+    write it, keeping its ``_metadata`` apart from the version. None if writing
+    it back would lose data: fields the schema does not know, at the top level
+    or in nested objects such as ``commercialTerms``, are dropped on validation
+    and must stay in the file.
+    """
+    data = invoice.model_dump(by_alias=True, exclude_none=True)
+    if not _keeps_fields(data, raw):
+        return None
+    data["_metadata"] = {**(data.get("_metadata") or {}), "version": FASTAPI_VERSION}
+    return data
+
+
+@lru_cache
+def get_invoice_cache() -> VersionedLRUCache[Invoice]:
+    """
+    Process-wide cache of validated invoices keyed by filename and storage version
+    ((mtime_ns, size) for files), so repeated opens and PDF downloads skip disk
+    reads and validation.
+    """
+    return VersionedLRUCache(settings.invoice_cache_size)
+
 
 class InvoiceService:
-    def __init__(self):
-        self.storage_path = settings.invoice_storage_path
-        self._ensure_storage_access()
+    def __init__(
+        self,
+        repository: Optional[InvoiceRepository] = None,
+        cache: Optional[VersionedLRUCache[Invoice]] = None,
+    ):
+        self.repository = repository or get_invoice_repository()
+        self.cache = cache if cache is not None else get_invoice_cache()
 
-    def _ensure_storage_access(self):
-        if not os.path.exists(self.storage_path):
-            try:
-                os.makedirs(self.storage_path, mode=0o777, exist_ok=True)
-            except OSError as e:
-                raise RuntimeError(f"Failed to create storage directory {self.storage_path}: {e}")
-        
-        if not os.access(self.storage_path, os.W_OK):
-             # Try to fix permissions if we own it? No, unsafe. Just warn/fail.
-             # In docker, this might be tricky. We assume permissions are set correctly by ops.
-             # Just logging for now might be better than crashing app startup?
-             # But for a service that NEEDS to write, crashing is better.
-             raise RuntimeError(f"Storage directory {self.storage_path} is not writable by current user {os.getuid()}")
-
-    def list_invoices(self) -> List[Dict]:
-        """
-        Lists all invoices in the storage directory.
-        Returns basic metadata for the list view.
-        """
-        invoices = []
-        
-        try:
-            # Sort by modification time, newest first
-            files = sorted(glob(os.path.join(self.storage_path, "*.json")), key=os.path.getmtime, reverse=True)
-        except OSError as e:
-             raise HTTPException(status_code=500, detail=f"Failed to list invoices: {e}")
-
-        for file_path in files:
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    
-                    # Basic validation/extraction for list view
-                    invoices.append({
-                        "filename": os.path.basename(file_path),
-                        "number": data.get("number", "N/A"),
-                        "date": data.get("date", "N/A"),
-                        "recipient": data.get("recipient", "N/A"),
-                        "total": self._calculate_total(data),
-                        "currency": data.get("currency", "Руб."),
-                        "documentType": data.get("documentType", "regular"),
-                        "saved_at": data.get("_metadata", {}).get("saved_at", ""),
-                        "organizationId": data.get("organizationId", None)
-                    })
-            except (json.JSONDecodeError, OSError):
-                continue # Skip broken files
-
-        return invoices
-
-    def _calculate_total(self, data: dict) -> float:
-        total = 0.0
-        items = data.get("items", [])
-        if isinstance(items, list):
-            for item in items:
-                if isinstance(item, dict):
-                    try:
-                        q = float(item.get("quantity", 0))
-                        p = float(item.get("price", 0))
-                        total += q * p
-                    except (ValueError, TypeError):
-                        pass
-        return total
-
-    def get_invoice(self, filename: str) -> Invoice:
+    async def list_invoices(self) -> List[Dict]:
+        """
+        Lists all invoices in the storage.
+        Returns basic metadata for the list view, served from the storage index.
+        """
+        entries, _ = await self.list_invoices_page(InvoiceListQuery())
+        return entries
+
+    async def list_invoices_page(self, query: InvoiceListQuery) -> Tuple[List[Dict], Optional[str]]:
+        """
+        Filtered page of the invoice list with optional field projection.
+        Returns the entries and the cursor of the next page (None on the last page).
+        """
+        fields = None
+        if query.fields:
+            fields = [field.strip() for field in query.fields.split(",") if field.strip()]
+            unknown = sorted(set(fields) - set(LIST_FIELDS))
+            if unknown:
+                raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+            if "filename" not in fields:
+                fields.insert(0, "filename")
+
+        filters = {name: getattr(query, name) for name in LIST_FILTERS}
+        try:
+            entries, next_cursor = await self.repository.list_page(query.limit, query.after, filters)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except InvoiceStorageError as e:
+            raise HTTPException(status_code=500, detail=f"Failed to list invoices: {e}")
+
+        if fields:
+            entries = [{field: entry[field] for field in fields} for entry in entries]
+        return entries, next_cursor
+
+    async def list_etag(self, *parts) -> Optional[str]:
+        """
+        ETag of the invoice list, derived from the storage's list version and
+        ``parts`` (the query string), or None when the backend has no version.
+        """
+        try:
+            version = await self.repository.list_version()
+        except InvoiceStorageError as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        return etag.make_etag("list", version, *parts) if version is not None else None
+
+    async def invoice_etag(self, filename: str, *parts) -> Optional[str]:
+        """
+        ETag of an invoice from its storage version (file mtime/size), without
+        reading the invoice; None if it does not exist. ``parts`` distinguish
+        other representations, e.g. the PDF template version.
+        """
+        try:
+            version = await self.repository.version(os.path.basename(filename))
+        except InvoiceStorageError as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        return etag.make_etag(version, *parts) if version is not None else None
+
+    async def resolve_export(self, request: InvoiceExportRequest) -> List[str]:
+        """
+        Filenames to export: the explicit list (deduplicated, order kept) or the
+        filtered list, newest first. Raises 400 above INVOICE_EXPORT_MAX_ITEMS.
+        """
+        if request.filenames is not None:
+            filenames = list(dict.fromkeys(os.path.basename(name) for name in request.filenames))
+        else:
+            query = request.filter.model_copy(update={"fields": "filename", "limit": None, "after": None})
+            entries, _ = await self.list_invoices_page(query)
+            filenames = [entry["filename"] for entry in entries]
+        if not filenames:
+            raise HTTPException(status_code=400, detail="Nothing to export")
+        if len(filenames) > settings.invoice_export_max_items:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Too many invoices to export: {len(filenames)} > {settings.invoice_export_max_items}",
+            )
+        return filenames
+
+    async def search_invoices(self, query: str, limit: int = 50) -> List[Dict]:
+        """
+        Full-text search across the archive (number, recipient, INN, tender, items).
+        Returns list-view entries ordered by relevance.
+        """
+        try:
+            return await self.repository.search(query, limit)
+        except InvoiceStorageError as e:
+            raise HTTPException(status_code=500, detail=f"Failed to search invoices: {e}")
+
+    async def get_stats(self, recipients_limit: int = 20) -> InvoiceStats:
+        """
+        Archive totals by month, recipient, currency and document type.
+        Served from rollups maintained on every save/delete, not recomputed per request.
+        """
+        try:
+            return InvoiceStats.model_validate(await self.repository.stats(recipients_limit))
+        except InvoiceStorageError as e:
+            raise HTTPException(status_code=500, detail=f"Failed to compute stats: {e}")
+
+    async def autocomplete_items(self, prefix: str, limit: int = 20) -> List[InvoiceCatalogItem]:
+        """
+        Line items from the whole archive whose model, name or description starts
+        with ``prefix``, most used first, each with its most recent price and attributes.
+        """
+        try:
+            entries = await self.repository.catalog(prefix, limit)
+        except InvoiceStorageError as e:
+            raise HTTPException(status_code=500, detail=f"Failed to search items: {e}")
+        return [InvoiceCatalogItem.model_validate(entry) for entry in entries]
+
+    async def get_price_history(
+        self, model: Optional[str] = None, description: Optional[str] = None, limit: int = 100
+    ) -> InvoicePriceHistory:
+        """
+        What was charged for a model and/or description across the archive:
+        the most recent lines with dates, recipients and currency, plus
+        min/avg/max per currency. Read from the line items kept in the index.
+        """
+        model = (model or "").strip() or None
+        description = (description or "").strip() or None
+        if model is None and description is None:
+            raise HTTPException(status_code=400, detail="Either model or description is required")
+        try:
+            result = await self.repository.price_history(model, description, limit)
+        except InvoiceStorageError as e:
+            raise HTTPException(status_code=500, detail=f"Failed to read price history: {e}")
+        return InvoicePriceHistory.model_validate({"model": model, "description": description, **result})
+
+    async def get_invoice(self, filename: str) -> Invoice:
         safe_filename = os.path.basename(filename)
-        file_path = os.path.join(self.storage_path, safe_filename)
-        
-        if not os.path.exists(file_path):
+
+        try:
+            version = await self.repository.version(safe_filename)
+            if version is not None:
+                cached = self.cache.get(safe_filename, version)
+                if cached is not None:
+                    # Callers may mutate the model, the cached instance must stay intact
+                    return cached.model_copy(deep=True)
+            data = await self.repository.get(safe_filename)
+        except InvoiceStorageError as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        if data is None:
             raise HTTPException(status_code=404, detail="Invoice not found")
-            
+
         try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                
             # Inject filename if missing so we know which file we edited
             if "filename" not in data or not data["filename"]:
                 data["filename"] = safe_filename
                 
-            return Invoice.model_validate(data)
-        except json.JSONDecodeError:
-             raise HTTPException(status_code=500, detail="Invalid JSON file")
+            invoice = Invoice.model_validate(data)
         except ValidationError as e:
              # Return detailed error for debugging
              raise HTTPException(status_code=422, detail=f"Validation error: {e}")
 
-    def save_invoice(self, invoice: Invoice) -> Dict:
-        data = invoice.model_dump(by_alias=True, exclude_none=True)
-        
-        # Handle metadata
-        if "_metadata" not in data or not data["_metadata"]:
-             data["_metadata"] = {}
-             
-        data["_metadata"].update({
-            "saved_at": datetime.now().isoformat(),
-            "version": "2.0 (FastAPI)",
-            "updated_by": "fastapi_service"
-        })
-
-        filename = invoice.filename
-        if not filename:
-            # If no filename, generate one based on number + timestamp
-            safe_number = re.sub(r'[^a-zA-Z0-9-_]', '_', invoice.number)
-            timestamp = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
-            filename = f"{safe_number}_{timestamp}.json"
-            data["filename"] = filename
+        if version is not None:
+            # The version was taken before the read: if the file changed in between,
+            # the next lookup sees a newer version and simply misses.
+            self.cache.put(safe_filename, version, invoice.model_copy(deep=True))
+        return invoice
 
+    async def get_invoice_file(self, filename: str) -> Optional[str]:
+        """
+        Path of the stored invoice when it can be sent as is, without validating
+        and re-serializing it: files written by ``save_invoice`` and unchanged
+        since. Other files are validated and normalized to that format once
+        (``INVOICE_NORMALIZE_ON_READ``), so later reads take the same path.
+        None means the caller has to go through ``get_invoice``.
+        """
         safe_filename = os.path.basename(filename)
-        file_path = os.path.join(self.storage_path, safe_filename)
-        
-        # Atomic write
-        temp_path = f"{file_path}.tmp"
-        try:
-            with open(temp_path, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
-            
-            # Set permissions to 666 so PHP/Others can read/write if needed
-            os.chmod(temp_path, 0o666)
-            os.replace(temp_path, file_path)
-        except OSError as e:
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-            raise HTTPException(status_code=500, detail=f"Failed to save file: {e}")
-            
+        try:
+            path = await self.repository.raw_path(safe_filename)
+            if path is not None or not settings.invoice_normalize_on_read:
+                return path
+            version = await self.repository.version(safe_filename)
+            raw = await self.repository.get(safe_filename) if version is not None else None
+        except InvoiceStorageError as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        if not isinstance(raw, dict) or is_canonical(raw):
+            return None  # Already canonical (packed or not indexed yet): nothing to rewrite
+
+        try:
+            invoice = Invoice.model_validate({**raw, "filename": raw.get("filename") or safe_filename})
+        except ValidationError:
+            return None  # get_invoice reports the error
+        data = normalize_data(invoice, raw)
+        if data is None:
+            return None
+        try:
+            if await self.repository.normalize(safe_filename, version, data):
+                return await self.repository.raw_path(safe_filename)
+        except InvoiceStorageError as e:
+            logger.warning("Failed to normalize invoice %s: %s", safe_filename, e)
+        return None
+
+    async def save_invoice(self, invoice: Invoice, if_match: Optional[str] = None) -> Dict:
+        """
+        Creates or overwrites an invoice. With ``if_match`` (the If-Match header)
+        the invoice is only overwritten if it is still at the version the client
+        has seen, otherwise 412 is raised.
+        """
+
+        def precondition(version) -> bool:
+            return etag.match(if_match, etag.make_etag(version) if version is not None else None)
+
+        safe_filename, data = prepare_for_save(invoice)
+        self.cache.invalidate(safe_filename)
+        try:
+            # The repository checks the version under its write lock, atomically with the write
+            file_path = await self.repository.save(
+                safe_filename, data, precondition if if_match is not None else None
+            )
+        except InvoiceVersionConflictError:
+            raise HTTPException(
+                status_code=status.HTTP_412_PRECONDITION_FAILED,
+                detail="Invoice was modified by someone else",
+            )
+        except InvoiceStorageError as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
         return {"success": True, "filename": safe_filename, "filepath": file_path}
 
-    def delete_invoice(self, filename: str) -> Dict:
+    async def import_invoices(
+        self,
+        records: List[RawRecord],
+        overwrite: bool = False,
+        dry_run: bool = False,
+    ) -> InvoiceImportResult:
+        """
+        Bulk import: validates all records in the process pool, then saves the
+        valid ones in batches. Invalid records and write failures are reported
+        per record; they do not stop the rest of the import. Without
+        ``overwrite`` records whose filename already exists are rejected.
+        """
+        errors: List[InvoiceImportError] = []
+        items: Dict[str, Tuple[str, Dict]] = {}  # filename -> (source, data)
+        for source, invoice, error in await validate_records(records):
+            if invoice is None:
+                errors.append(InvoiceImportError(source=source, error=error or "Invalid record"))
+                continue
+            filename, data = prepare_for_save(invoice, updated_by="fastapi_import")
+            if filename in items:
+                if invoice.filename:
+                    errors.append(InvoiceImportError(
+                        source=source, filename=filename, error="Duplicate filename in import"
+                    ))
+                    continue
+                # Generated names only differ by the second they were made in
+                stem, suffix = os.path.splitext(filename)
+                filename = next(
+                    f"{stem}_{n}{suffix}" for n in range(2, len(items) + 3)
+                    if f"{stem}_{n}{suffix}" not in items
+                )
+                data["filename"] = filename
+            items[filename] = (source, data)
+
+        if dry_run:
+            saved = list(items)
+        else:
+            try:
+                failed = await self.repository.save_many(
+                    [(filename, data) for filename, (_, data) in items.items()], overwrite=overwrite
+                )
+            except InvoiceStorageError as e:
+                raise HTTPException(status_code=500, detail=f"Import failed: {e}")
+            for filename in items:
+                self.cache.invalidate(filename)
+            errors.extend(
+                InvoiceImportError(source=items[filename][0], filename=filename, error=error)
+                for filename, error in failed.items()
+            )
+            saved = [filename for filename in items if filename not in failed]
+
+        return InvoiceImportResult(
+            total=len(records),
+            imported=len(saved),
+            failed=len(errors),
+            dry_run=dry_run,
+            filenames=saved,
+            errors=errors,
+        )
+
+    async def delete_invoice(self, filename: str) -> Dict:
         safe_filename = os.path.basename(filename)
-        file_path = os.path.join(self.storage_path, safe_filename)
 
-        if not os.path.exists(file_path):
+        self.cache.invalidate(safe_filename)
+        try:
+            deleted = await self.repository.delete(safe_filename)
+        except InvoiceStorageError as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        if not deleted:
             raise HTTPException(status_code=404, detail="Invoice not found")
 
+        return {"success": True, "filename": safe_filename}
+
+    async def list_revisions(self, filename: str) -> List[InvoiceRevision]:
+        safe_filename = os.path.basename(filename)
         try:
-            os.remove(file_path)
-        except OSError as e:
-            raise HTTPException(status_code=500, detail=f"Failed to delete file: {e}")
+            revisions = await self.repository.revisions(safe_filename)
+        except InvoiceStorageError as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        if not revisions:
+            raise HTTPException(status_code=404, detail="Invoice has no revisions")
+        return [InvoiceRevision.model_validate(revision) for revision in revisions]
 
-        return {"success": True, "filename": safe_filename}
+    async def get_revision(self, filename: str, rev: int) -> Dict:
+        """
+        Invoice data as of a revision. Returned as stored, without validation:
+        old revisions may predate changes of the invoice schema.
+        """
+        try:
+            data = await self.repository.get_revision(os.path.basename(filename), rev)
+        except InvoiceStorageError as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        if data is None:
+            raise HTTPException(status_code=404, detail="Revision not found")
+        return data
 
-    def get_next_number(self, date_str: str = None) -> str:
+    async def get_next_number(self, date_str: str = None, reserve: bool = False) -> str:
         """
-        Scans all JSON files to find the next sequence number for the given date.
+        Allocates the next sequence number for the given date from the storage index.
         Format: DDMMYY-NN (e.g. 251118-01)
+        With ``reserve`` the number is held for ``invoice_number_reservation_ttl``
+        seconds so that concurrent callers do not receive the same number.
         Returns the full formatted number as a string.
         """
         if not date_str:
@@ -172,36 +448,22 @@ class InvoiceService:
                  date_str = dt.strftime("%d%m%y")
             except ValueError:
                  pass 
-        
-        # Regex: ^DDMMYY-(\d+)$
-        pattern = re.compile(rf"^{re.escape(date_str)}-(\d+)$", re.IGNORECASE)
-        
-        max_number = 0
-        
-        try:
-            files = os.listdir(self.storage_path)
-        except OSError:
-            # Return formatted number with leading zero
-            return f"{date_str}-01"
-            
-        for filename in files:
-            if not filename.endswith(".json"):
-                continue
-                
-            try:
-                with open(os.path.join(self.storage_path, filename), 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    invoice_number = str(data.get("number", "")).strip()
-                    
-                    match = pattern.match(invoice_number)
-                    if match:
-                        num = int(match.group(1))
-                        if num > max_number:
-                            max_number = num
-            except (json.JSONDecodeError, OSError):
-                continue
-        
-        # Format with leading zero (e.g., 01, 02, ...)
-        next_num = max_number + 1
-        return f"{date_str}-{next_num:02d}"
 
+        ttl = settings.invoice_number_reservation_ttl if reserve else 0
+        try:
+            return await self.repository.next_number(date_str, reserve_ttl=ttl)
+        except InvoiceStorageError as e:
+            raise HTTPException(status_code=500, detail=f"Failed to allocate invoice number: {e}")
+
+    async def release_number(self, number: str) -> Dict:
+        """
+        Releases a number reserved by ``get_next_number`` before it expires,
+        e.g. when the new invoice is abandoned. 404 when it is not reserved.
+        """
+        try:
+            released = await self.repository.release_number(number)
+        except InvoiceStorageError as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        if not released:
+            raise HTTPException(status_code=404, detail="Number is not reserved")
+        return {"success": True, "number": number}
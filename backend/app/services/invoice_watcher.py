@@ -0,0 +1,279 @@
+"""
+Слежение за директорией архива инвойсов (записи PHP-эндпоинтов).
+
+inotify через ctypes, где доступен, иначе опрос по stat; директории
+``YYYY/MM/`` отслеживаются тоже.
+"""
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import threading
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from app.services.invoice_index import MONTH_DIR_RE, YEAR_DIR_RE, is_archive_file, scan_archive
+
+logger = logging.getLogger(__name__)
+
+# inotify(7) event masks
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = (
+    IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    | IN_DELETE_SELF | IN_MOVE_SELF
+)
+
+_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len (followed by the name)
+_READ_SIZE = 64 * 1024
+
+
+class ArchiveWatcher:
+    """
+    Runs in a daemon thread and calls ``on_change(rel_path)`` for every archive file
+    that was created, modified or removed (``rel_path`` is relative to the archive,
+    e.g. ``name.json`` or ``2025/11/name.json``), and ``on_resync()`` when individual
+    events were lost and the caller has to fall back to a full reconcile.
+    """
+
+    kind = "none"
+
+    def __init__(
+        self,
+        storage_path: str,
+        on_change: Callable[[str], None],
+        on_resync: Callable[[], None],
+    ):
+        self.storage_path = storage_path
+        self.on_change = on_change
+        self.on_resync = on_resync
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._run, name=f"invoice-watcher-{self.kind}", daemon=True
+        )
+        self._thread.start()
+        logger.info("Invoice archive watcher started (%s): %s", self.kind, self.storage_path)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        self._stop.set()
+        self._wakeup()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _wakeup(self) -> None:
+        pass
+
+    def _run(self) -> None:
+        raise NotImplementedError
+
+    def _dispatch(self, names: Set[str]) -> None:
+        for name in sorted(names):
+            try:
+                self.on_change(name)
+            except Exception:
+                # One bad file must not stop the watcher
+                logger.exception("Failed to process archive change for %s", name)
+
+    def _resync(self) -> None:
+        try:
+            self.on_resync()
+        except Exception:
+            logger.exception("Invoice archive resync failed")
+
+
+class InotifyArchiveWatcher(ArchiveWatcher):
+    kind = "inotify"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is not available")
+
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        # Watch descriptor -> directory relative to the archive ("" is the archive itself)
+        self._dirs: Dict[int, str] = {}
+        try:
+            self._root_wd = self._add_watch("")
+        except OSError:
+            os.close(self._fd)
+            raise
+        self._watch_tree("")
+        # Self-pipe so that stop() can interrupt select()
+        self._wake_r, self._wake_w = os.pipe()
+
+    def _add_watch(self, rel_dir: str) -> int:
+        path = os.path.join(self.storage_path, rel_dir)
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        self._dirs[wd] = rel_dir
+        return wd
+
+    def _watch_tree(self, rel_dir: str) -> List[str]:
+        """
+        Watches the shard directories below ``rel_dir`` and returns the archive
+        files already in them: a directory created while we were not watching
+        it yet may have been filled in the meantime.
+        """
+        pattern = YEAR_DIR_RE if rel_dir == "" else MONTH_DIR_RE if "/" not in rel_dir else None
+        files = []
+        try:
+            entries = list(os.scandir(os.path.join(self.storage_path, rel_dir)))
+        except OSError as e:
+            logger.warning("Failed to scan %s: %s", rel_dir or self.storage_path, e)
+            return files
+        for entry in entries:
+            child = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+            if pattern is not None and entry.is_dir() and pattern.match(entry.name):
+                try:
+                    self._add_watch(child)
+                except OSError as e:
+                    logger.warning("Failed to watch %s: %s", child, e)
+                    continue
+                files.extend(self._watch_tree(child))
+            elif pattern is None and is_archive_file(entry.name) and entry.is_file():
+                files.append(child)
+        return files
+
+    def _wakeup(self) -> None:
+        try:
+            os.write(self._wake_w, b"x")
+        except OSError:
+            pass
+
+    def _read_events(self) -> Tuple[Set[str], bool]:
+        names: Set[str] = set()
+        overflow = False
+        while True:
+            try:
+                buffer = os.read(self._fd, _READ_SIZE)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset + _EVENT.size <= len(buffer):
+                wd, mask, _cookie, length = _EVENT.unpack_from(buffer, offset)
+                offset += _EVENT.size
+                name = os.fsdecode(buffer[offset:offset + length].split(b"\0", 1)[0])
+                offset += length
+
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                if mask & IN_IGNORED:
+                    self._dirs.pop(wd, None)
+                    continue
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    # The archive itself went away; removed shards only lose their watch
+                    overflow = overflow or wd == self._root_wd
+                    continue
+                rel_dir = self._dirs.get(wd)
+                if rel_dir is None or not name:
+                    continue
+                child = f"{rel_dir}/{name}" if rel_dir else name
+                if mask & IN_ISDIR:
+                    if not self._is_shard(rel_dir, name):
+                        continue
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        try:
+                            self._add_watch(child)
+                        except OSError as e:
+                            logger.warning("Failed to watch %s: %s", child, e)
+                            continue
+                        names.update(self._watch_tree(child))
+                    elif mask & IN_MOVED_FROM:
+                        # A whole shard moved away: its files are gone from the archive
+                        overflow = True
+                elif is_archive_file(name) and not mask & IN_CREATE:
+                    # IN_CREATE is followed by IN_CLOSE_WRITE once the content is there
+                    names.add(child)
+        return names, overflow
+
+    @staticmethod
+    def _is_shard(rel_dir: str, name: str) -> bool:
+        if rel_dir == "":
+            return bool(YEAR_DIR_RE.match(name))
+        return "/" not in rel_dir and bool(MONTH_DIR_RE.match(name))
+
+    def _run(self) -> None:
+        try:
+            while not self._stop.is_set():
+                ready, _, _ = select.select([self._fd, self._wake_r], [], [])
+                if self._stop.is_set():
+                    break
+                if self._fd not in ready:
+                    continue
+                # A burst of events for one file (PHP writes, renames) is handled once
+                names, overflow = self._read_events()
+                if overflow:
+                    logger.warning("inotify queue overflow, reconciling invoice archive")
+                    self._resync()
+                else:
+                    self._dispatch(names)
+        finally:
+            for fd in (self._fd, self._wake_r, self._wake_w):
+                os.close(fd)
+
+
+class PollingArchiveWatcher(ArchiveWatcher):
+    """Fallback for platforms and filesystems without inotify (NFS, macOS dev setups)."""
+
+    kind = "polling"
+
+    def __init__(self, *args, interval: float = 5.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.interval = interval
+        self._snapshot: Dict[str, Tuple[int, int]] = {}
+        self._snapshot = self._scan()
+
+    def _scan(self) -> Dict[str, Tuple[int, int]]:
+        try:
+            files = scan_archive(self.storage_path)
+        except OSError as e:
+            logger.warning("Failed to scan invoice archive: %s", e)
+            return self._snapshot
+        return {rel_path: (st.st_mtime_ns, st.st_size) for rel_path, st in files.values()}
+
+    def poll(self) -> Set[str]:
+        current = self._scan()
+        previous, self._snapshot = self._snapshot, current
+        changed = {name for name, ident in current.items() if previous.get(name) != ident}
+        changed.update(name for name in previous if name not in current)
+        return changed
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._dispatch(self.poll())
+
+
+def create_archive_watcher(
+    storage_path: str,
+    on_change: Callable[[str], None],
+    on_resync: Callable[[], None],
+    poll_interval: float = 5.0,
+) -> ArchiveWatcher:
+    """inotify watcher when the platform supports it, polling otherwise."""
+    try:
+        return InotifyArchiveWatcher(storage_path, on_change, on_resync)
+    except (OSError, AttributeError) as e:
+        logger.info("inotify unavailable (%s), polling the invoice archive every %ss", e, poll_interval)
+        return PollingArchiveWatcher(storage_path, on_change, on_resync, interval=poll_interval)
@@ -0,0 +1,185 @@
+"""
+Реестр организаций из ``js/organizations.js`` легаси-фронтенда.
+
+Литерал объекта разбирается один раз и перечитывается при изменении
+mtime/size файла; при ошибке разбора остаётся последняя удачная версия.
+"""
+import logging
+import os
+import re
+import threading
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Used for every invoice when organizations.js is missing (as the PHP renderer did)
+DEFAULT_ORGANIZATION: Dict[str, Any] = {
+    'id': 'vector',
+    'name': 'ООО "Вектор"',
+    'shortName': 'ВЕКТОР',
+    'code': 'VEC',
+    'address': '620143, Свердловская обл., г. Екатеринбург, ул. Машиностроителей, 19, оф.687',
+    'phone': '+7 (343) 236-44-44',
+    'email': 'sales@uralreduktor.ru',
+    'INN_vektor': '6679016273',
+    'logo': 'LOGO_URALREDUKTOR.png',
+    'stamp': 'vektor_2.png',
+    'signature': 'sign.png',
+}
+
+_DECLARATION_RE = re.compile(r"\b(?:const|let|var)\s+organizations\s*=")
+_TOKEN_RE = re.compile(
+    r"""
+    (?P<space>\s+|//[^\n]*|/\*.*?\*/)
+    | (?P<string>'(?:[^'\\\n]|\\.)*'|"(?:[^"\\\n]|\\.)*"|`(?:[^`\\$]|\\.|\$(?!\{))*`)
+    | (?P<number>-?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+    | (?P<name>[A-Za-z_$][\w$]*)
+    | (?P<punct>[{}\[\]:,])
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+_ESCAPES = {"n": "\n", "r": "\r", "t": "\t", "b": "\b", "f": "\f", "v": "\v", "0": "\0"}
+_ESCAPE_RE = re.compile(r"\\(u\{[0-9a-fA-F]+\}|u[0-9a-fA-F]{4}|x[0-9a-fA-F]{2}|\r\n|.)", re.DOTALL)
+_LITERALS = {"true": True, "false": False, "null": None, "undefined": None}
+
+
+class OrganizationsError(ValueError):
+    """organizations.js has no ``organizations`` object or it is not a plain literal."""
+
+
+def _unescape(escape: re.Match) -> str:
+    code = escape.group(1)
+    if code[0] in "ux" and len(code) > 1:
+        return chr(int(code[1:].strip("{}"), 16))
+    if code in ("\n", "\r\n"):
+        return ""  # Line continuation
+    return _ESCAPES.get(code, code)
+
+
+def _tokens(source: str, pos: int):
+    while pos < len(source):
+        match = _TOKEN_RE.match(source, pos)
+        if match is None:
+            raise OrganizationsError(f"Unexpected {source[pos:pos + 20]!r} at offset {pos}")
+        pos = match.end()
+        kind = match.lastgroup
+        if kind == "space":
+            continue
+        text = match.group()
+        if kind == "string":
+            yield "value", _ESCAPE_RE.sub(_unescape, text[1:-1])
+        elif kind == "number":
+            yield "value", float(text) if any(c in text for c in ".eE") else int(text)
+        elif kind == "name":
+            yield "name", text
+        else:
+            yield text, text
+
+
+def parse_js_literal(source: str, pos: int = 0) -> Any:
+    """
+    Parses the JavaScript object/array literal starting at ``pos``: quoted or
+    bare keys, strings (template literals without ``${}``), numbers, booleans,
+    null, comments and trailing commas. Anything computed is an error.
+    """
+    tokens = _tokens(source, pos)
+
+    def value(token: Tuple[str, Any]) -> Any:
+        kind, text = token
+        if kind == "value":
+            return text
+        if kind == "name" and text in _LITERALS:
+            return _LITERALS[text]
+        if kind == "{":
+            result: Dict[str, Any] = {}
+            while True:
+                kind, key = next(tokens)
+                if kind == "}":
+                    return result
+                if kind not in ("value", "name"):
+                    raise OrganizationsError(f"Expected a key, got {key!r}")
+                if next(tokens)[0] != ":":
+                    raise OrganizationsError(f"Expected ':' after {key!r}")
+                result[str(key)] = value(next(tokens))
+                kind, text = next(tokens)
+                if kind == "}":
+                    return result
+                if kind != ",":
+                    raise OrganizationsError(f"Expected ',' or '}}', got {text!r}")
+        if kind == "[":
+            items: List[Any] = []
+            while True:
+                token = next(tokens)
+                if token[0] == "]":
+                    return items
+                items.append(value(token))
+                kind, text = next(tokens)
+                if kind == "]":
+                    return items
+                if kind != ",":
+                    raise OrganizationsError(f"Expected ',' or ']', got {text!r}")
+        raise OrganizationsError(f"Unsupported value {text!r}")
+
+    try:
+        return value(next(tokens))
+    except StopIteration:
+        raise OrganizationsError("Unexpected end of file") from None
+
+
+def parse_organizations(source: str) -> Dict[str, Dict[str, Any]]:
+    """``{id: organization}`` from the text of organizations.js."""
+    declaration = _DECLARATION_RE.search(source)
+    if declaration is None:
+        raise OrganizationsError("No `organizations` object")
+    organizations = parse_js_literal(source, declaration.end())
+    if not isinstance(organizations, dict) or not all(isinstance(v, dict) for v in organizations.values()):
+        raise OrganizationsError("`organizations` must map ids to objects")
+    return {key: {"id": key, **org} for key, org in organizations.items()}
+
+
+class OrganizationRegistry:
+    """organizations.js parsed once and reloaded when the file changes."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._version: Optional[Tuple[int, int]] = None
+        self._organizations: Optional[Dict[str, Dict[str, Any]]] = None
+
+    def all(self) -> Optional[Dict[str, Dict[str, Any]]]:
+        """All organizations by id; None when the file does not exist."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        version = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            if version != self._version:
+                try:
+                    with open(self.path, encoding="utf-8") as f:
+                        self._organizations = parse_organizations(f.read())
+                except (OSError, UnicodeDecodeError, OrganizationsError) as e:
+                    logger.warning("Failed to load %s, keeping the previous version: %s", self.path, e)
+                    if self._organizations is None:
+                        self._organizations = {}
+                self._version = version
+            return self._organizations
+
+    def get(self, org_id: str) -> Optional[Dict[str, Any]]:
+        """An organization by id; the default organization when the file is missing."""
+        organizations = self.all()
+        if organizations is None:
+            return DEFAULT_ORGANIZATION
+        return organizations.get(org_id)
+
+    def list(self) -> List[Dict[str, Any]]:
+        organizations = self.all()
+        return [DEFAULT_ORGANIZATION] if organizations is None else list(organizations.values())
+
+
+@lru_cache
+def get_organization_registry() -> OrganizationRegistry:
+    return OrganizationRegistry(get_settings().organizations_file)
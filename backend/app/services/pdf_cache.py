@@ -0,0 +1,183 @@
+"""
+Дисковый кэш PDF с ключом по содержимому.
+
+Ключ — хэш шаблона и контекста рендеринга, поэтому записи не устаревают;
+вытесняются по LRU сверх ``max_bytes`` или ``max_entries``.
+"""
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+from app.core.config import get_settings
+from app.utils import jsonio
+
+logger = logging.getLogger(__name__)
+
+SUFFIX = ".pdf"
+
+
+def cache_key(template: str, context: Dict[str, Any]) -> str:
+    """Hash of the template source and the render context (key order independent)."""
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(hashlib.blake2b(template.encode("utf-8"), digest_size=20).digest())
+    digest.update(jsonio.dumps(_canonical(context)))
+    return digest.hexdigest()
+
+
+def _canonical(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {str(k): _canonical(value[k]) for k in sorted(value, key=str)}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+class PdfCache:
+    """Thread-safe LRU of PDF files on disk, capped by total size and entry count."""
+
+    def __init__(self, path: str, max_bytes: int, max_entries: int = 0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries: Optional["OrderedDict[str, int]"] = None  # key -> size, LRU first
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.hit_bytes = 0
+        self.writes = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _file(self, key: str) -> str:
+        return os.path.join(self.path, key[:2], key + SUFFIX)
+
+    def _load(self) -> "OrderedDict[str, int]":
+        """In-memory LRU order, rebuilt from the cache directory on first use."""
+        if self._entries is None:
+            found = []
+            try:
+                with os.scandir(self.path) as shards:
+                    for shard in shards:
+                        if not shard.is_dir():
+                            continue
+                        with os.scandir(shard.path) as files:
+                            for entry in files:
+                                if entry.name.endswith(SUFFIX) and entry.is_file():
+                                    st = entry.stat()
+                                    found.append((st.st_mtime_ns, entry.name[:-len(SUFFIX)], st.st_size))
+            except OSError as e:
+                if not isinstance(e, FileNotFoundError):
+                    logger.warning("Failed to scan the PDF cache: %s", e)
+            found.sort()
+            self._entries = OrderedDict((key, size) for _, key, size in found)
+            self._bytes = sum(size for _, _, size in found)
+            self._evict()
+        return self._entries
+
+    def get(self, key: str) -> Optional[bytes]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            if key not in self._load():
+                self.misses += 1
+                return None
+        path = self._file(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            data = None  # Evicted meanwhile (possibly by another worker)
+        with self._lock:
+            entries = self._entries
+            if data is None:
+                if key in entries:
+                    self._bytes -= entries.pop(key)
+                self.misses += 1
+                return None
+            if key in entries:
+                entries.move_to_end(key)
+            self.hits += 1
+            self.hit_bytes += len(data)
+            return data
+
+    def put(self, key: str, data: bytes) -> None:
+        if not self.enabled or len(data) > self.max_bytes:
+            return
+        path = self._file(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with self._lock:
+            entries = self._load()
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(temp_path, "wb") as f:
+                    f.write(data)
+                os.replace(temp_path, path)
+            except OSError as e:
+                logger.warning("Failed to cache PDF %s: %s", key, e)
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                return
+            self._bytes += len(data) - entries.pop(key, 0)
+            entries[key] = len(data)
+            self.writes += 1
+            self._evict()
+
+    def _evict(self) -> None:
+        entries = self._entries
+        while entries and (
+            self._bytes > self.max_bytes or (self.max_entries and len(entries) > self.max_entries)
+        ):
+            key, size = entries.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self._file(key))
+            except FileNotFoundError:
+                pass
+
+    def clear(self) -> None:
+        with self._lock:
+            for key in list(self._load()):
+                try:
+                    os.remove(self._file(key))
+                except FileNotFoundError:
+                    pass
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            entries = self._load() if self.enabled else {}
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "hit_bytes": self.hit_bytes,
+                "writes": self.writes,
+                "evictions": self.evictions,
+            }
+
+
+@lru_cache
+def get_pdf_cache() -> PdfCache:
+    """Process-wide PDF cache; by default in ``<INVOICE_STORAGE_PATH>/.pdf-cache``."""
+    settings = get_settings()
+    path = settings.pdf_cache_path or os.path.join(settings.invoice_storage_path, ".pdf-cache")
+    return PdfCache(path, settings.pdf_cache_max_mb * 2**20, settings.pdf_cache_max_entries)
@@ -1,107 +1,60 @@
+import asyncio
 import json
 import os
 import base64
+import hashlib
 import re
 from datetime import datetime
-from typing import Dict, Any, List, Optional
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Tuple
 from pathlib import Path
 
 from fastapi import HTTPException
-from jinja2 import Environment, FileSystemLoader
-from playwright.async_api import async_playwright
+from jinja2 import Template
+from playwright.async_api import Page
+
+from app.services.browser_pool import get_browser_pool
+from app.services.pdf_cache import cache_key, get_pdf_cache
+from app.services.organizations import get_organization_registry
+from app.services.pdf_templates import get_pdf_templates
+
+# Подставляет содержимое body и завершается, когда документ готов к печати
+FILL_BODY_SCRIPT = """async (html) => {
+    document.body.innerHTML = html;
+    await Promise.all(Array.from(document.images, (img) => img.decode().catch(() => {})));
+    await document.fonts.ready;
+}"""
+
+ORG_FIELDS = ['name', 'address', 'phone', 'email', 'INN_vektor', 'logo', 'stamp', 'signature', 'code']
+# Изображения организации, которые встраиваются в PDF
+IMAGE_FIELDS = ['logo', 'stamp', 'signature']
+BANKING_FIELDS = ['bankName', 'bankAddress', 'account', 'bik', 'correspondentAccount', 'beneficiary']
+
+
+def _text(value: Any) -> str:
+    return '' if value is None else str(value)
 
 
 class PdfService:
     def __init__(self):
         # Пути к ресурсам
         self.base_dir = Path("/var/www/kp")
-        self.org_file = self.base_dir / "js" / "organizations.js"
-        
-        # Jinja2 шаблоны (будем использовать inline для простоты)
-        self.env = Environment(autoescape=True)
+        # Организации из organizations.js, разобранные один раз (перечитываются при изменении файла)
+        self.organizations = get_organization_registry()
+        self.org_file = Path(self.organizations.path)
 
-    def _parse_organization_data(self, org_id: str) -> Dict[str, str]:
-        """Парсит данные организации из organizations.js"""
-        try:
-            with open(self.org_file, 'r', encoding='utf-8') as f:
-                content = f.read()
-        except FileNotFoundError:
-            return self._get_default_org_data()
-
-        org_data = {
-            'name': '',
-            'address': '',
-            'phone': '',
-            'email': '',
-            'INN_vektor': '',
-            'logo': '',
-            'stamp': '',
-            'signature': '',
-            'code': ''
-        }
-
-        # Ищем блок организации
-        pattern = rf"'{org_id}':\s*\{{([^}}]+(?:\{{[^}}]*\}}[^}}]*)*)\}}"
-        match = re.search(pattern, content, re.DOTALL)
-        
-        if match:
-            org_block = match.group(1)
-            
-            # Извлекаем поля
-            fields = ['name', 'address', 'phone', 'email', 'INN_vektor', 'logo', 'stamp', 'signature', 'code']
-            for field in fields:
-                field_pattern = rf"(?:'{field}'|{field}):\s*'([^']+)'"
-                field_match = re.search(field_pattern, org_block)
-                if field_match:
-                    org_data[field] = field_match.group(1)
+        # Шаблоны документов (app/templates/pdf), скомпилированные один раз на процесс
+        self.templates = get_pdf_templates()
 
-        return org_data
+    def _parse_organization_data(self, org_id: str) -> Dict[str, str]:
+        """Данные организации из реестра organizations.js"""
+        org = self.organizations.get(org_id) or {}
+        return {field: _text(org.get(field)) for field in ORG_FIELDS}
 
     def _parse_banking_details(self, org_id: str) -> Dict[str, str]:
-        """Парсит банковские реквизиты из organizations.js"""
-        try:
-            with open(self.org_file, 'r', encoding='utf-8') as f:
-                content = f.read()
-        except FileNotFoundError:
-            return {}
-
-        banking_details = {
-            'bankName': '',
-            'bankAddress': '',
-            'account': '',
-            'bik': '',
-            'correspondentAccount': '',
-            'beneficiary': ''
-        }
-
-        pattern = rf"'{org_id}':\s*\{{([^}}]+(?:\{{[^}}]*\}}[^}}]*)*)\}}"
-        match = re.search(pattern, content, re.DOTALL)
-        
-        if match:
-            org_block = match.group(1)
-            
-            fields = ['bankName', 'bankAddress', 'account', 'bik', 'correspondentAccount', 'beneficiary']
-            for field in fields:
-                field_pattern = rf"(?:'{field}'|{field}):\s*'([^']+)'"
-                field_match = re.search(field_pattern, org_block)
-                if field_match:
-                    banking_details[field] = field_match.group(1)
-
-        return banking_details
-
-    def _get_default_org_data(self) -> Dict[str, str]:
-        """Дефолтные данные организации"""
-        return {
-            'name': 'ООО "Вектор"',
-            'address': '620143, Свердловская обл., г. Екатеринбург, ул. Машиностроителей, 19, оф.687',
-            'phone': '+7 (343) 236-44-44',
-            'email': 'sales@uralreduktor.ru',
-            'INN_vektor': '6679016273',
-            'logo': 'LOGO_URALREDUKTOR.png',
-            'stamp': 'vektor_2.png',
-            'signature': 'sign.png',
-            'code': 'VEC'
-        }
+        """Банковские реквизиты организации из реестра organizations.js"""
+        org = self.organizations.get(org_id) or {}
+        return {field: _text(org.get(field)) for field in BANKING_FIELDS}
 
     def _image_to_base64(self, filename: str) -> str:
         """Конвертирует изображение в base64 data URI"""
@@ -343,469 +296,91 @@ class PdfService:
         
         return result
 
-    def _get_playwright_template(self) -> str:
-        """Возвращает HTML шаблон для Playwright (полная копия PHP версии)"""
-        return '''<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Коммерческое Предложение</title>
-    <style>
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
-        body {
-            font-family: Arial, sans-serif;
-            font-size: 10pt; 
-            line-height: 1.4;
-            color: #000;
-            padding: 20px;
-        }
-        .container { 
-            max-width: 210mm; 
-            margin: 0 auto; 
-            padding: 10mm 10mm 2px 10mm;
-        }
-        .header { 
-            display: flex; 
-            justify-content: space-between; 
-            align-items: center;
-            margin-bottom: 20px; 
-            border-bottom: 2px solid #3b82f6;
-            padding-bottom: 15px;
-        }
-        .logo-section { 
-            flex-shrink: 0;
-            display: flex;
-            align-items: center;
-        }
-        .logo { 
-            max-height: 80px; 
-            width: auto;
-            object-fit: contain;
-        }
-        .company-info { 
-            text-align: right; 
-            font-size: 9pt; 
-            color: #1F2937;
-            display: flex;
-            flex-direction: column;
-            align-items: flex-end;
-            justify-content: center;
-        }
-        .company-info a {
-            color: inherit;
-            text-decoration: none;
-        }
-        .company-name { 
-            font-weight: bold; 
-            font-size: 11pt; 
-            margin-bottom: 5px;
-        }
-        .title {
-            text-align: center;
-            font-size: 18pt;
-            font-weight: bold;
-            margin: 10px 0;
-            color: #1e40af;
-        }
-        .document-info {
-            display: flex;
-            text-align: left;
-            margin-bottom: 5px;
-        }
-        .bill-to {
-            flex: 3;
-        }
-        .invoice-details {
-            flex: 1;
-            text-align: left;
-            margin-left: 140px;
-        }
-        .info-label {
-            font-weight: bold;
-            font-size: 9pt;
-            color: #374151;
-            margin-top: 10px;
-        }
-        .info-value {
-            font-size: 10pt;
-            margin-top: 3px;
-        }
-        .info-row {
-            margin-top: 10px;
-        }
-        .info-row .info-label {
-            margin-top: 0;
-            margin-right: 5px;
-        }
-        .info-row .info-value {
-            margin-top: 0;
-        }
-        .intro-text {
-            font-size: 10pt;
-            color: #1F2937;
-            margin: 10px 0;
-            line-height: 1.6;
-        }
-        table {
-            width: 100%;
-            border-collapse: collapse;
-            margin: 20px 0;
-        }
-        th, td {
-            border: none;
-            padding: 8px;
-            text-align: left;
-        }
-        th {
-            background-color: #3b82f6;
-            color: white;
-            font-weight: bold;
-            font-size: 9pt;
-        }
-        td {
-            font-size: 9pt;
-        }
-        .text-center { text-align: center; }
-        .text-right { text-align: right; }
-        .total-row {
-            background-color: #f3f4f6;
-            font-weight: bold;
-        }
-        .vat-row {
-            background-color: #f9fafb;
-            font-size: 9pt;
-        }
-        .terms-section {
-            margin-top: 20px;
-            font-size: 9pt;
-            line-height: 1.6;
-            display: flex;
-            justify-content: space-between;
-            gap: 40px;
-        }
-        .terms-left, .terms-right {
-            flex: 1;
-        }
-        .terms-section p {
-            margin: 5px 0;
-        }
-        .remarks-section {
-            margin-top: 20px;
-            font-size: 9pt;
-            line-height: 1.1;
-            width: 100%;
-        }
-        .remarks-section p {
-            margin: 0;
-        }
-        .banking-section {
-            margin-top: 15px;
-            padding: 10px;
-            background-color: #f9fafb;
-            border: 1px solid #e5e7eb;
-            border-radius: 4px;
-            overflow: visible;
-            page-break-inside: avoid;
-            break-inside: avoid-page;
-            page-break-before: avoid;
-            page-break-after: auto;
-            position: relative;
-            z-index: 1;
-            margin-bottom: 0;
-            padding-bottom: 0;
-        }
-        .banking-section h3 {
-            font-size: 11pt;
-            margin-bottom: 10px;
-            color: #1e40af;
-        }
-        .banking-details-list {
-            font-family: Arial, sans-serif;
-            font-size: 9pt;
-            line-height: 1.5;
-        }
-        .banking-detail-item {
-            margin-bottom: 8px;
-        }
-        .banking-detail-label {
-            font-weight: bold;
-            color: #1F2937;
-        }
-        .banking-detail-value {
-            color: #000;
-        }
-        .banking-detail-row {
-            display: flex;
-            gap: 30px;
-            margin-bottom: 8px;
-        }
-        .banking-detail-col {
-            flex: 1;
-        }
-        .signature {
-            margin-top: {{ signature_margin_top }}px;
-            padding-top: 20px;
-            display: flex;
-            align-items: flex-start;
-            justify-content: flex-start;
-            position: relative;
-            gap: 50px;
-            margin-left: 250px;
-            page-break-inside: avoid !important;
-            break-inside: avoid-page !important;
-            page-break-before: avoid !important;
-            page-break-after: avoid !important;
-            z-index: 2;
-            margin-bottom: 5px;
-        }
-        @page {
-            margin-bottom: 5px;
-        }
-        .signature-center {
-            flex: 0 0 auto;
-            display: flex;
-            align-items: flex-start;
-            margin-right: 5px;
-        }
-        .signature-right {
-            flex: 0 0 auto;
-        }
-        .signature-images {
-            position: relative;
-            display: inline-block;
-            margin-top: -10px;
-        }
-        .signature-stamp {
-            max-width: 150px;
-            height: auto;
-            position: relative;
-            z-index: 1;
-        }
-        .signature-sign {
-            max-width: 120px;
-            height: auto;
-            position: absolute;
-            top: 30px;
-            left: 20px;
-            z-index: 2;
-        }
-        .signature-text {
-            text-align: center;
-            position: relative;
-            z-index: 3;
-            text-align: left;
-        }
-        @media print {
-            body { padding: 0; }
-            .container { padding: 0; }
-        }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <div class="header">
-            <div class="logo-section">
-                {% if logo_path %}<img src="{{ logo_path }}" alt="{{ org.name }}" class="logo" />{% endif %}
-            </div>
-            <div class="company-info">
-                <div class="company-name">{{ org.name }}</div>
-                {% if org.INN_vektor %}<div>ИНН: {{ org.INN_vektor }}</div>{% endif %}
-                <div>{{ org.address }}</div>
-                <div><a href="tel:{{ org.phone|replace(' ', '')|replace('(', '')|replace(')', '')|replace('-', '') }}">{{ org.phone }}</a></div>
-                <div><a href="mailto:{{ org.email }}">{{ org.email }}</a></div>
-            </div>
-        </div>
-        
-        <div class="title">Коммерческое Предложение</div>
-        
-        <div class="document-info">
-            <div class="bill-to">
-                <div class="info-label">Плательщик:</div>
-                <div class="info-value">{{ recipient }}</div>
-                <div style="font-size: 10pt; color: #374151;">{{ recipient_address }}</div>
-                {% if recipient_inn %}<div style="font-size: 10pt; color: #374151; margin-top: 3px;">ИНН: {{ recipient_inn }}</div>{% endif %}
-            </div>
-            <div class="invoice-details">
-                <div class="info-row"><span class="info-label">Номер:</span> <span class="info-value">{{ number }}</span></div>
-                <div class="info-row"><span class="info-label">Дата:</span> <span class="info-value">{{ date }}</span></div>
-                <div class="info-row"><span class="info-label">Валюта:</span> <span class="info-value">{{ currency }}</span></div>
-            </div>
-        </div>
-        
-        <div class="intro-text">В ответ на Ваш запрос, на поставку продукции, готовы предложить следующее:</div>
-        
-        <table>
-            <thead>
-                <tr>
-                    <th style="width: 5%;">No.</th>
-                    <th style="min-width: 200px;">Описание Товара</th>
-                    <th style="width: 15%;" class="text-center">Страна<br>Производства</th>
-                    <th style="width: 8%;" class="text-center">Кол-во</th>
-                    <th style="width: 7%;" class="text-center">Ед.</th>
-                    <th style="width: 11%;" class="text-center">Цена за<br>ед.</th>
-                    <th style="width: 12%;" class="text-right">Сумма</th>
-                </tr>
-            </thead>
-            <tbody>
-            {% for item in items %}
-                <tr>
-                    <td class="text-center">{{ loop.index }}</td>
-                    <td>
-                        <div style="font-weight: bold;">{{ item.get('description') or item.get('type') or '' }}</div>
-                        {% if item.get('model') %}<div style="font-size: 0.9em; color: #555;">{{ item.get('model') }}</div>{% endif %}
-                        {% if item.get('name') %}<div style="font-size: 0.9em; color: #333;">{{ item.get('name') }}</div>{% endif %}
-                    </td>
-                    <td class="text-center">{{ item.get('countryOfOrigin') or item.get('country') or '' }}</td>
-                    <td class="text-center">{{ item.get('quantity_formatted') }}</td>
-                    <td class="text-center">{{ item.get('unit') or '' }}</td>
-                    <td class="text-right">{{ item.get('price_formatted') }}</td>
-                    <td class="text-right">{{ item.get('amount_formatted') }}</td>
-                </tr>
-            {% endfor %}
-                <tr class="total-row">
-                    <td colspan="6" class="text-right"><strong>Сумма в {{ currency }}:</strong></td>
-                    <td class="text-right"><strong>{{ total }}</strong></td>
-                </tr>
-                <tr class="vat-row">
-                    <td colspan="6" class="text-right">В том числе НДС - 20%:</td>
-                    <td class="text-right">{{ vat }}</td>
-                </tr>
-            </tbody>
-        </table>
-        
-        <div class="terms-section">
-            <div class="terms-left">
-                <p><strong>Условия поставки:</strong> {{ incoterm }} {{ delivery_place }}</p>
-                <p><strong>Условия оплаты:</strong> {{ payment_terms }}</p>
-                <p><strong>{{ delivery_label }}:</strong> {{ delivery_time }}</p>
-            </div>
-            <div class="terms-right">
-                <p><strong>Гарантия:</strong> {{ warranty }}</p>
-                <p><strong>Коммерческое Предложение действительно до:<br></strong> {{ valid_until }}</p>
-            </div>
-        </div>
-        
-        {% if remarks %}
-        <div class="remarks-section">
-            <p><strong>Примечания:</strong> {{ remarks|replace('\\n', '<br>')|safe }}</p>
-        </div>
-        {% endif %}
-        
-        {% if banking.bankName or banking.account %}
-        <div class="banking-section">
-            <h3>Банковские реквизиты</h3>
-            <div class="banking-details-list">
-                {% if banking.bankName %}
-                <div class="banking-detail-item">
-                    <span class="banking-detail-label">Банк:</span>
-                    <span class="banking-detail-value">{{ banking.bankName }}</span>
-                </div>
-                {% endif %}
-                {% if banking.bankAddress %}
-                <div class="banking-detail-item">
-                    <span class="banking-detail-label">Адрес банка:</span>
-                    <span class="banking-detail-value">{{ banking.bankAddress }}</span>
-                </div>
-                {% endif %}
-                {% if banking.bik or banking.correspondentAccount %}
-                <div class="banking-detail-item banking-detail-row">
-                    {% if banking.bik %}
-                    <div class="banking-detail-col">
-                        <span class="banking-detail-label">БИК:</span>
-                        <span class="banking-detail-value">{{ banking.bik }}</span>
-                    </div>
-                    {% endif %}
-                    {% if banking.correspondentAccount %}
-                    <div class="banking-detail-col">
-                        <span class="banking-detail-label">Корр. счет:</span>
-                        <span class="banking-detail-value">{{ banking.correspondentAccount }}</span>
-                    </div>
-                    {% endif %}
-                </div>
-                {% endif %}
-                {% if banking.beneficiary or banking.account %}
-                <div class="banking-detail-item banking-detail-row">
-                    {% if banking.beneficiary %}
-                    <div class="banking-detail-col">
-                        <span class="banking-detail-label">Бенефициар:</span>
-                        <span class="banking-detail-value">{{ banking.beneficiary }}</span>
-                    </div>
-                    {% endif %}
-                    {% if banking.account %}
-                    <div class="banking-detail-col">
-                        <span class="banking-detail-label">Счет:</span>
-                        <span class="banking-detail-value">{{ banking.account }}</span>
-                    </div>
-                    {% endif %}
-                </div>
-                {% endif %}
-            </div>
-        </div>
-        {% endif %}
-        
-        <div class="signature" style="margin-top: {{ signature_margin_top }}px;">
-            <div class="signature-center">
-                <div class="signature-text" style="margin-left: {{ signature_text_offset }}px; margin-top: {{ signature_text_top_offset }}px;">
-                    <div style="margin-bottom: 5px; font-weight: bold;">{{ contact_person }}</div>
-                    <div style="font-size: 9pt; color: #374151;">{{ position }}</div>
-                </div>
-            </div>
-            <div class="signature-right">
-                {% if stamp_path or signature_path %}
-                <div class="signature-images">
-                    {% if stamp_path %}<img src="{{ stamp_path }}" alt="Company Stamp" class="signature-stamp" />{% endif %}
-                    {% if signature_path %}<img src="{{ signature_path }}" alt="Authorized Signature" class="signature-sign" />{% endif %}
-                </div>
-                {% endif %}
-            </div>
-        </div>
-    </div>
-</body>
-</html>'''
+    def template_version(self) -> str:
+        """
+        Версия оформления PDF: все шаблоны, organizations.js и файлы логотипов,
+        печатей и подписей организаций (mtime и размер — без чтения файлов)
+        """
+        digest = hashlib.blake2b(self.templates.version().encode('ascii'), digest_size=8)
+        assets = {
+            _text(org.get(field))
+            for org in self.organizations.list()
+            for field in IMAGE_FIELDS
+        }
+        for path in [self.org_file, *(self.base_dir / name for name in sorted(assets) if name)]:
+            try:
+                st = path.stat()
+                digest.update(f"{path}:{st.st_mtime_ns}:{st.st_size}\0".encode('utf-8'))
+            except OSError:
+                digest.update(f"{path}:-\0".encode('utf-8'))
+        return digest.hexdigest()
+
+    def _render(self, template: Template, ctx: Dict[str, Any]) -> Tuple[str, str]:
+        """
+        Рендерит документ и делит его на оболочку (head со стилями и пустой body —
+        одинаковая для всех инвойсов шаблона) и содержимое body
+        """
+        html = template.render(**ctx)
+        head, _, rest = html.partition('<body>')
+        body, _, tail = rest.rpartition('</body>')
+        return f"{head}<body></body>{tail}", body
+
+    async def warm_up(self) -> None:
+        """Загружает оболочку основного шаблона в страницы пула браузеров заранее"""
+        shell, _ = self._render(self.templates.get(), self._normalize_invoice({}))
+        await get_browser_pool().warm(shell)
+
+    async def _print_pdf(self, page: Page, body_html: str) -> bytes:
+        # Страница уже с оболочкой: подставляем body и ждём картинки и шрифты
+        # (все ресурсы встроены, ожидание networkidle не нужно)
+        await page.evaluate(FILL_BODY_SCRIPT, body_html)
+        return await page.pdf(
+            format="A4",
+            print_background=True,
+            margin={
+                "top": "10mm",
+                "right": "10mm",
+                "bottom": "10mm",
+                "left": "10mm"
+            },
+            scale=1.0,
+            display_header_footer=False
+        )
 
     async def generate_pdf(self, invoice_data: Dict[str, Any]) -> bytes:
         """Генерирует PDF из данных инвойса"""
         try:
+            # Шаблон по типу документа и организации
+            name = self.templates.name(invoice_data.get('documentType'), invoice_data.get('organizationId'))
+
             # Нормализуем данные
             ctx = self._normalize_invoice(invoice_data)
-            
-            # Рендерим HTML через Jinja2
-            template = self.env.from_string(self._get_playwright_template())
-            html_content = template.render(**ctx)
+            key = cache_key(f"{name}:{self.templates.version(name)}", ctx)
+        except Exception as e:
+             raise HTTPException(status_code=500, detail=f"Failed to render HTML template: {str(e)}")
+
+        # Тот же контекст и шаблон дают тот же PDF: отдаём из кэша без браузера
+        cache = get_pdf_cache()
+        cached = await asyncio.to_thread(cache.get, key)
+        if cached is not None:
+            return cached
 
+        try:
+            # Страница пула уже держит оболочку, в неё подставляется только body
+            shell, body_html = self._render(self.templates.env.get_template(name), ctx)
         except Exception as e:
              raise HTTPException(status_code=500, detail=f"Failed to render HTML template: {str(e)}")
 
-        # Генерация PDF через Playwright
+        # Генерация PDF на странице из общего пула браузеров
         try:
-            async with async_playwright() as p:
-                browser = await p.chromium.launch(
-                    headless=True,
-                    args=['--no-sandbox', '--disable-setuid-sandbox', '--disable-dev-shm-usage', '--disable-gpu']
-                )
-                page = await browser.new_page()
-                await page.set_content(html_content, wait_until="networkidle")
-                
-                pdf_bytes = await page.pdf(
-                    format="A4",
-                    print_background=True,
-                    margin={
-                        "top": "10mm",
-                        "right": "10mm",
-                        "bottom": "10mm",
-                        "left": "10mm"
-                    },
-                    scale=1.0,
-                    display_header_footer=False
-                )
-                
-                await browser.close()
-                return pdf_bytes
-                
+            pdf_bytes = await get_browser_pool().run(lambda page: self._print_pdf(page, body_html), shell=shell)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Failed to generate PDF with Playwright: {str(e)}")
+        await asyncio.to_thread(cache.put, key, pdf_bytes)
+        return pdf_bytes
+
+
+@lru_cache
+def get_pdf_service() -> PdfService:
+    """Один PdfService на процесс: шаблоны и пути к ресурсам общие для всех запросов"""
+    return PdfService()
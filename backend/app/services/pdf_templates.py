@@ -0,0 +1,96 @@
+"""
+Реестр PDF-шаблонов (Jinja2-файлы в ``app/templates/pdf``).
+
+Шаблон выбирается по ``documentType`` и ``organizationId``: сначала
+``<documentType>/<organizationId>.html``, затем ``<documentType>/default.html``
+и ``default.html``. Версия шаблона — хэш его исходника.
+"""
+import hashlib
+import re
+import threading
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, Template, TemplatesNotFound
+
+from app.core.config import get_settings
+
+TEMPLATE_DIR = Path(__file__).resolve().parent.parent / "templates" / "pdf"
+DEFAULT_TEMPLATE = "default.html"
+
+# documentType and organizationId become path segments: only plain identifiers
+_NAME_RE = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+class PdfTemplates:
+    """Shared Jinja2 environment over the template directory plus template lookup per invoice."""
+
+    def __init__(self, directory: Path = TEMPLATE_DIR, auto_reload: bool = False):
+        self.directory = directory
+        self.auto_reload = auto_reload
+        self.env = Environment(
+            loader=FileSystemLoader(str(directory)),
+            autoescape=True,
+            auto_reload=auto_reload,
+            bytecode_cache=FileSystemBytecodeCache(),
+        )
+        self._names: Dict[Tuple[Optional[str], Optional[str]], str] = {}
+        self._versions: Dict[Optional[str], str] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def candidates(document_type: Optional[str], organization_id: Optional[str]) -> List[str]:
+        names = []
+        if document_type and _NAME_RE.match(document_type):
+            if organization_id and _NAME_RE.match(organization_id):
+                names.append(f"{document_type}/{organization_id}.html")
+            names.append(f"{document_type}/default.html")
+        names.append(DEFAULT_TEMPLATE)
+        return names
+
+    def name(self, document_type: Optional[str] = None, organization_id: Optional[str] = None) -> str:
+        """Name of the template used for an invoice of this type and organization."""
+        key = (document_type, organization_id)
+        if not self.auto_reload:
+            with self._lock:
+                name = self._names.get(key)
+            if name is not None:
+                return name
+        candidates = self.candidates(document_type, organization_id)
+        sources = set(self.env.list_templates(extensions=["html"]))
+        name = next((candidate for candidate in candidates if candidate in sources), None)
+        if name is None:
+            raise TemplatesNotFound(candidates)
+        if not self.auto_reload:
+            with self._lock:
+                self._names[key] = name
+        return name
+
+    def get(self, document_type: Optional[str] = None, organization_id: Optional[str] = None) -> Template:
+        """Compiled template for an invoice (cached by the environment)."""
+        return self.env.get_template(self.name(document_type, organization_id))
+
+    def version(self, name: Optional[str] = None) -> str:
+        """Hash of one template's source, or of all templates when ``name`` is None."""
+        if not self.auto_reload:
+            with self._lock:
+                version = self._versions.get(name)
+            if version is not None:
+                return version
+        digest = hashlib.blake2b(digest_size=8)
+        names = [name] if name is not None else sorted(self.env.list_templates(extensions=["html"]))
+        for template_name in names:
+            source, _, _ = self.env.loader.get_source(self.env, template_name)
+            digest.update(template_name.encode("utf-8") + b"\0" + source.encode("utf-8") + b"\0")
+        version = digest.hexdigest()
+        if not self.auto_reload:
+            with self._lock:
+                self._versions[name] = version
+        return version
+
+
+@lru_cache
+def get_pdf_templates() -> PdfTemplates:
+    """Process-wide template registry; hot reload only in the local environment."""
+    return PdfTemplates(auto_reload=get_settings().environment == "local")
@@ -0,0 +1,41 @@
+"""
+Строгие ETag и разбор условных заголовков (RFC 9110, 13.1).
+
+ETag строится из дешёвых идентификаторов версии (mtime/size файла, счётчик
+индекса), а не из содержимого ответа, — сравнить его можно без чтения файлов.
+"""
+
+from __future__ import annotations
+
+import hashlib
+from collections.abc import Hashable
+
+
+def make_etag(*parts: Hashable) -> str:
+    """Строгий ETag из частей версии, например ``make_etag(mtime_ns, size)``."""
+    digest = hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=12).hexdigest()
+    return f'"{digest}"'
+
+
+def _tags(header: str) -> list[str]:
+    return [tag.strip() for tag in header.split(",") if tag.strip()]
+
+
+def none_match(header: str | None, etag: str | None) -> bool:
+    """True, если ``If-None-Match`` совпал (слабое сравнение) — можно ответить 304."""
+    if not header or etag is None:
+        return False
+    tags = _tags(header)
+    if "*" in tags:
+        return True
+    return any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+def match(header: str | None, etag: str | None) -> bool:
+    """True, если ``If-Match`` выполнен (строгое сравнение); без заголовка — всегда."""
+    if header is None:
+        return True
+    tags = _tags(header)
+    if etag is None:
+        return False
+    return "*" in tags or etag in tags
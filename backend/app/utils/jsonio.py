@@ -0,0 +1,94 @@
+"""
+Сериализация JSON через orjson с откатом на стандартный ``json``.
+
+``dumps_document`` — формат файлов архива: байт-в-байт то же, что
+``json.dump(data, f, ensure_ascii=False, indent=2)`` (архив читают и сравнивают
+PHP-эндпоинты). orjson иначе записывает только числа с плавающей точкой, для
+которых Python выбирает экспоненту (``1e-05``, ``1e+16``), и не пишет NaN — такие
+документы, как и всё, что orjson не умеет, сериализуются через ``json``.
+Без установленного orjson модуль целиком работает на ``json``.
+"""
+
+from __future__ import annotations
+
+import json
+import math
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is a regular dependency
+    orjson = None
+
+# Диапазон, в котором repr(float) не использует экспоненту
+_PLAIN_FLOAT_MIN = 1e-4
+_PLAIN_FLOAT_MAX = 1e16
+
+_SCALARS = (str, int, bool, type(None))
+
+
+def _orjson_compatible(obj: Any) -> bool:
+    """Сериализует ли orjson документ так же, как ``json`` (без рекурсии)."""
+    stack = [obj]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            for key, item in value.items():
+                if type(key) is not str:
+                    return False
+                stack.append(item)
+        elif isinstance(value, list):
+            stack.extend(value)
+        elif isinstance(value, float):
+            if value and not (
+                math.isfinite(value) and _PLAIN_FLOAT_MIN <= abs(value) < _PLAIN_FLOAT_MAX
+            ):
+                return False
+        elif not isinstance(value, _SCALARS):
+            # tuple, datetime и т.п. orjson и json пишут по-разному (или json не умеет вовсе)
+            return False
+    return True
+
+
+def loads(data: bytes | str) -> Any:
+    """Разбор JSON. То, что отвергает orjson (NaN, целые больше 64 бит), разбирает ``json``."""
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
+
+def load_file(path: str) -> Any:
+    with open(path, "rb") as f:
+        return loads(f.read())
+
+
+def dumps(obj: Any) -> bytes:
+    """Компактный JSON в UTF-8 — для ответов API и служебных логов."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_document(obj: Any) -> bytes:
+    """Документ архива: ``json.dumps(obj, ensure_ascii=False, indent=2)`` в UTF-8."""
+    if orjson is not None and _orjson_compatible(obj):
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+        except TypeError:
+            pass  # Например, целые больше 64 бит
+    return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """Ответ API, сериализуемый через ``dumps`` (класс ответа по умолчанию)."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
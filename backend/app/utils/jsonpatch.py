@@ -0,0 +1,115 @@
+"""
+Минимальная реализация JSON Patch (RFC 6902) для истории инвойсов.
+
+``make_patch`` строит операции ``add``/``remove``/``replace`` (``move``/``copy``
+не используются), ``apply_patch`` применяет их, не изменяя исходный документ.
+Массивы сравниваются поэлементно: изменённые позиции — ``replace``, хвост —
+``add``/``remove`` (удаление с конца, чтобы индексы оставались верными).
+"""
+
+from __future__ import annotations
+
+import copy
+from typing import Any
+
+
+class JsonPatchError(ValueError):
+    """Патч не применим к документу."""
+
+
+def _escape(token: str) -> str:
+    return token.replace("~", "~0").replace("/", "~1")
+
+
+def _unescape(token: str) -> str:
+    return token.replace("~1", "/").replace("~0", "~")
+
+
+def _diff(src: Any, dst: Any, path: str, ops: list[dict]) -> None:
+    if type(src) is not type(dst):
+        ops.append({"op": "replace", "path": path, "value": dst})
+        return
+
+    if isinstance(src, dict):
+        for key in src:
+            if key not in dst:
+                ops.append({"op": "remove", "path": f"{path}/{_escape(key)}"})
+        for key, value in dst.items():
+            child = f"{path}/{_escape(key)}"
+            if key not in src:
+                ops.append({"op": "add", "path": child, "value": value})
+            elif src[key] != value:
+                _diff(src[key], value, child, ops)
+        return
+
+    if isinstance(src, list):
+        common = min(len(src), len(dst))
+        for i in range(common):
+            if src[i] != dst[i]:
+                _diff(src[i], dst[i], f"{path}/{i}", ops)
+        for i in range(len(src) - 1, common - 1, -1):
+            ops.append({"op": "remove", "path": f"{path}/{i}"})
+        for i in range(common, len(dst)):
+            ops.append({"op": "add", "path": f"{path}/{i}", "value": dst[i]})
+        return
+
+    if src != dst:
+        ops.append({"op": "replace", "path": path, "value": dst})
+
+
+def make_patch(src: Any, dst: Any) -> list[dict]:
+    """Операции, превращающие ``src`` в ``dst``."""
+    ops: list[dict] = []
+    _diff(src, dst, "", ops)
+    return ops
+
+
+def _resolve(doc: Any, path: str) -> tuple[Any, str]:
+    """Родительский контейнер и последний токен пути."""
+    tokens = [_unescape(token) for token in path.split("/")[1:]]
+    parent = doc
+    for token in tokens[:-1]:
+        try:
+            parent = parent[int(token)] if isinstance(parent, list) else parent[token]
+        except (KeyError, IndexError, ValueError, TypeError) as e:
+            raise JsonPatchError(f"Path not found: {path}") from e
+    return parent, tokens[-1]
+
+
+def apply_patch(doc: Any, patch: list[dict]) -> Any:
+    """Применяет патч к копии ``doc`` и возвращает результат."""
+    result = copy.deepcopy(doc)
+    for op in patch:
+        kind, path = op.get("op"), op.get("path", "")
+        if path == "":
+            if kind not in ("add", "replace"):
+                raise JsonPatchError(f"Unsupported operation on the root: {kind}")
+            result = copy.deepcopy(op["value"])
+            continue
+
+        parent, token = _resolve(result, path)
+        try:
+            if isinstance(parent, list):
+                index = len(parent) if token == "-" else int(token)
+                if kind == "add":
+                    parent.insert(index, copy.deepcopy(op["value"]))
+                elif kind == "replace":
+                    parent[index] = copy.deepcopy(op["value"])
+                elif kind == "remove":
+                    del parent[index]
+                else:
+                    raise JsonPatchError(f"Unsupported operation: {kind}")
+            elif isinstance(parent, dict):
+                if kind in ("add", "replace"):
+                    if kind == "replace" and token not in parent:
+                        raise JsonPatchError(f"Path not found: {path}")
+                    parent[token] = copy.deepcopy(op["value"])
+                elif kind == "remove":
+                    del parent[token]
+                else:
+                    raise JsonPatchError(f"Unsupported operation: {kind}")
+            else:
+                raise JsonPatchError(f"Path not found: {path}")
+        except (KeyError, IndexError, ValueError) as e:
+            raise JsonPatchError(f"Path not found: {path}") from e
+    return result
@@ -0,0 +1,144 @@
+"""
+Токенизация и стемминг текста для поискового индекса.
+
+Стеммер — реализация алгоритма Snowball для русского языка
+(https://snowballstem.org/algorithms/russian/stemmer.html).
+Латиница и цифры (модели, ИНН, номера) не стеммятся.
+"""
+
+from __future__ import annotations
+
+import re
+
+_TOKEN_RE = re.compile(r"[0-9a-zа-я]+")
+_VOWELS = "аеиоуыэюя"
+
+_PERFECTIVE_GERUND_1 = ("в", "вши", "вшись")
+_PERFECTIVE_GERUND_2 = ("ив", "ивши", "ившись", "ыв", "ывши", "ывшись")
+_ADJECTIVE = (
+    "ее", "ие", "ые", "ое", "ими", "ыми", "ей", "ий", "ый", "ой", "ем", "им", "ым", "ом",
+    "его", "ого", "ему", "ому", "их", "ых", "ую", "юю", "ая", "яя", "ою", "ею",
+)
+_PARTICIPLE_1 = ("ем", "нн", "вш", "ющ", "щ")
+_PARTICIPLE_2 = ("ивш", "ывш", "ующ")
+_REFLEXIVE = ("ся", "сь")
+_VERB_1 = (
+    "ла", "на", "ете", "йте", "ли", "й", "л", "ем", "н", "ло", "но", "ет", "ют", "ны",
+    "ть", "ешь", "нно",
+)
+_VERB_2 = (
+    "ила", "ыла", "ена", "ейте", "уйте", "ите", "или", "ыли", "ей", "уй", "ил", "ыл", "им",
+    "ым", "ен", "ило", "ыло", "ено", "ят", "ует", "уют", "ит", "ыт", "ены", "ить", "ыть",
+    "ишь", "ую", "ю",
+)
+_NOUN = (
+    "а", "ев", "ов", "ие", "ье", "е", "иями", "ями", "ами", "еи", "ии", "и", "ией", "ей",
+    "ой", "ий", "й", "иям", "ям", "ием", "ем", "ам", "ом", "о", "у", "ах", "иях", "ях",
+    "ы", "ь", "ию", "ью", "ю", "ия", "ья", "я",
+)
+_DERIVATIONAL = ("ост", "ость")
+_SUPERLATIVE = ("ейш", "ейше")
+
+
+def _regions(word: str) -> tuple[int, int]:
+    """Возвращает начало RV и R2."""
+    rv = r1 = r2 = len(word)
+    for i, ch in enumerate(word):
+        if ch in _VOWELS:
+            rv = i + 1
+            break
+    for i in range(1, len(word)):
+        if word[i] not in _VOWELS and word[i - 1] in _VOWELS:
+            r1 = i + 1
+            break
+    for i in range(r1 + 1, len(word)):
+        if word[i] not in _VOWELS and word[i - 1] in _VOWELS:
+            r2 = i + 1
+            break
+    return rv, r2
+
+
+def _longest(word: str, start: int, endings: tuple[str, ...]) -> str | None:
+    found = None
+    for ending in endings:
+        if word.endswith(ending) and len(word) - len(ending) >= start:
+            if found is None or len(ending) > len(found):
+                found = ending
+    return found
+
+
+def _remove_grouped(
+    word: str, rv: int, group1: tuple[str, ...], group2: tuple[str, ...]
+) -> str | None:
+    """
+    Удаляет самое длинное окончание из двух групп. Окончания первой группы
+    должны следовать за «а» или «я»; если условие не выполнено, удаления нет.
+    """
+    ending = _longest(word, rv, group1 + group2)
+    if ending is None:
+        return None
+    stem = word[: -len(ending)]
+    if ending in group2:
+        return stem
+    if len(stem) - 1 >= rv and stem[-1] in "ая":
+        return stem
+    return None
+
+
+def stem(word: str) -> str:
+    word = word.lower().replace("ё", "е")
+    if not any("а" <= ch <= "я" for ch in word):
+        return word
+    rv, r2 = _regions(word)
+
+    # Step 1
+    result = _remove_grouped(word, rv, _PERFECTIVE_GERUND_1, _PERFECTIVE_GERUND_2)
+    if result is not None:
+        word = result
+    else:
+        reflexive = _longest(word, rv, _REFLEXIVE)
+        if reflexive:
+            word = word[: -len(reflexive)]
+        adjective = _longest(word, rv, _ADJECTIVE)
+        if adjective:
+            word = word[: -len(adjective)]
+            participle = _remove_grouped(word, rv, _PARTICIPLE_1, _PARTICIPLE_2)
+            if participle is not None:
+                word = participle
+        else:
+            result = _remove_grouped(word, rv, _VERB_1, _VERB_2)
+            if result is not None:
+                word = result
+            else:
+                noun = _longest(word, rv, _NOUN)
+                if noun:
+                    word = word[: -len(noun)]
+
+    # Step 2
+    if word.endswith("и") and len(word) - 1 >= rv:
+        word = word[:-1]
+
+    # Step 3
+    derivational = _longest(word, max(rv, r2), _DERIVATIONAL)
+    if derivational:
+        word = word[: -len(derivational)]
+
+    # Step 4
+    superlative = _longest(word, rv, _SUPERLATIVE)
+    if superlative:
+        word = word[: -len(superlative)]
+    if word.endswith("нн") and len(word) - 2 >= rv:
+        word = word[:-1]
+    elif not superlative and word.endswith("ь") and len(word) - 1 >= rv:
+        word = word[:-1]
+    return word
+
+
+def tokenize(text: str) -> list[str]:
+    """Разбивает текст на нормализованные токены (ё → е, нижний регистр)."""
+    return _TOKEN_RE.findall(text.lower().replace("ё", "е"))
+
+
+def search_terms(text: str) -> list[str]:
+    """Токены текста после стемминга — в таком виде они хранятся в индексе."""
+    return [stem(token) for token in tokenize(text)]
@@ -0,0 +1,96 @@
+"""
+Задержка event loop под параллельной нагрузкой list/get/save на файловое хранилище.
+
+"before" — блокирующие вызовы прямо в event loop (как раньше делал синхронный
+InvoiceService), "after" — асинхронный API FileInvoiceRepository с пулом потоков.
+Пока идёт нагрузка, отдельная корутина каждые 5 мс измеряет, насколько позже
+она просыпается: это задержка, которую увидел бы любой другой запрос воркера.
+
+    python -m benchmarks.event_loop_latency --invoices 2000 --clients 16
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import statistics
+import tempfile
+import time
+
+from app.repositories.invoice import FileInvoiceRepository
+from benchmarks.synthetic import generate_archive, make_invoice
+
+TICK = 0.005
+
+
+async def _probe(stop: asyncio.Event, lags: list[float]) -> None:
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append((time.perf_counter() - started - TICK) * 1000)
+
+
+async def _client_blocking(repo: FileInvoiceRepository, filenames: list[str], ops: int, seq: int) -> None:
+    for i in range(ops):
+        repo.index.query_entries()
+        repo._read(filenames[(seq * ops + i) % len(filenames)])
+        data = make_invoice(seq * ops + i)
+        repo._write(data["filename"], data)
+        await asyncio.sleep(0)
+
+
+async def _client_async(repo: FileInvoiceRepository, filenames: list[str], ops: int, seq: int) -> None:
+    for i in range(ops):
+        await repo.list_page()
+        await repo.get(filenames[(seq * ops + i) % len(filenames)])
+        data = make_invoice(seq * ops + i)
+        await repo.save(data["filename"], data)
+
+
+async def _run(mode: str, repo: FileInvoiceRepository, filenames: list[str], clients: int, ops: int) -> dict:
+    client = _client_blocking if mode == "before" else _client_async
+    stop = asyncio.Event()
+    lags: list[float] = []
+    probe = asyncio.create_task(_probe(stop, lags))
+    started = time.perf_counter()
+    await asyncio.gather(*(client(repo, filenames, ops, seq) for seq in range(clients)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await probe
+
+    lags.sort()
+    return {
+        "mode": mode,
+        "operations": clients * ops * 3,
+        "elapsed_s": round(elapsed, 3),
+        "loop_lag_ms": {
+            "samples": len(lags),
+            "p50": round(statistics.median(lags), 2) if lags else None,
+            "p99": round(lags[int(len(lags) * 0.99) - 1], 2) if lags else None,
+            "max": round(lags[-1], 2) if lags else None,
+        },
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--invoices", type=int, default=2000)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--ops", type=int, default=20, help="list+get+save циклов на клиента")
+    parser.add_argument("--workers", type=int, default=8, help="INVOICE_IO_CONCURRENCY")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        filenames = generate_archive(tmp, args.invoices)
+        repo = FileInvoiceRepository(tmp, max_workers=args.workers)
+        repo.index.reconcile()
+        for mode in ("before", "after"):
+            results.append(asyncio.run(_run(mode, repo, filenames, args.clients, args.ops)))
+        repo.index.close()
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
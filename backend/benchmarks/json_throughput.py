@@ -0,0 +1,104 @@
+"""
+Пропускная способность list/get/save на крупных инвойсах: стандартный ``json`` против orjson.
+
+"before" — ``json`` для файлов и ответов, ответ собирается как у FastAPI по
+умолчанию (``response_model`` + ``jsonable_encoder`` + ``JSONResponse``);
+"after" — ``app.utils.jsonio`` на orjson, список отдаётся ``FastJSONResponse``,
+инвойс сериализуется ``model_dump_json``. Замеряется только работа воркера
+(чтение/запись файла, валидация, сериализация ответа), без HTTP.
+
+    python -m benchmarks.json_throughput --invoices 300 --items 200
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import tempfile
+import time
+from collections.abc import Callable
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from app.repositories.invoice import FileInvoiceRepository
+from app.schemas.invoice import Invoice
+from app.services.invoice_service import prepare_for_save
+from app.utils import jsonio
+from benchmarks.synthetic import generate_archive, make_invoice
+
+
+def _timed(func: Callable[[], object], repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started) / repeat
+
+
+def _run(mode: str, repo: FileInvoiceRepository, filenames: list[str], items: int, rounds: int) -> dict:
+    orjson = jsonio.orjson
+    if mode == "before":
+        jsonio.orjson = None
+    try:
+        entries = repo.index.list_entries()
+
+        def list_all() -> None:
+            if mode == "before":
+                JSONResponse(jsonable_encoder(entries))
+            else:
+                jsonio.FastJSONResponse(entries)
+
+        def get_all() -> None:
+            for filename in filenames:
+                invoice = Invoice.model_validate(repo._read(filename))
+                if mode == "before":
+                    # Как response_model: dump, повторная валидация, jsonable_encoder
+                    content = Invoice.model_validate(invoice.model_dump(by_alias=True))
+                    JSONResponse(jsonable_encoder(content.model_dump(mode="json", by_alias=True)))
+                else:
+                    invoice.model_dump_json(by_alias=True)
+
+        invoices = [Invoice.model_validate(make_invoice(seq, items)) for seq in range(len(filenames))]
+
+        def save_all() -> None:
+            for invoice in invoices:
+                filename, data = prepare_for_save(invoice)
+                repo._write_json(filename, None, data)
+
+        list_s = _timed(list_all, rounds)
+        get_s = _timed(get_all, 1)
+        save_s = _timed(save_all, 1)
+    finally:
+        jsonio.orjson = orjson
+
+    return {
+        "mode": mode,
+        "list_ms": round(list_s * 1000, 2),
+        "get_per_s": round(len(filenames) / get_s, 1),
+        "save_per_s": round(len(filenames) / save_s, 1),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--invoices", type=int, default=300)
+    parser.add_argument("--items", type=int, default=200, help="позиций в инвойсе")
+    parser.add_argument("--rounds", type=int, default=20, help="повторов сериализации списка")
+    args = parser.parse_args()
+
+    if jsonio.orjson is None:
+        raise SystemExit("orjson is not installed: nothing to compare")
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        filenames = generate_archive(tmp, args.invoices, items_per_invoice=args.items)
+        repo = FileInvoiceRepository(tmp)
+        repo.index.reconcile()
+        for mode in ("before", "after"):
+            results.append(_run(mode, repo, filenames, args.items, args.rounds))
+        repo.index.close()
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
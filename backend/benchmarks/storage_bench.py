@@ -0,0 +1,173 @@
+"""
+Задержка и пропускная способность InvoiceService на файловом хранилище.
+
+Для каждого размера архива (по умолчанию 1k/10k/100k инвойсов с реалистичными
+``items``) во временной директории генерируется синтетический архив, строится
+индекс (холодный старт) и замеряются операции сервиса:
+
+- ``list`` — полный список (``list_invoices``), ``list_page`` — первая страница из 50;
+- ``get`` — ``get_invoice`` случайных инвойсов (без кэша: меряется хранилище);
+- ``save`` — ``save_invoice`` новых инвойсов, ``next_number`` — с резервированием;
+- ``delete`` — ``delete_invoice`` сохранённых в ходе замера.
+
+Результат — JSON (в stdout или ``--output``): на операцию — число операций,
+пропускная способность и перцентили задержки в мс. ``--concurrency`` задаёт число
+одновременных клиентов.
+
+    python -m benchmarks.storage_bench --sizes 1000,10000 --ops 200 --output bench.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections.abc import Awaitable, Callable
+from datetime import datetime, timezone
+
+from app.repositories.invoice import FileInvoiceRepository
+from app.schemas.invoice import Invoice, InvoiceListQuery
+from app.services.invoice_service import InvoiceService
+from app.utils.cache import VersionedLRUCache
+from benchmarks.synthetic import generate_archive, make_invoice
+
+PAGE_SIZE = 50
+
+
+def _summary(latencies: list[float], elapsed: float) -> dict:
+    latencies = sorted(latencies)
+
+    def percentile(p: float) -> float:
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 3)
+
+    return {
+        "ops": len(latencies),
+        "ops_per_s": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "latency_ms": {
+            "mean": round(statistics.fmean(latencies) * 1000, 3),
+            "p50": percentile(0.5),
+            "p95": percentile(0.95),
+            "p99": percentile(0.99),
+            "max": round(latencies[-1] * 1000, 3),
+        },
+    }
+
+
+async def _measure(
+    operation: Callable[[int], Awaitable[object]], ops: int, concurrency: int
+) -> dict:
+    """Выполняет ``operation(i)`` для i < ops в ``concurrency`` клиентах."""
+    latencies: list[float] = []
+    counter = iter(range(ops))
+
+    async def client() -> None:
+        for i in counter:
+            started = time.perf_counter()
+            await operation(i)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return _summary(latencies, time.perf_counter() - started)
+
+
+async def _bench_size(path: str, size: int, args: argparse.Namespace) -> dict:
+    started = time.perf_counter()
+    filenames = generate_archive(path, size, items_per_invoice=args.items, seed=size)
+    generated_s = time.perf_counter() - started
+
+    repository = FileInvoiceRepository(path, max_workers=args.workers)
+    started = time.perf_counter()
+    await asyncio.get_running_loop().run_in_executor(None, repository.index.reconcile)
+    reconcile_s = time.perf_counter() - started
+    service = InvoiceService(repository, cache=VersionedLRUCache(0))
+
+    rng = random.Random(size)
+    probes = [rng.choice(filenames) for _ in range(args.ops)]
+    new_invoices = []
+    for i in range(args.ops):
+        data = make_invoice(size + i, args.items)
+        data["filename"] = f"bench_{i:06d}.json"
+        new_invoices.append(Invoice.model_validate(data))
+
+    list_ops = max(1, min(args.ops, args.list_ops))
+    results = {
+        "list": await _measure(lambda i: service.list_invoices(), list_ops, 1),
+        "list_page": await _measure(
+            lambda i: service.list_invoices_page(InvoiceListQuery(limit=PAGE_SIZE)), args.ops, args.concurrency
+        ),
+        "get": await _measure(lambda i: service.get_invoice(probes[i]), args.ops, args.concurrency),
+        "save": await _measure(lambda i: service.save_invoice(new_invoices[i]), args.ops, args.concurrency),
+        "next_number": await _measure(
+            lambda i: service.get_next_number("2025-11-18", reserve=True), args.ops, args.concurrency
+        ),
+        "delete": await _measure(
+            lambda i: service.delete_invoice(new_invoices[i].filename), args.ops, args.concurrency
+        ),
+    }
+    await repository.shutdown()
+    repository.index.close()
+
+    archive_bytes = sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+    return {
+        "invoices": size,
+        "archive_mb": round(archive_bytes / 2**20, 1),
+        "generate_s": round(generated_s, 2),
+        "reconcile_s": round(reconcile_s, 2),
+        "operations": results,
+    }
+
+
+async def _run(args: argparse.Namespace) -> list[dict]:
+    results = []
+    for size in args.sizes:
+        with tempfile.TemporaryDirectory(dir=args.tmp) as tmp:
+            print(f"{size} invoices...", file=sys.stderr)
+            results.append(await _bench_size(os.path.join(tmp, "archive"), size, args))
+    return results
+
+
+def _sizes(value: str) -> list[int]:
+    return [int(size) for size in value.split(",") if size.strip()]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=_sizes, default=[1_000, 10_000, 100_000], help="размеры архива через запятую")
+    parser.add_argument("--items", type=int, default=8, help="позиций в инвойсе")
+    parser.add_argument("--ops", type=int, default=200, help="операций каждого вида")
+    parser.add_argument("--list-ops", type=int, default=20, help="повторов полного списка")
+    parser.add_argument("--concurrency", type=int, default=1, help="одновременных клиентов")
+    parser.add_argument("--workers", type=int, default=8, help="INVOICE_IO_CONCURRENCY")
+    parser.add_argument("--tmp", default=None, help="каталог для временных архивов")
+    parser.add_argument("--output", default=None, help="файл для JSON-результата (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    report = {
+        "benchmark": "storage",
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "params": {
+            "items": args.items, "ops": args.ops, "concurrency": args.concurrency, "workers": args.workers,
+        },
+        "results": asyncio.run(_run(args)),
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Генерация синтетического архива инвойсов для бенчмарков."""
+
+from __future__ import annotations
+
+import os
+import random
+from datetime import date, timedelta
+
+from app.utils import jsonio
+
+MODELS = ["Ч-80", "Ч-100", "Ц2У-160", "1Ц2У-200", "РМ-350", "NMRV-050", "RV-63", "КЦ1-300"]
+DESCRIPTIONS = [
+    "Редуктор червячный одноступенчатый",
+    "Редуктор цилиндрический двухступенчатый",
+    "Мотор-редуктор планетарный",
+    "Редуктор коническо-цилиндрический",
+]
+RECIPIENTS = [f'ООО "Заказчик {i}"' for i in range(200)]
+CURRENCIES = ["Руб.", "USD", "EUR", "CNY"]
+
+
+def make_invoice(seq: int, items_per_invoice: int = 8, rng: random.Random | None = None) -> dict:
+    """Инвойс с реалистичным набором позиций, как их сохраняет фронтенд."""
+    rng = rng or random.Random(seq)
+    day = date(2023, 1, 1) + timedelta(days=seq % 1000)
+    number = f"{day.strftime('%d%m%y')}-{seq % 97 + 1:02d}"
+    return {
+        "filename": f"{number}_{seq:07d}.json",
+        "number": number,
+        "date": day.isoformat(),
+        "validUntil": (day + timedelta(days=30)).isoformat(),
+        "recipient": rng.choice(RECIPIENTS),
+        "recipientINN": f"{rng.randrange(10**9, 10**10)}",
+        "recipientAddress": "620143, Свердловская обл., г. Екатеринбург, ул. Машиностроителей, 19",
+        "currency": rng.choice(CURRENCIES),
+        "items": [
+            {
+                "id": f"{seq}-{i}",
+                "description": rng.choice(DESCRIPTIONS),
+                "model": rng.choice(MODELS),
+                "quantity": rng.randint(1, 20),
+                "price": round(rng.uniform(10_000, 900_000), 2),
+                "unit": "шт",
+                "countryOfOrigin": "Россия",
+                "hsCode": "8483402900",
+                "leadTime": "30 рабочих дней",
+                "technicalDescription": "Передаточное отношение 40, крутящий момент 1200 Нм. " * 3,
+                "reducerSpecs": {"type": "worm", "stages": 1, "torqueNm": 1200, "ratio": "40"},
+            }
+            for i in range(items_per_invoice)
+        ],
+        "commercialTerms": {
+            "incoterm": "FCA",
+            "deliveryPlace": "Екатеринбург",
+            "deliveryTime": "30 дней",
+            "paymentTerms": "100% предоплата",
+            "warranty": "12 месяцев",
+        },
+        "contact": {"person": "Иванов И.И.", "position": "Менеджер", "email": "sales@example.com", "phone": ""},
+        "organizationId": "vector",
+        "documentType": "regular" if seq % 5 else "proforma",
+        "tenderId": f"T-{seq}" if seq % 7 == 0 else "",
+        "_metadata": {"saved_at": f"{day.isoformat()}T10:00:00", "version": "2.0 (FastAPI)"},
+    }
+
+
+def generate_archive(path: str, count: int, items_per_invoice: int = 8, seed: int = 0) -> list[str]:
+    """Пишет ``count`` инвойсов в ``path`` так же, как save_invoice. Возвращает имена файлов."""
+    os.makedirs(path, exist_ok=True)
+    rng = random.Random(seed)
+    filenames = []
+    for seq in range(count):
+        data = make_invoice(seq, items_per_invoice, rng)
+        with open(os.path.join(path, data["filename"]), "wb") as f:
+            f.write(jsonio.dumps_document(data))
+        filenames.append(data["filename"])
+    return filenames
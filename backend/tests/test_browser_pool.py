@@ -0,0 +1,150 @@
+import asyncio
+import os
+import subprocess
+import sys
+
+import pytest
+from playwright.async_api import Error as PlaywrightError
+
+from app.services.browser_pool import BrowserPool, process_tree_rss
+
+
+class FakePage:
+    def __init__(self, browser):
+        self.browser = browser
+        self.shell = None
+        self.closed = False
+
+    async def set_content(self, html):
+        self.shell = html
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeBrowser:
+    def __init__(self, number):
+        self.number = number
+        self.connected = True
+        self.listeners = []
+        self.pages = 0
+
+    def on(self, event, listener):
+        self.listeners.append(listener)
+
+    def is_connected(self):
+        return self.connected
+
+    async def new_page(self):
+        self.pages += 1
+        return FakePage(self)
+
+    async def close(self):
+        self.crash()
+
+    def crash(self):
+        if self.connected:
+            self.connected = False
+            for listener in self.listeners:
+                listener(self)
+
+
+class FakePool(BrowserPool):
+    """The pool with its Chromium launches replaced by in-memory browsers."""
+
+    def __init__(self, **kwargs):
+        super().__init__(health_interval=0, **kwargs)
+        self.launched = []
+
+    async def _launch_browser(self, marker):
+        browser = FakeBrowser(len(self.launched))
+        self.launched.append(browser)
+        return browser
+
+
+async def render(page):
+    await asyncio.sleep(0)
+    return page.browser.number
+
+
+async def test_pool_reuses_and_recycles_browsers():
+    pool = FakePool(browsers=2, pages_per_browser=2, max_renders=3)
+    await pool.start()
+    assert len(pool.launched) == 2
+
+    # Renders are spread over the browsers and no more than 2×2 run at once
+    results = await asyncio.gather(*(pool.run(render) for _ in range(4)))
+    assert sorted(results) == [0, 0, 1, 1]
+
+    # Renders already running finish on a retiring browser
+    assert sorted(await asyncio.gather(*(pool.run(render) for _ in range(4)))) == [0, 0, 1, 1]
+    await asyncio.sleep(0.01)
+    # Each browser was replaced after its third render
+    assert pool.counters["recycled"] == 2
+    assert not pool.launched[0].connected and not pool.launched[1].connected
+    assert all(status["connected"] for status in pool.status())
+    assert sorted(await asyncio.gather(*(pool.run(render) for _ in range(4)))) == [2, 2, 3, 3]
+
+    await pool.stop()
+    assert not any(browser.connected for browser in pool.launched)
+    with pytest.raises(RuntimeError):
+        await pool._acquire()
+
+
+async def test_render_is_retried_when_its_browser_crashes():
+    pool = FakePool(browsers=2, pages_per_browser=1)
+    attempts = []
+
+    async def crashing_render(page):
+        attempts.append(page.browser.number)
+        if len(attempts) == 1:
+            page.browser.crash()
+            raise PlaywrightError("Target closed")
+        return "pdf"
+
+    assert await pool.run(crashing_render) == "pdf"
+    assert attempts[0] == 0 and attempts[1] != 0
+    assert pool.counters == {"renders": 2, "recycled": 0, "crashed": 1, "retried": 1}
+    await asyncio.sleep(0.01)
+    assert [s["connected"] for s in pool.status()] == [True, True]
+    assert len(pool.launched) == 3
+    await pool.stop()
+
+
+async def test_warm_pages_keep_their_shell():
+    pool = FakePool(browsers=2, pages_per_browser=2)
+    await pool.warm("<shell>")
+    assert [s["idle_pages"] for s in pool.status()] == [2, 2]
+
+    async def shell_of(page):
+        return page
+
+    pages = await asyncio.gather(*(pool.run(shell_of, shell="<shell>") for _ in range(4)))
+    assert all(page.shell == "<shell>" and not page.closed for page in pages)
+    assert [browser.pages for browser in pool.launched] == [2, 2]
+
+    # A page without a shell is not kept; a new shell replaces the oldest idle page
+    page = await pool.run(shell_of)
+    assert page.closed and page.shell is None
+    page = await pool.run(shell_of, shell="<other>")
+    assert page.shell == "<other>"
+    assert sum(p.closed for p in pages) == 1
+    assert [s["idle_pages"] for s in pool.status()] == [2, 2]
+
+    # A relaunched browser is warmed up again
+    pool.launched[0].crash()
+    await asyncio.sleep(0.01)
+    assert [s["idle_pages"] for s in pool.status()] == [2, 2]
+    await pool.stop()
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc"), reason="needs /proc")
+def test_process_tree_rss_finds_marked_processes():
+    marker = "--kp-pdf-browser=test"
+    child = subprocess.Popen([sys.executable, "-c", "import sys; sys.stdin.read()", marker], stdin=subprocess.PIPE)
+    try:
+        rss = process_tree_rss([marker, "--kp-pdf-browser=missing"])
+    finally:
+        child.communicate(b"")
+    assert rss["--kp-pdf-browser=missing"] == 0
+    assert rss[marker] > 1024 * 1024
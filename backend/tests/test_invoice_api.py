@@ -0,0 +1,215 @@
+import json
+
+import pytest
+from httpx import AsyncClient
+
+from app.api.routes.invoices import get_invoice_service
+from app.dependencies.auth import session_guard
+from app.main import app
+from app.repositories.invoice import FileInvoiceRepository
+from app.services.invoice_service import InvoiceService
+from app.utils.cache import VersionedLRUCache
+
+
+@pytest.fixture
+async def client(tmp_path):
+    repository = FileInvoiceRepository(str(tmp_path / "archive"))
+    service = InvoiceService(repository, cache=VersionedLRUCache(16))
+    app.dependency_overrides[get_invoice_service] = lambda: service
+    app.dependency_overrides[session_guard] = lambda: None
+    async with AsyncClient(app=app, base_url="http://testserver") as ac:
+        yield ac
+    app.dependency_overrides.clear()
+    await repository.shutdown()
+
+
+async def test_conditional_requests(client):
+    invoice = {"number": "181125-01", "date": "2025-11-18", "recipient": "Test LLC"}
+    saved = await client.post("/api/v1/invoices/", json=invoice)
+    assert saved.status_code == 200
+    filename = saved.json()["filename"]
+
+    first = await client.get(f"/api/v1/invoices/{filename}")
+    etag = first.headers["ETag"]
+    assert etag == saved.headers["ETag"]
+    again = await client.get(f"/api/v1/invoices/{filename}", headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.headers["ETag"] == etag
+
+    listing = await client.get("/api/v1/invoices/")
+    list_etag = listing.headers["ETag"]
+    assert (await client.get("/api/v1/invoices/", headers={"If-None-Match": list_etag})).status_code == 304
+    assert (await client.get("/api/v1/invoices/?limit=1", headers={"If-None-Match": list_etag})).status_code == 200
+
+    # Optimistic concurrency: the first writer wins, a stale ETag gets 412
+    update = {**invoice, "filename": filename, "recipient": "Other LLC"}
+    ok = await client.post("/api/v1/invoices/", json=update, headers={"If-Match": etag})
+    assert ok.status_code == 200
+    stale = await client.post("/api/v1/invoices/", json=update, headers={"If-Match": etag})
+    assert stale.status_code == 412
+
+    assert (await client.get(f"/api/v1/invoices/{filename}", headers={"If-None-Match": etag})).status_code == 200
+    assert (await client.get("/api/v1/invoices/", headers={"If-None-Match": list_etag})).status_code == 200
+
+
+async def test_next_number_reserves_on_request_and_releases(client):
+    url = "/api/v1/invoices/next-number"
+    assert (await client.get(url, params={"date": "2025-11-18"})).json() == {"number": "181125-01"}
+    # Only an explicit reservation holds the number
+    assert (await client.get(url, params={"date": "2025-11-18"})).json() == {"number": "181125-01"}
+    reserved = await client.get(url, params={"date": "2025-11-18", "reserve": True})
+    assert reserved.json() == {"number": "181125-01"}
+    assert (await client.get(url, params={"date": "2025-11-18"})).json() == {"number": "181125-02"}
+
+    assert (await client.delete(f"{url}/181125-01")).status_code == 200
+    assert (await client.delete(f"{url}/181125-01")).status_code == 404
+    assert (await client.get(url, params={"date": "2025-11-18"})).json() == {"number": "181125-01"}
+
+
+async def test_export_streams_zip(client):
+    import io
+    import zipfile
+
+    from app.api.routes.invoices import get_pdf_service
+
+    class FakePdfService:
+        def template_version(self):
+            return "test"
+
+        async def generate_pdf(self, data):
+            return f"%PDF {data['number']}".encode()
+
+    app.dependency_overrides[get_pdf_service] = FakePdfService
+    for number in ("181125-01", "181125-02"):
+        await client.post("/api/v1/invoices/", json={"number": number, "date": "2025-11-18", "recipient": "X"})
+    filenames = [entry["filename"] for entry in (await client.get("/api/v1/invoices/")).json()]
+
+    response = await client.post(
+        "/api/v1/invoices/export", json={"filenames": [*filenames, "missing.json"]}
+    )
+    assert response.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(response.content))
+    names = archive.namelist()
+    assert [name for name in names if name.startswith("json/")] == [f"json/{name}" for name in filenames]
+    assert len([name for name in names if name.startswith("pdf/")]) == 2
+    assert list(json.loads(archive.read("errors.json"))) == ["missing.json"]
+
+    by_filter = await client.post("/api/v1/invoices/export", json={"filter": {"date_from": "2030-01-01"}})
+    assert by_filter.status_code == 400
+
+
+async def test_bulk_import_ndjson(client):
+    lines = [json.dumps({"number": f"181125-{n:02d}", "date": "2025-11-18", "recipient": f"R{n}"}) for n in range(1, 151)]
+    lines[4] = '{"number": "broken"'
+    lines[9] = json.dumps({"number": "181125-99", "date": "2025-11-18", "items": "not a list"})
+    lines.append(json.dumps({"filename": "fixed.json", "number": "1", "date": "2025-11-18", "recipient": "F"}))
+    upload = ("\n".join(lines) + "\n").encode()
+
+    response = await client.post("/api/v1/invoices/import", files={"file": ("data.ndjson", upload)})
+    result = response.json()
+    assert response.status_code == 200
+    assert (result["total"], result["imported"], result["failed"]) == (151, 149, 2)
+    assert [error["source"] for error in result["errors"]] == ["line 5", "line 10"]
+    assert len(set(result["filenames"])) == 149
+
+    listing = (await client.get("/api/v1/invoices/", params={"fields": "filename"})).json()
+    assert len(listing) == 149
+
+    again = await client.post(
+        "/api/v1/invoices/import", files={"file": ("data.ndjson", lines[-1].encode())}
+    )
+    assert again.json()["errors"][0]["error"] == "Invoice already exists"
+
+
+async def test_get_serves_stored_file_and_normalizes_legacy_once(client, tmp_path):
+    import os
+
+    archive = tmp_path / "archive"
+    legacy = {
+        "number": "181125-01", "date": "2025-11-18", "recipient": "PHP LLC", "organizationId": None,
+        "items": [{"description": "item", "quantity": "2", "price": "5,5"}],
+        "_metadata": {"saved_at": "2025-11-18T10:00:00+05:00", "version": "1.0"},
+    }
+    (archive / "legacy.json").write_text(json.dumps(legacy, ensure_ascii=False, indent=4), encoding="utf-8")
+    (archive / "custom.json").write_text(json.dumps({**legacy, "phpOnly": "keep me"}), encoding="utf-8")
+    nested = {**legacy, "commercialTerms": {"incoterm": "EXW", "bankGuarantee": "keep me"}}
+    (archive / "nested.json").write_text(json.dumps(nested), encoding="utf-8")
+    mtime = os.stat(archive / "legacy.json").st_mtime_ns
+
+    first = await client.get("/api/v1/invoices/legacy.json")
+    assert first.status_code == 200
+    stored = (archive / "legacy.json").read_bytes()
+    assert first.content == stored
+    body = first.json()
+    assert body["items"][0]["price"] == 5.5
+    assert body["filename"] == "legacy.json"
+    assert body["_metadata"] == {"saved_at": "2025-11-18T10:00:00+05:00", "version": "2.0 (FastAPI)"}
+    # Normalizing is not an edit: the list order (by mtime) stays the same
+    assert os.stat(archive / "legacy.json").st_mtime_ns == mtime
+    assert first.headers["ETag"] == (await client.get("/api/v1/invoices/legacy.json")).headers["ETag"]
+
+    # Fields the schema does not know would be lost: the file is left alone
+    custom = await client.get("/api/v1/invoices/custom.json")
+    assert custom.status_code == 200
+    assert custom.json()["recipient"] == "PHP LLC"
+    assert "phpOnly" in json.loads((archive / "custom.json").read_text(encoding="utf-8"))
+    nested_response = await client.get("/api/v1/invoices/nested.json")
+    assert nested_response.status_code == 200
+    assert nested_response.json()["commercialTerms"]["incoterm"] == "EXW"
+    stored = json.loads((archive / "nested.json").read_text(encoding="utf-8"))
+    assert stored["commercialTerms"]["bankGuarantee"] == "keep me"
+
+
+async def test_item_autocomplete_follows_latest_invoice(client):
+    def invoice(filename, date, price, **item):
+        return {
+            "filename": filename, "number": filename[:-5], "date": date, "recipient": "X",
+            "items": [{"model": "Ч-80", "description": "Редуктор червячный", "price": price,
+                       "unit": "шт", "hsCode": "8483402900", **item},
+                      {"model": "РМ-350", "description": "Редуктор цилиндрический", "price": 50}],
+        }
+
+    await client.post("/api/v1/invoices/", json=invoice("a.json", "2025-01-10", 100, countryOfOrigin="Китай"))
+    await client.post("/api/v1/invoices/", json=invoice("b.json", "2025-03-01", 120, countryOfOrigin="Россия"))
+    await client.post("/api/v1/invoices/", json=invoice("c.json", "2024-12-01", 90))
+
+    found = (await client.get("/api/v1/invoices/items/autocomplete", params={"q": "ч-"})).json()
+    assert [(e["model"], e["price"], e["uses"], e["countryOfOrigin"], e["date"]) for e in found] == [
+        ("Ч-80", 120.0, 3, "Россия", "2025-03-01"),
+    ]
+    by_description = (await client.get("/api/v1/invoices/items/autocomplete", params={"q": "редуктор"})).json()
+    assert {e["model"] for e in by_description} == {"Ч-80", "РМ-350"}
+
+    # The catalog falls back to the next most recent invoice when the latest one goes away
+    await client.delete("/api/v1/invoices/b.json")
+    found = (await client.get("/api/v1/invoices/items/autocomplete", params={"q": "Ч-80"})).json()
+    assert [(e["price"], e["uses"], e["filename"]) for e in found] == [(100.0, 2, "a.json")]
+
+
+async def test_item_price_history(client):
+    for filename, date, recipient, currency, price in [
+        ("a.json", "2024-05-01", "Alpha", "Руб.", 100),
+        ("b.json", "2025-02-01", "Beta", "Руб.", 140),
+        ("c.json", "2025-03-01", "Gamma", "USD", 2),
+        ("d.json", "2025-04-01", "Delta", "Руб.", 0),
+    ]:
+        await client.post("/api/v1/invoices/", json={
+            "filename": filename, "number": filename[:-5], "date": date, "recipient": recipient,
+            "currency": currency, "items": [{"model": "Ч-80", "description": "Редуктор", "price": price}],
+        })
+
+    result = (await client.get("/api/v1/invoices/items/price-history", params={"model": " ч-80 "})).json()
+    assert [(p["date"], p["recipient"], p["price"]) for p in result["history"]] == [
+        ("2025-03-01", "Gamma", 2.0), ("2025-02-01", "Beta", 140.0), ("2024-05-01", "Alpha", 100.0),
+    ]
+    assert [(a["currency"], a["count"], a["min"], a["avg"], a["max"]) for a in result["aggregates"]] == [
+        ("Руб.", 2, 100.0, 120.0, 140.0), ("USD", 1, 2.0, 2.0, 2.0),
+    ]
+
+    await client.delete("/api/v1/invoices/b.json")
+    result = (await client.get(
+        "/api/v1/invoices/items/price-history", params={"model": "Ч-80", "description": "редуктор", "limit": 1}
+    )).json()
+    assert [p["filename"] for p in result["history"]] == ["c.json"]
+    assert [a["count"] for a in result["aggregates"]] == [1, 1]
+    assert (await client.get("/api/v1/invoices/items/price-history")).status_code == 400
@@ -0,0 +1,123 @@
+from app.repositories.invoice_postgres import (
+    _revision_row,
+    catalog_rows,
+    item_rows,
+    record_values,
+    rollup_rows,
+)
+from app.services.invoice_revisions import EXTERNAL_AUTHOR, plan_revisions, replay
+
+
+def invoice(**fields):
+    data = {
+        "number": "181125-07",
+        "date": "2025-11-18",
+        "recipient": " Test LLC ",
+        "currency": "EUR",
+        "items": [{"model": "RM-100", "description": "Reducer", "quantity": 2, "price": 5}],
+    }
+    data.update(fields)
+    return data
+
+
+def test_record_values_parse_the_number():
+    values = record_values("a.json", invoice())
+    assert (values["number_date"], values["number_seq"]) == ("181125", 7)
+    assert values["total"] == 10.0
+    assert values["currency"] == "EUR"
+    assert values["data"]["number"] == "181125-07"
+
+    values = record_values("b.json", invoice(number="VEC-2025-001"))
+    assert (values["number_date"], values["number_seq"]) == ("vec-2025", 1)
+    values = record_values("c.json", invoice(number="draft"))
+    assert (values["number_date"], values["number_seq"]) == (None, None)
+
+
+def test_rollup_rows_net_out_an_overwrite():
+    before = record_values("a.json", invoice())
+    after = record_values("a.json", invoice(date="2025-12-01"))
+
+    rows = rollup_rows([(before, -1), (after, 1)])
+
+    # Only the month moves; recipient, currency and document type cancel out
+    assert rows == [
+        {"dimension": "month", "key": "2025-11", "currency": "EUR", "count": -1, "total": -10.0},
+        {"dimension": "month", "key": "2025-12", "currency": "EUR", "count": 1, "total": 10.0},
+    ]
+
+
+def test_rollup_rows_add_and_subtract_invoices():
+    first = record_values("a.json", invoice())
+    second = record_values("b.json", invoice(items=[{"model": "RM", "quantity": 1, "price": 30}]))
+
+    added = {(row["dimension"], row["key"]): row for row in rollup_rows([(first, 1), (second, 1)])}
+    assert set(added) == {
+        ("month", "2025-11"),
+        ("recipient", "Test LLC"),
+        ("currency", "EUR"),
+        ("documentType", "regular"),
+    }
+    recipient = added["recipient", "Test LLC"]
+    assert (recipient["count"], recipient["total"]) == (2, 40.0)
+
+    removed = rollup_rows([(first, -1)])
+    assert {(row["count"], row["total"]) for row in removed} == {(-1, -10.0)}
+
+
+def test_item_rows_and_catalog_rows():
+    older = record_values("a.json", invoice(date="2025-11-18", items=[
+        {"model": "RM-100", "description": "Reducer", "quantity": 2, "price": 5},
+        {"description": "  "},
+        {"model": "rm-100 ", "description": "reducer", "quantity": 1, "price": 7, "country": "RU"},
+    ]))
+    newer = record_values("b.json", invoice(date="2025-12-01", items=[
+        {"model": "RM-100", "description": "Reducer", "quantity": 1, "price": 9, "type": "ignored"},
+    ]))
+
+    items = item_rows(older)
+    # Items without a model, name or description are skipped; positions are kept
+    assert [item["position"] for item in items] == [0, 2]
+    assert items[0]["item_key"] == items[1]["item_key"] == "rm-100\x1f\x1freducer"
+    assert items[1]["country"] == "RU"
+    assert item_rows(record_values("c.json", invoice(items="broken"))) == []
+
+    catalog = catalog_rows(items + item_rows(newer))
+    assert len(catalog) == 1
+    entry = catalog[0]
+    keys = (entry["model_key"], entry["name_key"], entry["description_key"])
+    assert keys == ("rm-100", "", "reducer")
+    assert entry["uses"] == 3
+    # The most recent invoice provides the price and attributes
+    assert (entry["price"], entry["filename"], entry["date"]) == (9.0, "b.json", "2025-12-01")
+    assert "updated_at" not in entry
+
+
+def test_revision_rows_replay_to_the_saved_document():
+    first = invoice()
+    second = invoice(recipient="Other LLC")
+    external = invoice(recipient="Edited by PHP")
+
+    planned = plan_revisions(0, 0, None, None, first, 20)
+    planned += plan_revisions(1, 1, first, first, second, 20)
+    # A file changed outside the API is recorded before the new save
+    third = invoice(recipient="Third LLC")
+    external_save = plan_revisions(2, 1, second, external, third, 20)
+    assert external_save[0]["saved_by"] == EXTERNAL_AUTHOR
+    rows = [_revision_row("a.json", entry) for entry in planned + external_save]
+
+    assert [row["rev"] for row in rows] == [1, 2, 3, 4]
+    assert rows[0]["snapshot"] == first and rows[0]["patch"] is None
+    assert rows[1]["snapshot"] is None and rows[1]["patch"] is not None
+
+    def replay_rows(upto):
+        # The same shape _replay builds from the invoice_revisions table
+        return replay(
+            {"snapshot": row["snapshot"]} if row["snapshot"] is not None
+            else {"patch": row["patch"]}
+            for row in rows[:upto]
+        )
+
+    assert replay_rows(1) == first
+    assert replay_rows(2) == second
+    assert replay_rows(3) == external
+    assert replay_rows(4) == third
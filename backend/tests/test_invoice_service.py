@@ -0,0 +1,417 @@
+import asyncio
+import json
+import os
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from app.repositories.invoice import FileInvoiceRepository
+from app.schemas.invoice import Invoice, InvoiceListQuery
+from app.services.invoice_service import InvoiceService
+from app.utils.cache import VersionedLRUCache
+
+
+def write_invoice(storage, filename, **fields):
+    data = {
+        "number": "251118-01",
+        "date": "2025-11-18",
+        "recipient": "Test LLC",
+        "items": [{"description": "item", "quantity": 2, "price": 5}],
+    }
+    data.update(fields)
+    path = os.path.join(storage, filename)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    return path
+
+
+@pytest.fixture
+def storage(tmp_path):
+    path = tmp_path / "archive"
+    path.mkdir()
+    return str(path)
+
+
+@pytest.fixture
+def repository(storage):
+    return FileInvoiceRepository(storage)
+
+
+@pytest.fixture
+def service(repository):
+    return InvoiceService(repository, cache=VersionedLRUCache(16))
+
+
+async def test_reconcile_indexes_existing_files(storage, repository, service):
+    write_invoice(storage, "a.json", number="251118-01")
+    write_invoice(storage, "b.json", number="251118-02", _metadata=[])
+    with open(os.path.join(storage, "broken.json"), "w") as f:
+        f.write("{not json")
+
+    stats = repository.index.reconcile()
+
+    assert stats["updated"] == 2
+    entries = {entry["filename"]: entry for entry in await service.list_invoices()}
+    assert set(entries) == {"a.json", "b.json"}
+    assert entries["a.json"]["total"] == 10.0
+    assert entries["b.json"]["saved_at"] == ""
+
+
+async def test_reconcile_only_rereads_changed_files(storage, repository, service):
+    write_invoice(storage, "a.json")
+    write_invoice(storage, "b.json")
+    repository.index.reconcile()
+
+    os.remove(os.path.join(storage, "b.json"))
+    path = write_invoice(storage, "a.json", recipient="Changed LLC")
+    os.utime(path, ns=(1, 1))
+
+    stats = repository.index.reconcile()
+
+    assert stats == {"files": 1, "updated": 1, "removed": 1}
+    assert [entry["recipient"] for entry in await service.list_invoices()] == ["Changed LLC"]
+
+
+async def test_reconcile_commits_in_batches(storage, repository, service, monkeypatch):
+    monkeypatch.setattr("app.services.invoice_index.RECONCILE_BATCH", 2)
+    for i in range(5):
+        write_invoice(storage, f"{i}.json", number=f"251118-0{i}")
+    transaction = repository.index._transaction
+    transactions = []
+
+    def counting_transaction():
+        transactions.append(1)
+        return transaction()
+
+    monkeypatch.setattr(repository.index, "_transaction", counting_transaction)
+
+    assert repository.index.reconcile()["updated"] == 5
+    assert len(transactions) == 4  # Three batches of files, then moves and removals
+    assert len(await service.list_invoices()) == 5
+
+
+async def test_reconcile_keeps_files_missed_by_the_scan(storage, repository, service, monkeypatch):
+    write_invoice(storage, "a.json")
+    repository.index.reconcile()
+    # A file replaced while the directory is scanned can be missing from the scan
+    monkeypatch.setattr("app.services.invoice_index.scan_archive", lambda path: {})
+
+    assert repository.index.reconcile()["removed"] == 0
+    assert [entry["filename"] for entry in await service.list_invoices()] == ["a.json"]
+
+
+async def test_save_and_delete_update_index(service):
+    invoice = Invoice.model_validate(
+        {"number": "251118-03", "date": "2025-11-18", "recipient": "Saved LLC"}
+    )
+    result = await service.save_invoice(invoice)
+
+    listed = await service.list_invoices()
+    assert [entry["filename"] for entry in listed] == [result["filename"]]
+    assert listed[0]["saved_at"]
+
+    await service.delete_invoice(result["filename"])
+    assert await service.list_invoices() == []
+
+
+async def test_concurrent_conditional_saves_let_one_writer_win(service):
+    invoice = {"number": "251118-04", "date": "2025-11-18", "recipient": "Saved LLC"}
+    filename = (await service.save_invoice(Invoice.model_validate(invoice)))["filename"]
+    current = await service.invoice_etag(filename)
+
+    # Different sizes: the versions differ even within one mtime tick
+    updates = [
+        Invoice.model_validate({**invoice, "filename": filename, "recipient": recipient})
+        for recipient in ("A LLC", "Another Company LLC")
+    ]
+    results = await asyncio.gather(
+        *(service.save_invoice(update, if_match=current) for update in updates), return_exceptions=True
+    )
+
+    conflicts = [r for r in results if isinstance(r, HTTPException)]
+    assert len(conflicts) == 1 and conflicts[0].status_code == 412
+    assert len(await service.list_revisions(filename)) == 2
+
+
+async def test_search_matches_russian_word_forms(storage, repository, service):
+    write_invoice(
+        storage,
+        "a.json",
+        recipient='ООО "Уральские редукторы"',
+        recipientINN="6679016273",
+        items=[{"description": "Редуктор червячный", "model": "RV-50", "quantity": 1, "price": 1}],
+    )
+    write_invoice(storage, "b.json", number="251118-02", recipient="Другой покупатель")
+    repository.index.reconcile()
+
+    async def found(query):
+        return [entry["filename"] for entry in await service.search_invoices(query)]
+
+    assert await found("редуктора") == ["a.json"]
+    assert await found("червячного") == ["a.json"]
+    assert await found("уральский") == ["a.json"]
+    assert await found("667901") == ["a.json"]
+    assert await found("rv-50") == ["a.json"]
+    assert await found("251118-02") == ["b.json"]
+    assert await found("   ") == []
+
+    await service.delete_invoice("a.json")
+    assert await found("редуктор") == []
+
+
+async def test_list_page_cursor_filters_and_projection(storage, repository, service):
+    for i in range(5):
+        path = write_invoice(
+            storage,
+            f"{i}.json",
+            number=f"251118-0{i}",
+            currency="USD" if i % 2 else "Руб.",
+            items=[{"quantity": 1, "price": i * 100}],
+        )
+        os.utime(path, ns=(i * 10**9, i * 10**9))
+    repository.index.reconcile()
+
+    pages, after = [], None
+    while True:
+        entries, after = await service.list_invoices_page(
+            InvoiceListQuery(limit=2, after=after, fields="number")
+        )
+        pages.append([entry["filename"] for entry in entries])
+        assert all(set(entry) == {"filename", "number"} for entry in entries)
+        if after is None:
+            break
+    assert pages == [["4.json", "3.json"], ["2.json", "1.json"], ["0.json"]]
+
+    entries, after = await service.list_invoices_page(InvoiceListQuery(currency="USD", total_min=200))
+    assert [entry["filename"] for entry in entries] == ["3.json"]
+    assert after is None
+
+    with pytest.raises(HTTPException):
+        await service.list_invoices_page(InvoiceListQuery(fields="secret"))
+    with pytest.raises(HTTPException):
+        await service.list_invoices_page(InvoiceListQuery(after="garbage"))
+
+
+async def test_next_number_reservations(storage, repository, service):
+    write_invoice(storage, "a.json", number="181125-01")
+    write_invoice(storage, "b.json", number="181125-07")
+    write_invoice(storage, "c.json", number="191125-03")
+    repository.index.reconcile()
+
+    assert await service.get_next_number("2025-11-18") == "181125-08"
+    assert await service.get_next_number("2025-11-18", reserve=True) == "181125-08"
+    assert await service.get_next_number("2025-11-18", reserve=True) == "181125-09"
+    assert await service.get_next_number("2025-11-20") == "201125-01"
+
+    # Saving the reserved number releases its reservation
+    await service.save_invoice(
+        Invoice.model_validate({"number": "181125-09", "date": "2025-11-18", "recipient": "X"})
+    )
+    assert await service.get_next_number("2025-11-18") == "181125-10"
+
+
+def test_expired_reservation_is_reissued(repository):
+    repository.index.next_number("181125", reserve_ttl=0.01)
+    assert repository.index.next_number("181125") == "181125-02"
+    time.sleep(0.02)
+    assert repository.index.next_number("181125") == "181125-01"
+
+
+async def test_get_invoice_cache_tracks_file_identity(storage, service):
+    path = write_invoice(storage, "a.json", recipient="First")
+
+    first = await service.get_invoice("a.json")
+    first.recipient = "mutated"
+    assert (await service.get_invoice("a.json")).recipient == "First"
+    assert service.cache.stats()["hits"] == 1
+
+    # An external edit changes (mtime_ns, size) and is picked up
+    write_invoice(storage, "a.json", recipient="Second, longer")
+    os.utime(path, ns=(time.time_ns() + 10**9,) * 2)
+    assert (await service.get_invoice("a.json")).recipient == "Second, longer"
+
+    await service.delete_invoice("a.json")
+    assert service.cache.stats()["size"] == 0
+    with pytest.raises(HTTPException) as exc:
+        await service.get_invoice("a.json")
+    assert exc.value.status_code == 404
+
+
+@pytest.mark.parametrize("polling", [False, True])
+async def test_archive_watcher_picks_up_external_writes(storage, repository, polling, monkeypatch):
+    if polling:
+        import app.services.invoice_watcher as invoice_watcher
+
+        def no_inotify(*args, **kwargs):
+            raise OSError("disabled")
+
+        monkeypatch.setattr(invoice_watcher.InotifyArchiveWatcher, "__init__", no_inotify)
+    changes = []
+    repository.add_change_listener(changes.append)
+    watcher = repository.start_watching(poll_interval=0.05)
+    assert watcher.kind == ("polling" if polling else "inotify")
+
+    async def wait_for(predicate):
+        for _ in range(100):
+            if predicate():
+                return
+            await asyncio.sleep(0.02)
+        raise AssertionError("watcher did not catch up")
+
+    try:
+        # Written the way the PHP endpoints do it, behind the repository's back
+        write_invoice(storage, "php.json", number="251118-07")
+        await wait_for(lambda: [e["filename"] for e in repository.index.list_entries()] == ["php.json"])
+
+        os.remove(os.path.join(storage, "php.json"))
+        await wait_for(lambda: repository.index.list_entries() == [])
+        assert changes.count("php.json") >= 2
+
+        # Our own writes are already indexed, the replayed event is a no-op
+        changes.clear()
+        await repository.save("own.json", {"number": "251118-08", "date": "2025-11-18"})
+        await asyncio.sleep(0.2)
+        assert changes == []
+    finally:
+        repository.stop_watching()
+
+
+async def test_sharded_layout_and_migration(storage, repository, service):
+    from app.cli.invoice_archive import _shard_archive
+
+    write_invoice(storage, "legacy.json", number="251118-01", date="2024-03-05")
+    write_invoice(storage, "undated.json", number="251118-02", date="")
+    repository.layout = "sharded"
+    await service.save_invoice(
+        Invoice.model_validate({"number": "251118-03", "date": "2025-11-18", "recipient": "X"})
+    )
+    saved = [name for name in os.listdir(os.path.join(storage, "2025", "11"))]
+    assert len(saved) == 1
+    repository.index.reconcile()
+    assert {e["filename"] for e in repository.index.list_entries()} == {"legacy.json", "undated.json", saved[0]}
+
+    # Resumable: the first run stops after one file, the second one finishes
+    assert _shard_archive(storage, repository.index, False, 1, False)["moved"] == 1
+    assert _shard_archive(storage, repository.index, False, 0, False)["moved"] == 1
+    assert _shard_archive(storage, repository.index, False, 0, False)["moved"] == 0
+    assert os.path.isfile(os.path.join(storage, "2024", "03", "legacy.json"))
+    assert not os.path.exists(os.path.join(storage, "legacy.json"))
+
+    assert repository.index.reconcile()["updated"] == 0
+    assert (await service.get_invoice("legacy.json")).date == "2024-03-05"
+    await service.save_invoice(Invoice.model_validate(
+        {"filename": "legacy.json", "number": "251118-01", "date": "2024-03-05", "recipient": "Y"}
+    ))
+    assert os.path.isfile(os.path.join(storage, "2024", "03", "legacy.json"))
+    assert (await service.get_invoice("legacy.json")).recipient == "Y"
+
+    _shard_archive(storage, repository.index, True, 0, False)
+    assert sorted(os.listdir(storage)) == sorted([".index", ".revisions", "legacy.json", "undated.json", saved[0]])
+    assert await service.delete_invoice("legacy.json")
+
+
+async def test_stats_rollups_follow_saves_and_deletes(storage, repository, service):
+    write_invoice(storage, "a.json", date="2025-10-01", recipient="Alpha")
+    write_invoice(storage, "b.json", date="2025-11-02", recipient="Beta", currency="USD")
+    write_invoice(storage, "c.json", date="n/a", recipient="Alpha")
+    repository.index.reconcile()
+
+    stats = await service.get_stats()
+    assert stats.count == 3
+    assert [(b.key, b.currency, b.count, b.total) for b in stats.by_month] == [
+        ("2025-11", "USD", 1, 10.0), ("2025-10", "Руб.", 1, 10.0), (None, "Руб.", 1, 10.0),
+    ]
+    assert [(b.key, b.count, b.total) for b in stats.by_recipient][0] == ("Alpha", 2, 20.0)
+
+    await service.save_invoice(Invoice.model_validate({
+        "filename": "a.json", "number": "1", "date": "2025-10-01", "recipient": "Alpha",
+        "items": [{"description": "x", "quantity": 1, "price": 100}],
+    }))
+    await service.delete_invoice("c.json")
+    stats = await service.get_stats(recipients_limit=1)
+    assert [(b.key, b.count, b.total) for b in stats.by_recipient] == [("Alpha", 1, 100.0)]
+    assert {(b.key, b.count) for b in stats.by_currency} == {("Руб.", 1), ("USD", 1)}
+
+    # Rollups match a rebuild from scratch
+    repository.index._conn.execute("PRAGMA user_version = 0")
+    rebuilt = type(repository.index)(storage, repository.index.index_path)
+    rebuilt.reconcile()
+    assert rebuilt.stats() == repository.index.stats()
+
+
+async def test_revision_history_deltas_and_snapshots(storage, repository, service):
+    repository.revision_log.snapshot_every = 3
+
+    def invoice(price):
+        return Invoice.model_validate({
+            "filename": "a.json", "number": "251118-01", "date": "2025-11-18", "recipient": "Test LLC",
+            "items": [{"description": "item", "quantity": 2, "price": price}],
+        })
+
+    for price in range(10, 15):
+        await service.save_invoice(invoice(price))
+    # Edited behind the API (PHP): recorded as an external revision on the next save
+    path = os.path.join(storage, "a.json")
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({**data, "recipient": "Edited by PHP"}, f, ensure_ascii=False)
+    await service.save_invoice(invoice(99))
+
+    revisions = await service.list_revisions("a.json")
+    assert [r.rev for r in revisions] == list(range(1, 8))
+    assert [r.saved_by for r in revisions] == ["fastapi_service"] * 5 + ["external", "fastapi_service"]
+    assert [r.rev for r in revisions if r.snapshot] == [1, 4, 7]
+
+    assert (await service.get_revision("a.json", 1))["items"][0]["price"] == 10
+    assert (await service.get_revision("a.json", 3))["items"][0]["price"] == 12
+    assert (await service.get_revision("a.json", 6))["recipient"] == "Edited by PHP"
+    assert await service.get_revision("a.json", 7) == await repository.get("a.json")
+    with pytest.raises(HTTPException) as e:
+        await service.get_revision("a.json", 8)
+    assert e.value.status_code == 404
+
+    # Offsets are rebuilt from the log when the index lost them
+    with repository.index.transaction() as conn:
+        conn.execute("DELETE FROM invoice_revisions")
+    assert (await service.get_revision("a.json", 5))["items"][0]["price"] == 14
+
+
+async def test_cold_invoices_are_read_from_packs(storage, repository, service):
+    from app.cli.invoice_archive import _pack_archive, _unpack_archive
+    from app.services.invoice_packs import PACK_DIR, open_pack
+
+    for i in range(20):
+        write_invoice(storage, f"old{i:02d}.json", number=f"230105-{i:02d}", date="2023-01-05", recipient=f"R{i}")
+    write_invoice(storage, "new.json", date="2026-10-01")
+    repository.index.reconcile()
+
+    assert _pack_archive(storage, repository.index, "2025/01", 0, False)["packed"] == 20
+    packs = os.listdir(os.path.join(storage, PACK_DIR))
+    assert len(packs) == 1 and packs[0].startswith("2023_")
+    assert sorted(name for name in os.listdir(storage) if not name.startswith(".")) == ["new.json"]
+
+    # List, stats and reads go through the index and the pack
+    assert len(await service.list_invoices()) == 21
+    assert (await service.get_stats()).count == 21
+    assert (await service.get_invoice("old03.json")).recipient == "R3"
+    assert await service.get_invoice_file("old03.json") is None
+    assert repository.index.reconcile()["updated"] == 0
+    assert len(repository.index.list_entries()) == 21
+
+    # Saving brings an invoice back into the archive, deleting drops it from the pack
+    await service.save_invoice(Invoice.model_validate(
+        {"filename": "old03.json", "number": "230105-03", "date": "2023-01-05", "recipient": "Y"}
+    ))
+    assert os.path.isfile(os.path.join(storage, "old03.json"))
+    assert await service.delete_invoice("old04.json")
+    pack = open_pack(os.path.join(storage, PACK_DIR, packs[0]))
+    assert "old03.json" not in pack.entries and "old04.json" not in pack.entries
+    assert (await service.get_invoice("old03.json")).recipient == "Y"
+    assert len(await service.list_invoices()) == 20
+
+    assert _unpack_archive(storage, repository.index, "flat") == 18
+    assert not os.listdir(os.path.join(storage, PACK_DIR))
+    assert repository.index.reconcile()["updated"] == 0
+    assert (await service.get_invoice("old05.json")).recipient == "R5"
@@ -0,0 +1,26 @@
+import json
+
+import pytest
+
+from app.utils import jsonio
+from benchmarks.synthetic import make_invoice
+
+
+@pytest.mark.parametrize("document", [
+    make_invoice(1),
+    {"price": 0.1, "tiny": 1e-05, "huge": 1e16, "edge": 0.0001, "negative": -0.0, "zero": 0.0},
+    {"nan": float("nan"), "inf": float("-inf")},
+    {"big": 2**70, "tuple": (1, 2), "nested": [[], {}, [{"a": None, "b": True}]]},
+    {"text": "Редуктор \"Ч-80\"\t\\ \x1f   😀", "": ""},
+    [],
+])
+def test_dumps_document_matches_json_dump(document):
+    expected = json.dumps(document, ensure_ascii=False, indent=2).encode("utf-8")
+    assert jsonio.dumps_document(document) == expected
+
+
+def test_loads_falls_back_for_json_extensions():
+    assert jsonio.loads(b'{"a": 18446744073709551616}') == {"a": 2**64}
+    assert jsonio.loads('{"a": NaN}')["a"] != jsonio.loads('{"a": NaN}')["a"]
+    with pytest.raises(json.JSONDecodeError):
+        jsonio.loads(b"{not json")
@@ -0,0 +1,107 @@
+import os
+import shutil
+from pathlib import Path
+
+from httpx import AsyncClient
+
+from app.dependencies.auth import session_guard
+from app.main import app
+from app.services.organizations import (
+    DEFAULT_ORGANIZATION,
+    OrganizationRegistry,
+    get_organization_registry,
+    parse_organizations,
+)
+from app.services.pdf_service import PdfService
+
+ORGANIZATIONS_JS = Path(__file__).resolve().parents[2] / "js" / "organizations.js"
+
+
+def test_parse_organizations_literal():
+    organizations = parse_organizations("""
+        // comment
+        const organizations = {
+          'a': { name: 'ООО "А"', code: "A\\u0041", /* inline */ phone: '', bankAccounts: [{id: `t`,},], },
+          b: {name: 'B', INN_vektor: 123},
+        };
+        const getDefaultOrganization = () => organizations.a;
+    """)
+    assert organizations == {
+        "a": {"id": "a", "name": 'ООО "А"', "code": "AA", "phone": "", "bankAccounts": [{"id": "t"}]},
+        "b": {"id": "b", "name": "B", "INN_vektor": 123},
+    }
+
+
+def test_registry_reloads_on_change(tmp_path):
+    path = tmp_path / "organizations.js"
+    shutil.copy(ORGANIZATIONS_JS, path)
+    registry = OrganizationRegistry(str(path))
+    service = PdfService()
+    service.organizations = registry
+
+    vector = registry.get("vector")
+    assert vector["bik"] == "044525104"
+    assert service._parse_organization_data("vector")["INN_vektor"] == "6679016273"
+    assert service._parse_banking_details("vector")["bankName"] == "ООО «Банк Точка»"
+    assert registry.get("vector") is vector  # Parsed once
+
+    path.write_text(path.read_text(encoding="utf-8").replace("'vector'", "'other'"), encoding="utf-8")
+    os.utime(path, ns=(0, 10**18))
+    assert registry.get("vector") is None
+    assert service._parse_organization_data("vector")["name"] == ""
+    assert registry.get("other")["name"] == 'ООО "Вектор"'
+
+    # A broken file keeps the last good version
+    path.write_text("const organizations = {broken", encoding="utf-8")
+    assert registry.get("other")["code"] == "VEC"
+
+    path.unlink()
+    assert registry.get("anything") == DEFAULT_ORGANIZATION
+
+
+async def test_organizations_api(tmp_path):
+    registry = OrganizationRegistry(str(ORGANIZATIONS_JS))
+    app.dependency_overrides[get_organization_registry] = lambda: registry
+    app.dependency_overrides[session_guard] = lambda: None
+    try:
+        async with AsyncClient(app=app, base_url="http://testserver") as client:
+            response = await client.get("/api/v1/organizations")
+    finally:
+        app.dependency_overrides.clear()
+    assert response.status_code == 200
+    [vector] = response.json()
+    assert vector["id"] == "vector" and vector["shortName"] == "ВЕКТОР"
+    assert vector["correspondentAccount"] == "30101810745374525104"
+
+
+async def test_organizations_api_coerces_scalars(tmp_path):
+    path = tmp_path / "organizations.js"
+    path.write_text("const organizations = {a: {phone: null, INN_vektor: 6679016273, note: null}};", encoding="utf-8")
+    app.dependency_overrides[get_organization_registry] = lambda: OrganizationRegistry(str(path))
+    app.dependency_overrides[session_guard] = lambda: None
+    try:
+        async with AsyncClient(app=app, base_url="http://testserver") as client:
+            response = await client.get("/api/v1/organizations")
+    finally:
+        app.dependency_overrides.clear()
+    assert response.status_code == 200
+    [org] = response.json()
+    assert (org["phone"], org["INN_vektor"], org["note"]) == ("", "6679016273", None)
+
+
+def test_template_version_follows_organization_images(tmp_path):
+    path = tmp_path / "organizations.js"
+    path.write_text("const organizations = {a: {logo: 'logo.png', stamp: 'stamp.png'}};", encoding="utf-8")
+    service = PdfService()
+    service.organizations = OrganizationRegistry(str(path))
+    service.org_file = path
+    service.base_dir = tmp_path
+    (tmp_path / "logo.png").write_bytes(b"logo")
+
+    version = service.template_version()
+    assert service.template_version() == version
+    (tmp_path / "stamp.png").write_bytes(b"stamp")
+    assert service.template_version() != version
+    version = service.template_version()
+    (tmp_path / "logo.png").write_bytes(b"new logo")
+    assert service.template_version() != version
@@ -0,0 +1,53 @@
+import os
+
+from app.services import pdf_service
+from app.services.pdf_cache import PdfCache, cache_key
+from benchmarks.synthetic import make_invoice
+
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    cache = PdfCache(str(tmp_path), max_bytes=250, max_entries=3)
+    for key in ["aa1", "bb2", "cc3"]:
+        cache.put(key, key.encode() * 20)
+    assert cache.get("aa1") == b"aa1" * 20
+    cache.put("dd4", b"x" * 60)  # Over the entry cap: bb2 is the least recently used
+    assert cache.get("bb2") is None
+    cache.put("ee5", b"y" * 140)  # Over the size cap: cc3, then aa1
+    stats = cache.stats()
+    assert (stats["entries"], stats["bytes"]) == (2, 200)
+    assert (stats["hits"], stats["misses"], stats["hit_bytes"]) == (1, 1, 60)
+    assert sorted(name for _, _, files in os.walk(tmp_path) for name in files) == ["dd4.pdf", "ee5.pdf"]
+
+    # Another process sees the same entries and LRU order
+    reopened = PdfCache(str(tmp_path), max_bytes=250)
+    assert reopened.get("dd4") == b"x" * 60
+    assert reopened.stats()["bytes"] == 200
+
+
+def test_cache_key_covers_context_and_template():
+    context = {"number": "1", "items": [{"price": 1.5}], "org": {"logo": "data:image/png;base64,AAA"}}
+    key = cache_key("<tpl>", context)
+    assert key == cache_key("<tpl>", dict(reversed(context.items())))
+    assert key != cache_key("<tpl2>", context)
+    assert key != cache_key("<tpl>", {**context, "org": {"logo": "data:image/png;base64,AAB"}})
+
+
+async def test_repeated_pdf_is_served_from_cache(tmp_path, monkeypatch):
+    renders = []
+
+    class Pool:
+        async def run(self, render, shell=None):
+            renders.append(shell)
+            return b"%PDF-1.4 invoice"
+
+    cache = PdfCache(str(tmp_path), max_bytes=2**20)
+    monkeypatch.setattr(pdf_service, "get_browser_pool", lambda: Pool())
+    monkeypatch.setattr(pdf_service, "get_pdf_cache", lambda: cache)
+    service = pdf_service.PdfService()
+
+    for _ in range(3):
+        assert await service.generate_pdf(make_invoice(1)) == b"%PDF-1.4 invoice"
+    assert len(renders) == 1
+    await service.generate_pdf(make_invoice(2))
+    assert len(renders) == 2
+    assert cache.stats()["hit_ratio"] == 0.5
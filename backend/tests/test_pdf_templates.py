@@ -0,0 +1,27 @@
+from app.services.pdf_templates import PdfTemplates
+
+
+def test_templates_resolve_by_document_type_and_organization(tmp_path):
+    (tmp_path / "proforma").mkdir()
+    (tmp_path / "default.html").write_text("default {{ number }}", encoding="utf-8")
+    (tmp_path / "proforma" / "default.html").write_text("proforma {{ number }}", encoding="utf-8")
+    (tmp_path / "proforma" / "vector.html").write_text("vector {{ number }}", encoding="utf-8")
+    templates = PdfTemplates(tmp_path)
+
+    assert templates.get("proforma", "vector").render(number=1) == "vector 1"
+    assert templates.get("proforma", "other").render(number=2) == "proforma 2"
+    assert templates.get("regular", "vector").render(number="<3>") == "default &lt;3&gt;"
+    assert templates.name("../proforma", "vector") == "default.html"
+    assert templates.get("proforma", "vector") is templates.get("proforma", "vector")
+
+    # Without hot reload the registry and versions are fixed for the process
+    version = templates.version()
+    (tmp_path / "proforma" / "vector.html").unlink()
+    assert templates.name("proforma", "vector") == "proforma/vector.html"
+    assert templates.version() == version
+
+    reloading = PdfTemplates(tmp_path, auto_reload=True)
+    assert reloading.name("proforma", "vector") == "proforma/default.html"
+    assert reloading.version() != version
+    (tmp_path / "default.html").write_text("changed", encoding="utf-8")
+    assert reloading.get().render() == "changed"
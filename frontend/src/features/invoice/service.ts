@@ -195,18 +195,34 @@ export const invoiceService = {
   },
 
   /**
-   * Get next invoice number
+   * Get next invoice number (with `reserve` it is held until saved, released or expired)
    */
-  async getNextNumber(year: number = new Date().getFullYear()): Promise<string> {
+  async getNextNumber(year: number = new Date().getFullYear(), reserve: boolean = false): Promise<string> {
     try {
       // Using versioned Python API
-      const { data } = await api.get(`/api/v1/invoices/next-number`);
+      const { data } = await api.get(`/api/v1/invoices/next-number`, {
+        params: reserve ? { reserve: true } : undefined
+      });
       return data.number || `VEC-${year}-001`;
     } catch {
       return `VEC-${year}-001`;
     }
   },
 
+  /**
+   * Release a number reserved by getNextNumber when the invoice is not saved.
+   * Uses fetch with keepalive so the request survives closing the page.
+   */
+  releaseNumber(number: string): void {
+    fetch(`/api/v1/invoices/next-number/${encodeURIComponent(number)}`, {
+      method: 'DELETE',
+      credentials: 'include',
+      keepalive: true,
+    }).catch(() => {
+      // The reservation expires on its own
+    });
+  },
+
   /**
    * Search companies by name (DaData)
    */
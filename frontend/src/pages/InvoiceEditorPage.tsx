@@ -1,5 +1,5 @@
 import { invoiceService } from '@/features/invoice/service';
-import { useEffect, useState } from 'react';
+import { useEffect, useRef, useState } from 'react';
 import { useForm, FormProvider, type SubmitHandler, type Resolver, type SubmitErrorHandler, type FieldErrors } from 'react-hook-form';
 import { zodResolver } from '@hookform/resolvers/zod';
 import { useNavigate, useSearchParams } from 'react-router-dom';
@@ -25,6 +25,8 @@ export default function InvoiceEditorPage() {
   const [savedFilename, setSavedFilename] = useState<string | null>(null);
   const [isSplitScreen, setIsSplitScreen] = useState(false);
   const [isPreviewFullscreen, setIsPreviewFullscreen] = useState(false);
+  // Номер, зарезервированный для нового КП: снимается, если КП ушло без сохранения
+  const reservedNumberRef = useRef<string | null>(null);
   
   const filename = searchParams.get('filename');
   const documentTypeParam = searchParams.get('type') || 'regular';
@@ -57,8 +59,24 @@ export default function InvoiceEditorPage() {
 
   const { handleSubmit, reset, trigger, formState: { errors } } = methods;
 
+  // Резерв снимается при уходе со страницы редактора и при закрытии вкладки
+  useEffect(() => {
+    const releaseReservedNumber = () => {
+      if (reservedNumberRef.current) {
+        invoiceService.releaseNumber(reservedNumberRef.current);
+        reservedNumberRef.current = null;
+      }
+    };
+    window.addEventListener('pagehide', releaseReservedNumber);
+    return () => {
+      window.removeEventListener('pagehide', releaseReservedNumber);
+      releaseReservedNumber();
+    };
+  }, []);
+
   // Load data
   useEffect(() => {
+    let cancelled = false;
     const loadData = async () => {
       if (isEditing && filename) {
         try {
@@ -73,8 +91,13 @@ export default function InvoiceEditorPage() {
           navigate('/');
         }
       } else {
-        // Load next number for new invoice
-        const nextNumber = await invoiceService.getNextNumber();
+        // Load next number for new invoice, reserved until it is saved or the editor is left
+        const nextNumber = await invoiceService.getNextNumber(undefined, true);
+        if (cancelled) {
+          invoiceService.releaseNumber(nextNumber);
+          return;
+        }
+        reservedNumberRef.current = nextNumber;
         
         // Повторно вычисляем даты для сброса формы (на случай если компонент был смонтирован давно)
         const today = new Date();
@@ -91,6 +114,9 @@ export default function InvoiceEditorPage() {
       }
     };
     loadData();
+    return () => {
+      cancelled = true;
+    };
   }, [isEditing, filename, reset, navigate, documentTypeParam, methods]);
 
   const onSubmit: SubmitHandler<InvoiceFormData> = async (data) => {
@@ -103,6 +129,8 @@ export default function InvoiceEditorPage() {
       
       const result = await invoiceService.save(saveData);
       if (result.success) {
+         // Сохранённый номер занят самим КП
+         reservedNumberRef.current = null;
          setSavedFilename(result.filename);
          alert('КП успешно сохранено!');
          // Переход в режим просмотра сохраненного документа